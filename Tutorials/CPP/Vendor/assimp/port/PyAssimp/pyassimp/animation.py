@@ -0,0 +1,319 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Evaluation of skeletal (node) animations.
+
+The keyframes of an animation are copied once into contiguous arrays. All
+the channels are then evaluated together for a batch of timestamps, which
+makes it cheap to bake an animation or to stream thousands of poses:
+
+    from pyassimp import load
+    from pyassimp.animation import AnimationSampler
+
+    scene = load('walk.x')
+    sampler = AnimationSampler(scene, 0)
+    times = sampler.frame_times(fps = 30)
+    poses = sampler.pose(times)                 # (frames, nodes, 4, 4)
+    skins = sampler.skinning_matrices(scene.meshes[0], times)
+
+Times are expressed in seconds. Poses are float32 arrays ordered like
+scene.index.nodes. Outside of the keys of a channel, the first/last key is
+held (the pre- and post-states of the channels are not taken into account),
+unless loop = True in which case times wrap around the animation duration.
+
+Requires numpy.
+"""
+
+import ctypes
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import structs
+
+# ticks per second assumed when an animation does not specify it
+DEFAULT_TICKS_PER_SECOND = 25.
+
+def _contents(obj):
+    """ The struct behind a pythonized pointer (eager scenes) or struct (lazy scenes). """
+    return obj.contents if hasattr(obj, 'contents') else obj
+
+def _key_dtype(key_type, size):
+    return numpy.dtype({'names': ['time', 'value'],
+                        'formats': [numpy.float64, (numpy.float32, size)],
+                        'offsets': [key_type.mTime.offset, key_type.mValue.offset],
+                        'itemsize': ctypes.sizeof(key_type)})
+
+_vector_key = _key_dtype(structs.VectorKey, 3)
+_quat_key = _key_dtype(structs.QuatKey, 4)
+
+def _read_keys(pointer, length, dtype):
+    """ Copies an array of aiVectorKey/aiQuatKey into (times, values) arrays. """
+    if not length or not pointer:
+        return numpy.zeros(0), numpy.zeros((0, dtype['value'].shape[0]), dtype = numpy.float32)
+    raw = numpy.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctypes.c_ubyte)),
+                                   shape = (length * dtype.itemsize,))
+    keys = raw.view(dtype)
+    return keys['time'].copy(), keys['value'].copy()
+
+def decompose(matrix):
+    """
+    Decomposes a 4x4 transformation matrix into its (translation, rotation
+    quaternion (w, x, y, z), scaling) components.
+    """
+    matrix = numpy.asarray(matrix, dtype = numpy.float64)
+    translation = matrix[:3, 3].copy()
+    scaling = numpy.sqrt((matrix[:3, :3] ** 2).sum(axis = 0))
+    rotation = matrix[:3, :3] / numpy.where(scaling == 0, 1, scaling)
+    if numpy.linalg.det(rotation) < 0:
+        scaling[0] = -scaling[0]
+        rotation[:, 0] = -rotation[:, 0]
+    return translation, _matrix_to_quaternion(rotation), scaling
+
+def _matrix_to_quaternion(m):
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 0.5 / numpy.sqrt(trace + 1.)
+        q = [0.25 / s, (m[2, 1] - m[1, 2]) * s, (m[0, 2] - m[2, 0]) * s, (m[1, 0] - m[0, 1]) * s]
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2. * numpy.sqrt(1. + m[0, 0] - m[1, 1] - m[2, 2])
+        q = [(m[2, 1] - m[1, 2]) / s, 0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s]
+    elif m[1, 1] > m[2, 2]:
+        s = 2. * numpy.sqrt(1. + m[1, 1] - m[0, 0] - m[2, 2])
+        q = [(m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s]
+    else:
+        s = 2. * numpy.sqrt(1. + m[2, 2] - m[0, 0] - m[1, 1])
+        q = [(m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s]
+    return numpy.array(q)
+
+def compose(translations, rotations, scalings):
+    """
+    Builds (..., 4, 4) transformation matrices from arrays of translations
+    (..., 3), unit quaternions (..., 4) as (w, x, y, z) and scalings (..., 3),
+    as translation * rotation * scaling.
+    """
+    w, x, y, z = [rotations[..., i] for i in range(4)]
+    shape = translations.shape[:-1]
+    m = numpy.zeros(shape + (4, 4), dtype = translations.dtype)
+    m[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    m[..., 0, 1] = 2 * (x * y - w * z)
+    m[..., 0, 2] = 2 * (x * z + w * y)
+    m[..., 1, 0] = 2 * (x * y + w * z)
+    m[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    m[..., 1, 2] = 2 * (y * z - w * x)
+    m[..., 2, 0] = 2 * (x * z - w * y)
+    m[..., 2, 1] = 2 * (y * z + w * x)
+    m[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    m[..., :3, :3] *= scalings[..., numpy.newaxis, :]
+    m[..., :3, 3] = translations
+    m[..., 3, 3] = 1
+    return m
+
+def slerp(q0, q1, t):
+    """
+    Spherical linear interpolation between two arrays of unit quaternions
+    (..., 4), t being an array of interpolation factors (...).
+    """
+    dot = (q0 * q1).sum(axis = -1)
+    # take the shortest path
+    q1 = numpy.where((dot < 0)[..., numpy.newaxis], -q1, q1)
+    dot = numpy.abs(dot)
+
+    # fall back to a linear interpolation when the quaternions are close
+    close = dot > 0.9995
+    angle = numpy.arccos(numpy.clip(dot, -1, 1))
+    sin = numpy.sin(angle)
+    sin = numpy.where(close, 1, sin)
+    w0 = numpy.where(close, 1 - t, numpy.sin((1 - t) * angle) / sin)
+    w1 = numpy.where(close, t, numpy.sin(t * angle) / sin)
+
+    q = w0[..., numpy.newaxis] * q0 + w1[..., numpy.newaxis] * q1
+    return q / numpy.sqrt((q * q).sum(axis = -1))[..., numpy.newaxis]
+
+class _Track(object):
+    """
+    One kind of keys (positions, rotations or scalings) of all the
+    channels of an animation, concatenated in single arrays.
+
+    The key times of channel c are shifted by c * span, so that the keys
+    surrounding a (shifted) time are found for all the channels at once
+    with a single binary search on the whole array.
+    """
+    def __init__(self, keys, start, span):
+        self.span = span
+        self.start = start
+        self.offsets = numpy.cumsum([0] + [len(times) for times, _ in keys])
+        self.times = numpy.concatenate([times - start + c * span for c, (times, _) in enumerate(keys)])
+        self.values = numpy.concatenate([values for _, values in keys]).astype(numpy.float32)
+
+    def sample(self, times):
+        """
+        Returns the (frames, channels) indices of the keys preceding each time,
+        and the interpolation factors with the next keys.
+        """
+        channels = numpy.arange(len(self.offsets) - 1)
+        local = numpy.clip(times - self.start, 0, self.span * 0.5)
+        shifted = local[:, numpy.newaxis] + channels * self.span
+
+        first = self.offsets[:-1]
+        last = numpy.maximum(self.offsets[1:] - 2, first)
+        i = numpy.searchsorted(self.times, shifted, side = 'right') - 1
+        i = numpy.clip(i, first, last)
+
+        j = numpy.minimum(i + 1, self.offsets[1:] - 1)
+        dt = self.times[j] - self.times[i]
+        factor = numpy.where(dt > 0, (shifted - self.times[i]) / numpy.where(dt > 0, dt, 1), 0)
+        return i, j, numpy.clip(factor, 0, 1).astype(numpy.float32)
+
+    def lerp(self, times):
+        i, j, t = self.sample(times)
+        t = t[..., numpy.newaxis]
+        return self.values[i] * (1 - t) + self.values[j] * t
+
+    def slerp(self, times):
+        i, j, t = self.sample(times)
+        return slerp(self.values[i], self.values[j], t)
+
+
+class AnimationSampler(object):
+    """
+    Evaluates a node animation of a scene.
+
+    :param scene: a scene returned by pyassimp.load()
+    :param animation: an animation of the scene, or its index in scene.animations
+    :param loop: if True, times wrap around the duration of the animation.
+
+    Attributes
+    ----------
+    nodes:    the nodes of the scene (scene.index.nodes)
+    parents:  the position of the parent of each node (-1 for the root)
+    animated: the positions of the nodes driven by a channel
+    duration: duration of the animation, in seconds
+    """
+    def __init__(self, scene, animation = 0, loop = False):
+        if not isinstance(animation, int):
+            animation = list(scene.animations).index(animation)
+        self.animation = scene.animations[animation]
+        self.index = scene.index
+        self.flat = scene.flatten()
+        self.nodes = self.flat.nodes
+        self.parents = self.flat.parents
+        self.loop = loop
+
+        ticks = self.animation.tickspersecond or DEFAULT_TICKS_PER_SECOND
+        self.ticks_per_second = ticks
+        self.duration = self.animation.duration / ticks
+
+        # rest pose, used by the nodes (or the components of the
+        # channels) that are not animated
+        self.rest = self.flat.local.astype(numpy.float32)
+
+        positions, rotations, scalings, animated = [], [], [], []
+        for channel in self.animation.channels:
+            channel = _contents(channel)
+            name = channel.mNodeName.data.decode("utf-8")
+            node = self.index.find(name)
+            if node is None:
+                logger.debug("Animation channel " + name + " does not match any node")
+                continue
+            position = self.index.position(node)
+            animated.append(position)
+
+            rest = decompose(self.rest[position])
+            for keys, (pointer, length, dtype), default in (
+                    (positions, (channel.mPositionKeys, channel.mNumPositionKeys, _vector_key), rest[0]),
+                    (rotations, (channel.mRotationKeys, channel.mNumRotationKeys, _quat_key), rest[1]),
+                    (scalings, (channel.mScalingKeys, channel.mNumScalingKeys, _vector_key), rest[2])):
+                times, values = _read_keys(pointer, length, dtype)
+                if not len(times):
+                    times, values = numpy.zeros(1), default[numpy.newaxis]
+                keys.append((times, values))
+
+        self.animated = numpy.array(animated, dtype = numpy.intp)
+        if not animated:
+            self._tracks = None
+            return
+
+        all_times = numpy.concatenate([t for keys in (positions, rotations, scalings) for t, _ in keys])
+        start = min(0., all_times.min())
+        span = 2. * (max(all_times.max(), self.animation.duration) - start) + 1.
+        self._tracks = [_Track(keys, start, span) for keys in (positions, rotations, scalings)]
+
+    def frame_times(self, fps = 30.):
+        """ Times (in seconds) of the frames of the animation, sampled at 'fps'. """
+        count = max(int(numpy.floor(self.duration * fps + 1e-9)) + 1, 1)
+        return numpy.arange(count) / float(fps)
+
+    def _ticks(self, times):
+        times = numpy.atleast_1d(numpy.asarray(times, dtype = numpy.float64)) * self.ticks_per_second
+        if self.loop and self.animation.duration > 0:
+            times = numpy.mod(times, self.animation.duration)
+        return times
+
+    def local(self, times):
+        """
+        Returns the local transformations of all the nodes at the given
+        times (in seconds), as a (frames, nodes, 4, 4) float32 array.
+        """
+        ticks = self._ticks(times)
+        local = numpy.repeat(self.rest[numpy.newaxis], len(ticks), axis = 0)
+        if self._tracks is not None:
+            positions, rotations, scalings = self._tracks
+            local[:, self.animated] = compose(positions.lerp(ticks),
+                                              rotations.slerp(ticks),
+                                              scalings.lerp(ticks))
+        return local
+
+    def pose(self, times):
+        """
+        Returns the world transformations (relative to the scene, as in
+        scene.index.world) of all the nodes at the given times (in seconds),
+        as a (frames, nodes, 4, 4) float32 array.
+        """
+        world = self.local(times)
+        if self._tracks is None:
+            # not animated: the world transformations are those of the rest pose
+            return numpy.repeat(self.flat.world.astype(numpy.float32)[numpy.newaxis], len(world), axis = 0)
+        # compose a whole level of the hierarchy at once
+        for level in self.flat.levels[1:]:
+            world[:, level] = numpy.matmul(world[:, self.parents[level]], world[:, level])
+        return world
+
+    def skinning_matrices(self, mesh, times, node = None):
+        """
+        Returns the matrices that transform the vertices of a skinned mesh
+        from bind pose to their animated position, for each bone of the mesh
+        (in the order of mesh.bones), as a (frames, bones, 4, 4) array:
+
+            inverse(world(node)) * world(bone node) * bone.offsetmatrix
+
+        Bones without a matching node get identity matrices.
+
+        :param node: the node the mesh is attached to. By default, the first
+        node referencing the mesh.
+        """
+        if node is None:
+            node = self._mesh_node(mesh)
+        world = self.pose(times)
+        skins = numpy.zeros((len(world), len(mesh.bones), 4, 4), dtype = numpy.float32)
+        skins[:] = numpy.eye(4, dtype = numpy.float32)
+
+        bound = [i for i, bone in enumerate(mesh.bones) if bone.node is not None]
+        if not bound:
+            return skins
+        positions = [self.index.position(mesh.bones[i].node) for i in bound]
+        offsets = numpy.array([numpy.asarray(mesh.bones[i].offsetmatrix, dtype = numpy.float32) for i in bound])
+
+        bound_skins = numpy.matmul(world[:, positions], offsets)
+        if node is not None:
+            inverse = numpy.linalg.inv(world[:, self.index.position(node)])
+            bound_skins = numpy.matmul(inverse[:, numpy.newaxis], bound_skins)
+        skins[:, bound] = bound_skins
+        return skins
+
+    def _mesh_node(self, mesh):
+        for node in self.nodes:
+            if any(m is mesh for m in node.meshes):
+                return node
+        return None
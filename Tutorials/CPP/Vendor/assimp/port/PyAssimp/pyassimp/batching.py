@@ -0,0 +1,209 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Static batching of the meshes of a scene.
+
+Scenes often contain many small meshes sharing a few materials; drawing
+each of them separately costs one draw call (and one set of buffers) per
+mesh instance. batch_scene() merges all the mesh instances of the scene
+that share a material into a single interleaved vertex buffer and a single
+index buffer, with the world transformations of the nodes baked in:
+
+    from pyassimp import load
+    from pyassimp.batching import batch_scene
+
+    scene = load('city.obj')
+    for batch in batch_scene(scene):
+        # upload batch.vertices (GL_ARRAY_BUFFER) and batch.indices
+        # (GL_ELEMENT_ARRAY_BUFFER), then draw them with one call:
+        # glDrawElements(GL_TRIANGLES, len(batch.indices), GL_UNSIGNED_INT, None)
+        print(batch.material, len(batch.draws))
+
+Only triangles are batched (points and lines are skipped).
+
+interleave() packs the attributes of a single mesh the same way, in the
+coordinate system of the mesh, for meshes drawn with their own buffers.
+
+Requires numpy.
+"""
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+# per-vertex attributes that can be batched, with their number of components
+ATTRIBUTES = {"vertices": 3,
+              "normals": 3,
+              "texturecoords": 2, # first set of texture coordinates
+              "colors": 4,        # first set of vertex colors
+              "tangents": 3}
+
+DEFAULT_ATTRIBUTES = ("vertices", "normals", "texturecoords")
+
+class Batch(object):
+    """
+    The mesh instances of a scene sharing a material.
+
+    Attributes
+    ----------
+    material:      the material of the batch.
+    materialindex: its index in scene.materials.
+    vertices:      (V, components) float32 array of interleaved attributes.
+    layout:        list of (attribute, offset, size) tuples describing a row
+                   of 'vertices'; offset and size are in floats.
+    stride:        size of a row of 'vertices', in bytes.
+    indices:       flat uint32 array of triangle indices.
+    draws:         (instances, 2) uint32 array: the (first index, index count)
+                   of each mesh instance in 'indices'.
+    sources:       the (node, mesh) of each instance, in the order of 'draws'.
+    """
+    def __init__(self, material, materialindex, vertices, layout, indices, draws, sources):
+        self.material = material
+        self.materialindex = materialindex
+        self.vertices = vertices
+        self.layout = layout
+        self.stride = vertices.shape[1] * vertices.itemsize
+        self.indices = indices
+        self.draws = draws
+        self.sources = sources
+
+    def attribute(self, name):
+        """ Returns a (V, size) view on one attribute of the interleaved vertices. """
+        for attribute, offset, size in self.layout:
+            if attribute == name:
+                return self.vertices[:, offset:offset + size]
+        raise KeyError(name)
+
+    def ranges(self, mask):
+        """
+        The parts of 'indices' to draw for a subset of the instances (eg.
+        the visible ones), with consecutive instances merged into a single
+        range.
+
+        :param mask: (instances,) bool array, the instances to draw.
+        :returns: (ranges, 2) uint32 array of (first index, index count).
+        """
+        mask = numpy.asarray(mask, dtype = bool)
+        edges = numpy.diff(numpy.concatenate(([False], mask, [False])).astype(numpy.int8))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1) - 1
+        first = self.draws[starts, 0]
+        return numpy.stack((first, self.draws[ends, 0] + self.draws[ends, 1] - first), axis = 1).astype(numpy.uint32)
+
+    def __repr__(self):
+        return "Batch(%s: %d instances, %d vertices, %d triangles)" % (
+                getattr(self.material, "name", self.materialindex),
+                len(self.draws), len(self.vertices), len(self.indices) // 3)
+
+def _triangles(mesh):
+    """ The indices of the triangles of a mesh, as a (T, 3) array. """
+    offsets = numpy.asarray(mesh.faceoffsets)
+    indices = numpy.asarray(mesh.indices)
+    sizes = numpy.diff(offsets)
+    if len(sizes) and (sizes == 3).all():
+        return indices.reshape((-1, 3))
+    starts = offsets[:-1][sizes == 3]
+    if len(starts) < len(sizes):
+        logger.debug(str(mesh) + ": skipping " + str(len(sizes) - len(starts)) + " non-triangle faces")
+    return indices[starts[:, numpy.newaxis] + numpy.arange(3)]
+
+def _attribute(mesh, name, transformation, normal_matrix):
+    """ One attribute of a mesh, transformed to world space, or None. """
+    value = getattr(mesh, name, None)
+    if value is None or not len(value):
+        return None
+    if name == "vertices":
+        return numpy.dot(value, transformation[:3, :3].T) + transformation[:3, 3]
+    if name in ("normals", "tangents"):
+        # tangents follow the surface, normals stay orthogonal to it
+        directions = numpy.dot(value, (normal_matrix if name == "normals" else transformation[:3, :3]).T)
+        length = numpy.sqrt((directions ** 2).sum(axis = 1))[:, numpy.newaxis]
+        return directions / numpy.where(length > 0, length, 1)
+    # the first set of texture coordinates/colors
+    return numpy.asarray(value[0])[:, :ATTRIBUTES[name]]
+
+def _layout(attributes):
+    layout = []
+    offset = 0
+    for name in attributes:
+        layout.append((name, offset, ATTRIBUTES[name]))
+        offset += ATTRIBUTES[name]
+    return layout, offset
+
+def interleave(mesh, attributes = DEFAULT_ATTRIBUTES):
+    """
+    Packs the attributes of a mesh, in its own coordinate system, into a
+    single float32 array, ready for one vertex buffer. They are copied
+    once, straight from the arrays of the mesh.
+
+    :param attributes: the per-vertex attributes to interleave, among
+    ATTRIBUTES. Missing attributes are zeros.
+    :returns: a (vertices, layout) tuple, as Batch.vertices and Batch.layout.
+    """
+    layout, components = _layout(attributes)
+    vertices = numpy.zeros((len(mesh.vertices), components), dtype = numpy.float32)
+    for name, offset, size in layout:
+        value = getattr(mesh, name, None)
+        if value is None or not len(value):
+            continue
+        if name in ("texturecoords", "colors"):
+            value = value[0]
+        value = numpy.asarray(value)[:, :size]
+        vertices[:, offset:offset + value.shape[1]] = value
+    return vertices, layout
+
+def batch_scene(scene, attributes = DEFAULT_ATTRIBUTES):
+    """
+    Merges the mesh instances of a scene per material.
+
+    :param attributes: the per-vertex attributes to interleave, among
+    ATTRIBUTES. Meshes lacking an attribute get zeros.
+    :returns: a list of Batch, ordered by material index.
+    """
+    layout, components = _layout(attributes)
+
+    flat = scene.flatten()
+    instances = {}
+    for node, world in zip(flat.nodes, flat.world):
+        for mesh in node.meshes:
+            instances.setdefault(mesh.materialindex, []).append((node, mesh, world))
+
+    batches = []
+    for materialindex in sorted(instances):
+        sources = instances[materialindex]
+
+        blocks, triangles, draws = [], [], []
+        nb_vertices = nb_indices = 0
+        for node, mesh, world in sources:
+            tris = _triangles(mesh)
+            if numpy.linalg.det(world[:3, :3]) < 0:
+                # mirroring transformation: keep the faces front-facing
+                tris = tris[:, ::-1]
+            try:
+                normal_matrix = numpy.linalg.inv(world[:3, :3]).T
+            except numpy.linalg.LinAlgError:
+                normal_matrix = numpy.zeros((3, 3))
+
+            block = numpy.zeros((len(mesh.vertices), components), dtype = numpy.float32)
+            for name, offset, size in layout:
+                value = _attribute(mesh, name, world, normal_matrix)
+                if value is not None:
+                    block[:, offset:offset + value.shape[1]] = value
+
+            blocks.append(block)
+            triangles.append(tris.astype(numpy.uint32).ravel() + nb_vertices)
+            draws.append((nb_indices, tris.size))
+            nb_vertices += len(block)
+            nb_indices += tris.size
+
+        material = scene.materials[materialindex] if len(scene.materials) else None
+        batches.append(Batch(material,
+                             materialindex,
+                             numpy.concatenate(blocks) if blocks else numpy.zeros((0, components), dtype = numpy.float32),
+                             layout,
+                             numpy.concatenate(triangles).astype(numpy.uint32),
+                             numpy.array(draws, dtype = numpy.uint32).reshape((-1, 2)),
+                             [(node, mesh) for node, mesh, _ in sources]))
+
+    logger.debug("Batched %d mesh instances into %d batches" % (sum(len(b.draws) for b in batches), len(batches)))
+    return batches
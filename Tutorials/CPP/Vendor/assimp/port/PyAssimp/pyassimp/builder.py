@@ -0,0 +1,351 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Construction of Assimp scenes from numpy arrays, for export.
+
+SceneBuilder assembles an aiScene from vertex, normal, texture coordinate,
+color and face arrays plus a node hierarchy. The ctypes structs point
+directly at the buffers of the arrays (float32 and uint32 C-contiguous
+arrays are not copied), so exporting large generated meshes costs little
+more than the writing of the file:
+
+    import numpy
+    from pyassimp import export
+    from pyassimp.builder import SceneBuilder
+
+    builder = SceneBuilder()
+    material = builder.add_material(name = "ground", diffuse = (0.2, 0.6, 0.2, 1))
+    grid = builder.add_mesh(vertices, faces, normals = normals, material = material)
+    root = builder.add_node("root")
+    builder.add_node("terrain", parent = root, meshes = [grid])
+    export(builder.build(pythonize = False), "terrain.ply", "ply")
+
+The scene returned by build() keeps the arrays (and every struct it is
+made of) alive. It is owned by Python: it must not be released with
+pyassimp.release(). Changing the arrays after build() changes the scene.
+
+Requires numpy.
+"""
+
+import struct
+import ctypes
+from ctypes import POINTER
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import core
+from . import structs
+from .errors import AssimpError
+
+# aiPrimitiveType
+aiPrimitiveType_POINT = 0x1
+aiPrimitiveType_LINE = 0x2
+aiPrimitiveType_TRIANGLE = 0x4
+aiPrimitiveType_POLYGON = 0x8
+
+# the pyassimp structs omit some trailing members of their C counterparts
+# (aiNode::mMetaData, aiScene::mPrivate, aiMesh::mMethod): the structs
+# built here are followed by zeroed padding so that these read as NULL/0
+_PADDING = 64
+_padded_types = {}
+
+def _alloc(struct_type):
+    """ A zeroed, padded instance of struct_type. """
+    padded = _padded_types.get(struct_type)
+    if padded is None:
+        padded = _padded_types[struct_type] = type(struct_type.__name__, (struct_type,),
+                                                   {'_fields_': [('_padding', ctypes.c_byte * _PADDING)]})
+    return padded()
+
+def _pointer(obj, struct_type):
+    return ctypes.cast(ctypes.pointer(obj), POINTER(struct_type))
+
+def _string(value):
+    data = value.encode("utf-8") if not isinstance(value, bytes) else value
+    if len(data) >= structs.String.MAXLEN:
+        raise AssimpError("String too long: " + repr(value))
+    return structs.String(len(data), data)
+
+def _vectors(value, components, name):
+    """ value as a C-contiguous (N, components) float32 array, padded
+    with zeros if it has less components. Not copied if possible. """
+    value = numpy.asarray(value)
+    if value.ndim != 2 or value.shape[1] > components:
+        raise AssimpError("%s must be a (N, %d) array, got %s" % (name, components, value.shape))
+    if value.shape[1] < components:
+        padded = numpy.zeros((len(value), components), dtype = numpy.float32)
+        padded[:, :value.shape[1]] = value
+        return padded
+    return numpy.ascontiguousarray(value, dtype = numpy.float32)
+
+def _faces(faces):
+    """ (indices, sizes) of the faces: a flat uint32 index buffer (not
+    copied if possible) and the number of indices of each face. """
+    if isinstance(faces, numpy.ndarray) or (len(faces) and not hasattr(faces[0], '__len__')):
+        faces = numpy.asarray(faces)
+        if faces.ndim == 1:
+            faces = faces.reshape((-1, 3))
+        indices = numpy.ascontiguousarray(faces, dtype = numpy.uint32).reshape(-1)
+        sizes = numpy.full(len(faces), faces.shape[1], dtype = numpy.uint32)
+    else:
+        sizes = numpy.array([len(f) for f in faces], dtype = numpy.uint32)
+        indices = numpy.concatenate([numpy.asarray(f, dtype = numpy.uint32) for f in faces]) \
+                if len(faces) else numpy.zeros(0, dtype = numpy.uint32)
+    return indices, sizes
+
+def _property(key, value, semantic = 0, index = 0):
+    """ An aiMaterialProperty, and the buffer holding its value. """
+    if isinstance(value, bytes) or hasattr(value, "encode"):
+        data = value.encode("utf-8") if not isinstance(value, bytes) else value
+        # aiString layout with a 32 bits length (see structs.MaterialPropertyString)
+        data = struct.pack("<I", len(data)) + data + b"\0"
+        ptype = core.material.aiPTI_String
+    else:
+        value = numpy.atleast_1d(value)
+        if value.dtype.kind in "iub":
+            data, ptype = value.astype(numpy.int32).tobytes(), core.material.aiPTI_Integer
+        else:
+            data, ptype = value.astype(numpy.float32).tobytes(), core.material.aiPTI_Float
+    buffer = ctypes.create_string_buffer(data, len(data))
+
+    prop = _alloc(structs.MaterialProperty)
+    prop.mKey = _string(key)
+    prop.mSemantic = semantic
+    prop.mIndex = index
+    prop.mDataLength = len(data)
+    prop.mType = ptype
+    prop.mData = ctypes.cast(buffer, POINTER(ctypes.c_char))
+    return prop, buffer
+
+
+class SceneBuilder(object):
+    """
+    Assembles an aiScene from numpy arrays.
+
+    Materials, meshes and nodes are referred to by the indices returned
+    by add_material(), add_mesh() and add_node().
+    """
+    def __init__(self):
+        self.materials = []
+        self.meshes = []
+        # (name, parent, meshes, transformation) of each node
+        self.nodes = []
+        self._default_material = None
+        # arrays and ctypes objects the built scenes point to
+        self._buffers = []
+
+    def _keep(self, *objects):
+        self._buffers.extend(objects)
+
+    def add_material(self, name = "", diffuse = None, ambient = None, specular = None,
+                     emissive = None, transparent = None, reflective = None,
+                     shininess = None, opacity = None, textures = None, properties = None):
+        """
+        Adds a material. The arguments mirror the attributes of the
+        materials of loaded scenes (see core._set_material_properties).
+
+        :param textures: dict mapping texture types (pyassimp.material.aiTextureType_*)
+        to lists of texture paths.
+        :param properties: other properties, as a dict mapping full Assimp keys
+        ("$mat.refracti") or (key, semantic, index) tuples to strings, numbers
+        or sequences of numbers.
+        :returns: the index of the material.
+        """
+        props = [("?mat.name", name, 0, 0)]
+        for key, color in (("diffuse", diffuse), ("ambient", ambient), ("specular", specular),
+                           ("emissive", emissive), ("transparent", transparent), ("reflective", reflective)):
+            if color is not None:
+                props.append(("$clr." + key, numpy.asarray(color, dtype = numpy.float32), 0, 0))
+        if shininess is not None:
+            props.append(("$mat.shininess", float(shininess), 0, 0))
+        if opacity is not None:
+            props.append(("$mat.opacity", float(opacity), 0, 0))
+        for semantic, paths in sorted((textures or {}).items()):
+            props.extend(("$tex.file", path, semantic, index) for index, path in enumerate(paths))
+        for key, value in (properties or {}).items():
+            key, semantic, index = key if isinstance(key, tuple) else (key, 0, 0)
+            props.append((key, value, semantic, index))
+
+        material = _alloc(structs.Material)
+        pointers = (POINTER(structs.MaterialProperty) * len(props))()
+        for i, (key, value, semantic, index) in enumerate(props):
+            prop, buffer = _property(key, value, semantic, index)
+            pointers[i] = _pointer(prop, structs.MaterialProperty)
+            self._keep(prop, buffer)
+        material.mProperties = ctypes.cast(pointers, POINTER(POINTER(structs.MaterialProperty)))
+        material.mNumProperties = material.mNumAllocated = len(props)
+        self._keep(pointers)
+
+        self.materials.append(material)
+        return len(self.materials) - 1
+
+    def add_mesh(self, vertices, faces, normals = None, texturecoords = None, colors = None,
+                 tangents = None, bitangents = None, material = None, name = ""):
+        """
+        Adds a mesh.
+
+        :param vertices: (N, 3) positions.
+        :param faces: (F, k) array of vertex indices (a flat array is taken
+        as triangles), or a sequence of index sequences for faces of
+        different sizes.
+        :param normals, tangents, bitangents: (N, 3) arrays, or None.
+        :param texturecoords: a (N, 2) or (N, 3) array, or a list of them
+        (one per set of texture coordinates).
+        :param colors: a (N, 4) array, or a list of them.
+        :param material: index of the material of the mesh. A default
+        material is created for meshes without one.
+        :returns: the index of the mesh.
+        """
+        vertices = _vectors(vertices, 3, "vertices")
+        nb_vertices = len(vertices)
+
+        mesh = _alloc(structs.Mesh)
+        mesh.mName = _string(name)
+        mesh.mNumVertices = nb_vertices
+        mesh.mVertices = vertices.ctypes.data_as(POINTER(structs.Vector3D))
+        self._keep(vertices)
+
+        for field, value in (("mNormals", normals), ("mTangents", tangents), ("mBitangents", bitangents)):
+            if value is not None:
+                value = _vectors(value, 3, field[1:].lower())
+                if len(value) != nb_vertices:
+                    raise AssimpError("%s must have %d rows" % (field[1:].lower(), nb_vertices))
+                setattr(mesh, field, value.ctypes.data_as(POINTER(structs.Vector3D)))
+                self._keep(value)
+
+        if texturecoords is not None:
+            if isinstance(texturecoords, numpy.ndarray) and texturecoords.ndim == 2:
+                texturecoords = [texturecoords]
+            for i, uvs in enumerate(texturecoords):
+                uvs = numpy.asarray(uvs)
+                mesh.mNumUVComponents[i] = uvs.shape[-1]
+                uvs = _vectors(uvs, 3, "texturecoords")
+                mesh.mTextureCoords[i] = uvs.ctypes.data_as(POINTER(structs.Vector3D))
+                self._keep(uvs)
+
+        if colors is not None:
+            if isinstance(colors, numpy.ndarray) and colors.ndim == 2:
+                colors = [colors]
+            for i, rgba in enumerate(colors):
+                rgba = _vectors(rgba, 4, "colors")
+                mesh.mColors[i] = rgba.ctypes.data_as(POINTER(structs.Color4D))
+                self._keep(rgba)
+
+        indices, sizes = _faces(faces)
+        if len(indices) and indices.max() >= nb_vertices:
+            raise AssimpError("Face indices out of range (%d vertices)" % nb_vertices)
+        # the aiFace structs point into the flat index buffer
+        offsets = numpy.zeros(len(sizes), dtype = numpy.uintp)
+        numpy.cumsum(sizes[:-1], out = offsets[1:])
+        records = numpy.zeros(len(sizes), dtype = core._face_dtype())
+        records['count'] = sizes
+        records['address'] = indices.ctypes.data + offsets * indices.itemsize
+        mesh.mNumFaces = len(sizes)
+        mesh.mFaces = records.ctypes.data_as(POINTER(structs.Face))
+        self._keep(indices, records)
+
+        mesh.mPrimitiveTypes = 0
+        for size in numpy.unique(sizes).tolist():
+            mesh.mPrimitiveTypes |= {1: aiPrimitiveType_POINT,
+                                     2: aiPrimitiveType_LINE,
+                                     3: aiPrimitiveType_TRIANGLE}.get(size, aiPrimitiveType_POLYGON)
+
+        # resolved in build() if None
+        mesh._material = material
+        self.meshes.append(mesh)
+        return len(self.meshes) - 1
+
+    def add_node(self, name = "", parent = None, meshes = (), transformation = None):
+        """
+        Adds a node. The first node without parent is the root of the scene.
+
+        :param parent: index of the parent node.
+        :param meshes: indices of the meshes of the node.
+        :param transformation: 4x4 transformation relative to the parent.
+        :returns: the index of the node.
+        """
+        if parent is not None and not 0 <= parent < len(self.nodes):
+            raise AssimpError("Unknown parent node %r" % (parent,))
+        if parent is None and any(n[1] is None for n in self.nodes):
+            raise AssimpError("The scene already has a root node")
+        for m in meshes:
+            if not 0 <= m < len(self.meshes):
+                raise AssimpError("Unknown mesh %r" % (m,))
+        self.nodes.append((name, parent, list(meshes), transformation))
+        return len(self.nodes) - 1
+
+    def build(self, pythonize = True):
+        """
+        Builds the scene, to be passed to pyassimp.export(). Without
+        nodes, a root node holding all the meshes is created.
+
+        :param pythonize: if True, the scene has the same python attributes
+        as the scenes returned by pyassimp.load() (meshes, rootnode,
+        materials...). This reads the faces back: pass False to skip it
+        when the scene is only exported.
+        """
+        if not self.nodes:
+            self.add_node("root", meshes = range(len(self.meshes)))
+
+        needs_default = any(mesh._material is None for mesh in self.meshes) or not self.materials
+        if needs_default and self._default_material is None:
+            self._default_material = self.add_material(name = "DefaultMaterial", diffuse = (.6, .6, .6, 1.))
+        for mesh in self.meshes:
+            mesh.mMaterialIndex = self._default_material if mesh._material is None else mesh._material
+            if not 0 <= mesh.mMaterialIndex < len(self.materials):
+                raise AssimpError("Unknown material %r" % (mesh._material,))
+
+        nodes = [_alloc(structs.Node) for _ in self.nodes]
+        children = [[] for _ in self.nodes]
+        for i, (name, parent, meshes, transformation) in enumerate(self.nodes):
+            node = nodes[i]
+            node.mName = _string(name)
+            matrix = numpy.eye(4) if transformation is None else numpy.asarray(transformation)
+            node.mTransformation = structs.Matrix4x4(*matrix.astype(numpy.float32).ravel().tolist())
+            if parent is not None:
+                node.mParent = _pointer(nodes[parent], structs.Node)
+                children[parent].append(i)
+            if meshes:
+                indices = numpy.array(meshes, dtype = numpy.uint32)
+                node.mNumMeshes = len(indices)
+                node.mMeshes = indices.ctypes.data_as(POINTER(ctypes.c_uint))
+                self._keep(indices)
+        for node, kids in zip(nodes, children):
+            if kids:
+                pointers = (POINTER(structs.Node) * len(kids))(*[_pointer(nodes[k], structs.Node) for k in kids])
+                node.mNumChildren = len(kids)
+                node.mChildren = ctypes.cast(pointers, POINTER(POINTER(structs.Node)))
+                self._keep(pointers)
+        self._keep(*nodes)
+
+        # the meshes share their vertices, but the scene is not flagged
+        # AI_SCENE_FLAGS_NON_VERBOSE_FORMAT: the exporters would then unshare
+        # and join them again, which is slow and corrupts polygon meshes with
+        # some versions of Assimp
+        scene = _alloc(structs.Scene)
+        root = [i for i, n in enumerate(self.nodes) if n[1] is None][0]
+        scene.mRootNode = _pointer(nodes[root], structs.Node)
+
+        meshes = (POINTER(structs.Mesh) * len(self.meshes))(*[_pointer(m, structs.Mesh) for m in self.meshes])
+        scene.mNumMeshes = len(self.meshes)
+        scene.mMeshes = ctypes.cast(meshes, POINTER(POINTER(structs.Mesh)))
+        materials = (POINTER(structs.Material) * len(self.materials))(*[_pointer(m, structs.Material) for m in self.materials])
+        scene.mNumMaterials = len(self.materials)
+        scene.mMaterials = ctypes.cast(materials, POINTER(POINTER(structs.Material)))
+        self._keep(meshes, materials, *self.meshes + self.materials)
+
+        if pythonize:
+            scene = core._pythonize(scene, self)
+        # everything the scene points to lives as long as the scene
+        scene._builder = self
+        return scene
+
+def scene_from_arrays(vertices, faces, normals = None, texturecoords = None, colors = None, name = "mesh"):
+    """ A scene made of a single mesh, ready for pyassimp.export()
+    (not pythonized, see SceneBuilder.build()). """
+    builder = SceneBuilder()
+    builder.add_mesh(vertices, faces, normals = normals, texturecoords = texturecoords,
+                     colors = colors, name = name)
+    return builder.build(pythonize = False)
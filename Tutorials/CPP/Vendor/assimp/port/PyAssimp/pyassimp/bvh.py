@@ -0,0 +1,494 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Bounding volume hierarchy over the triangles of a scene, for ray queries
+(picking, visibility, collisions).
+
+build_scene() collects the triangles of all the mesh instances of a scene
+in world space and organizes them in a binary BVH, built top-down with the
+surface area heuristic (SAH). The build and the queries process all the
+nodes of a level, and all the rays of a packet, at once with numpy:
+
+    import numpy
+    from pyassimp import load
+    from pyassimp.bvh import build_scene
+
+    scene = load('city.obj')
+    bvh = build_scene(scene)
+    hits = bvh.intersect(origins, directions) # (R, 3) arrays
+    for ray in numpy.flatnonzero(hits.mask):
+        node = scene.index.nodes[hits.nodes[ray]]
+        print(node, hits.faces[ray], hits.points[ray])
+
+intersect() returns the nearest hit of each ray, occluded() only tells
+whether anything is hit before a maximal distance (shadow and visibility
+rays), which is cheaper. Triangles are tested with the Möller-Trumbore
+algorithm and are two-sided.
+
+BVH.write() and read() store a BVH as an (uncompressed) '.npz' file;
+SceneCache.load_bvh() keeps it next to a cached scene.
+
+Requires numpy.
+"""
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import core
+from .errors import AssimpError
+
+FORMAT_VERSION = 1
+
+DEFAULT_LEAF_SIZE = 4
+
+# nodes with more triangles are split even if the SAH advises against it
+MAX_LEAF_SIZE = 32
+
+# SAH cost of traversing a node, relative to intersecting a triangle
+TRAVERSAL_COST = 1.
+
+_EPSILON = 1e-12
+
+def _areas(lower, upper):
+    """ Half the surface area of boxes, 0 for empty boxes. """
+    extent = numpy.maximum(upper - lower, 0)
+    return extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0]
+
+def _ranges(starts, counts):
+    """ Concatenation of the ranges [start, start + count). """
+    total = int(counts.sum())
+    offsets = numpy.cumsum(counts) - counts
+    return numpy.arange(total) - numpy.repeat(offsets - starts, counts)
+
+class RayHits(object):
+    """
+    The result of BVH.intersect() for a packet of R rays.
+
+    Attributes
+    ----------
+    distances:    (R,) distance along each ray to its nearest hit (in
+                  units of the ray direction), inf if the ray missed.
+    triangles:    (R,) index of the triangle hit, -1 if the ray missed.
+    barycentrics: (R, 2) coordinates (u, v) of the hit in its triangle:
+                  point = (1 - u - v) * p0 + u * p1 + v * p2.
+    points:       (R, 3) world position of the hits (NaN if missed).
+    nodes, meshes, faces: (R,) the position of the node in scene.index.nodes,
+                  the index of the mesh in scene.meshes and the face of
+                  the mesh hit by each ray (-1 if missed), for BVHs built
+                  by build_scene(). None otherwise.
+    """
+    def __init__(self, distances, triangles, barycentrics, points, sources):
+        self.distances = distances
+        self.triangles = triangles
+        self.barycentrics = barycentrics
+        self.points = points
+        self.nodes = self.meshes = self.faces = None
+        if sources is not None:
+            self.nodes, self.meshes, self.faces = [numpy.where(self.mask, s[triangles] if len(s) else -1, -1)
+                                                   for s in sources]
+
+    @property
+    def mask(self):
+        """ (R,) bool array, True for the rays that hit a triangle. """
+        return self.triangles >= 0
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def __repr__(self):
+        return "RayHits(%d rays, %d hits)" % (len(self), self.mask.sum())
+
+class BVH(object):
+    """
+    A bounding volume hierarchy over triangles (see build() and build_scene()).
+
+    Node 0 is the root. The children of an inner node are stored next to
+    each other; the triangles of a leaf are contiguous.
+
+    Attributes
+    ----------
+    bounds:    (N, 2, 3) float32 array, the (min, max) corners of the box of
+               each node.
+    first:     (N,) int32 array: for inner nodes the index of the left child
+               (the right one follows it), for leaves the index of their
+               first triangle.
+    counts:    (N,) int32 array, the number of triangles of the leaves, 0 for
+               inner nodes.
+    triangles: (T, 3, 3) float32 array, the corners of the triangles in
+               leaf order.
+    ids:       (T,) int32 array, the index of each triangle of 'triangles'
+               in the input of build() (ids[i] is reported for a hit of
+               triangles[i]).
+    sources:   (nodes, meshes, faces) int32 arrays giving the origin of
+               each input triangle, for BVHs built by build_scene(), or None.
+    """
+    def __init__(self, bounds, first, counts, triangles, ids, sources = None):
+        self.bounds = bounds
+        self.first = first
+        self.counts = counts
+        self.triangles = triangles
+        self.ids = ids
+        self.sources = sources
+        # Möller-Trumbore works on the edges of the triangles
+        self._v0 = triangles[:, 0].astype(numpy.float64)
+        self._e1 = triangles[:, 1] - self._v0
+        self._e2 = triangles[:, 2] - self._v0
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def __repr__(self):
+        return "BVH(%d triangles, %d nodes, depth %d)" % (len(self), len(self.first), self.depth())
+
+    def depth(self):
+        """ The number of levels of the hierarchy. """
+        depth, level = 0, numpy.zeros(1 if len(self.first) else 0, dtype = numpy.intp)
+        while len(level):
+            depth += 1
+            inner = level[self.counts[level] == 0]
+            level = numpy.concatenate((self.first[inner], self.first[inner] + 1))
+        return depth
+
+    def _traverse(self, origins, directions, tmin, tmax, any_hit):
+        """
+        Breadth-first traversal of the hierarchy by all the rays at once:
+        the (ray, node) pairs whose boxes are hit are expanded to the
+        children of the nodes, or to their triangles for the leaves.
+        """
+        origins, directions, tmin, best = _rays(origins, directions, tmin, tmax)
+        nb_rays = len(origins)
+        hit = numpy.full(nb_rays, -1, dtype = numpy.intp)
+        uv = numpy.zeros((nb_rays, 2))
+        if not len(self.first) or not nb_rays:
+            return origins, directions, best, hit, uv
+
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            inverse = 1. / directions
+
+        rays = numpy.arange(nb_rays)
+        nodes = numpy.zeros(nb_rays, dtype = numpy.intp)
+        while len(rays):
+            # ray/box slab test of all the pairs
+            lower = self.bounds[nodes, 0]
+            upper = self.bounds[nodes, 1]
+            with numpy.errstate(invalid = 'ignore'):
+                t0 = (lower - origins[rays]) * inverse[rays]
+                t1 = (upper - origins[rays]) * inverse[rays]
+            near = numpy.fmax.reduce(numpy.fmin(t0, t1), axis = 1)
+            far = numpy.fmin.reduce(numpy.fmax(t0, t1), axis = 1)
+            keep = (near <= far) & (far >= tmin[rays]) & (near <= best[rays])
+            rays, nodes = rays[keep], nodes[keep]
+
+            leaves = self.counts[nodes] > 0
+            if leaves.any():
+                counts = self.counts[nodes[leaves]]
+                pair_rays = numpy.repeat(rays[leaves], counts)
+                pair_triangles = _ranges(self.first[nodes[leaves]], counts)
+                self._intersect(origins, directions, tmin, best, hit, uv, pair_rays, pair_triangles, any_hit)
+
+            inner = ~leaves
+            rays, nodes = rays[inner], nodes[inner]
+            if any_hit:
+                pending = hit[rays] < 0
+                rays, nodes = rays[pending], nodes[pending]
+            rays = numpy.concatenate((rays, rays))
+            nodes = numpy.concatenate((self.first[nodes], self.first[nodes] + 1))
+
+        return origins, directions, best, hit, uv
+
+    def _intersect(self, origins, directions, tmin, best, hit, uv, rays, triangles, any_hit):
+        """ Möller-Trumbore test of (ray, triangle) pairs; updates the nearest
+        hits (best, hit, uv) of the rays. """
+        valid, t, u, v = _moller_trumbore(origins[rays], directions[rays],
+                                          self._v0[triangles], self._e1[triangles], self._e2[triangles])
+        with numpy.errstate(invalid = 'ignore'):
+            valid &= (t >= tmin[rays]) & (t <= best[rays])
+        rays, triangles, t, u, v = rays[valid], triangles[valid], t[valid], u[valid], v[valid]
+        if not len(rays):
+            return
+
+        numpy.minimum.at(best, rays, t)
+        nearest = t == best[rays]
+        rays, triangles = rays[nearest], triangles[nearest]
+        hit[rays] = triangles
+        uv[rays, 0] = u[nearest]
+        uv[rays, 1] = v[nearest]
+
+    def intersect(self, origins, directions, tmin = 0., tmax = numpy.inf):
+        """
+        Nearest hit of a packet of rays.
+
+        :param origins, directions: (R, 3) arrays (or (3,) for one ray). The
+        directions do not need to be normalized: distances are expressed
+        in units of their length.
+        :param tmin, tmax: the part of the rays to consider (scalars or (R,) arrays).
+        :returns: a RayHits.
+        """
+        origins, directions, best, hit, uv = self._traverse(origins, directions, tmin, tmax, False)
+        missed = hit < 0
+        best[missed] = numpy.inf
+        with numpy.errstate(invalid = 'ignore'):
+            points = origins + directions * best[:, numpy.newaxis]
+        points[missed] = numpy.nan
+        triangles = numpy.where(missed, -1, self.ids[hit] if len(self.ids) else -1)
+        return RayHits(best, triangles, uv, points, self.sources)
+
+    def occluded(self, origins, directions, tmin = 0., tmax = numpy.inf):
+        """
+        Any-hit query: whether each ray hits a triangle between tmin and
+        tmax. The traversal of a ray stops at its first hit.
+
+        :returns: (R,) bool array.
+        """
+        return self._traverse(origins, directions, tmin, tmax, True)[3] >= 0
+
+    def write(self, path):
+        """ Stores the BVH in a '.npz' file (see read()). """
+        arrays = {"format": numpy.array(FORMAT_VERSION),
+                  "bounds": self.bounds,
+                  "first": self.first,
+                  "counts": self.counts,
+                  "triangles": self.triangles,
+                  "ids": self.ids}
+        if self.sources is not None:
+            arrays.update(zip(("nodes", "meshes", "faces"), self.sources))
+        with open(path, "wb") as f:
+            numpy.savez(f, **arrays)
+
+def read(path):
+    """ Reads a BVH stored by BVH.write(). Raises AssimpError if the file is
+    not a BVH of the current format. """
+    try:
+        with numpy.load(path) as data:
+            arrays = dict((name, data[name]) for name in data.files)
+    except (IOError, OSError, ValueError) as e:
+        raise AssimpError("Could not read BVH " + str(path) + ": " + str(e))
+    if arrays.get("format") != FORMAT_VERSION:
+        raise AssimpError("Unsupported BVH format in " + str(path))
+    sources = None
+    if "nodes" in arrays:
+        sources = (arrays["nodes"], arrays["meshes"], arrays["faces"])
+    return BVH(arrays["bounds"], arrays["first"], arrays["counts"], arrays["triangles"], arrays["ids"], sources)
+
+def _moller_trumbore(origins, directions, v0, e1, e2):
+    """
+    Möller-Trumbore test of (N, 3) rays against (N, 3) triangles, given by
+    a vertex and two edges. Returns (valid, t, u, v): whether each ray hits
+    its (two-sided) triangle, and the distance and barycentric coordinates
+    of the hit along the ray, undefined for the misses.
+    """
+    p = numpy.cross(directions, e2)
+    det = numpy.einsum('ij,ij->i', e1, p)
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        inv_det = 1. / det
+        s = origins - v0
+        u = numpy.einsum('ij,ij->i', s, p) * inv_det
+        q = numpy.cross(s, e1)
+        v = numpy.einsum('ij,ij->i', directions, q) * inv_det
+        t = numpy.einsum('ij,ij->i', e2, q) * inv_det
+        valid = (numpy.abs(det) > _EPSILON) & (u >= 0) & (v >= 0) & (u + v <= 1)
+    return valid, t, u, v
+
+def _rays(origins, directions, tmin, tmax):
+    origins = numpy.atleast_2d(numpy.asarray(origins, dtype = numpy.float64))
+    directions = numpy.atleast_2d(numpy.asarray(directions, dtype = numpy.float64))
+    origins, directions = numpy.broadcast_arrays(origins, directions)
+    if origins.ndim != 2 or origins.shape[1] != 3:
+        raise AssimpError("Rays must be given as (R, 3) arrays")
+    nb_rays = len(origins)
+    tmin = numpy.broadcast_to(numpy.asarray(tmin, dtype = numpy.float64), (nb_rays,))
+    tmax = numpy.array(numpy.broadcast_to(numpy.asarray(tmax, dtype = numpy.float64), (nb_rays,)))
+    return origins, directions, tmin, tmax
+
+def _sweep(boxes, shift, rank, counts, node_area):
+    """
+    SAH cost of splitting nodes after each of their triangles, sorted
+    along an axis: the triangles up to rank r (included) go to the left
+    child. The cost is relative to the cost of intersecting a triangle;
+    inf after the last triangle of each node.
+
+    :param boxes: (6, M) lower and upper corners of the triangles, grouped
+    by node.
+    :param shift: (M,) offset of the node of each triangle: the prefix and
+    suffix bounds of the nodes are computed in a single accumulate over all
+    the nodes by moving the nodes apart.
+    """
+    lower = boxes[:3]
+    upper = boxes[3:]
+    # the segments are shifted so that the accumulates restart at each node
+    left = numpy.maximum.accumulate(upper + shift, axis = 1) \
+            - numpy.minimum.accumulate(lower - shift, axis = 1) - 2 * shift
+    right = numpy.maximum.accumulate((upper - shift)[:, ::-1], axis = 1)[:, ::-1] \
+            - numpy.minimum.accumulate((lower + shift)[:, ::-1], axis = 1)[:, ::-1] + 2 * shift
+    left_area = _areas(0, left.T)
+    right_area = numpy.zeros_like(left_area)
+    right_area[:-1] = _areas(0, right[:, 1:].T)
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        cost = TRAVERSAL_COST + ((rank + 1) * left_area + (counts - rank - 1) * right_area) / node_area
+    cost[(rank == counts - 1) | ~numpy.isfinite(cost)] = numpy.inf
+    return cost
+
+def build(vertices, triangles, leaf_size = DEFAULT_LEAF_SIZE, sources = None):
+    """
+    Builds a BVH over triangles.
+
+    The nodes are split with the surface area heuristic, evaluated at every
+    triangle: each axis keeps the triangles sorted by centroid, and these
+    orders are partitioned (stably) from one level to the next.
+
+    :param vertices: (V, 3) array of positions.
+    :param triangles: (T, 3) array of vertex indices (or a flat array).
+    :param leaf_size: nodes with at most leaf_size triangles are not split.
+    :param sources: optional (nodes, meshes, faces) arrays describing the
+    triangles (see BVH.sources).
+    """
+    leaf_size = max(1, leaf_size)
+    vertices = numpy.asarray(vertices)
+    triangles = numpy.asarray(triangles).reshape((-1, 3))
+    corners = vertices[triangles].astype(numpy.float32)
+    nb_triangles = len(triangles)
+
+    if not nb_triangles:
+        empty = numpy.zeros(0, dtype = numpy.int32)
+        return BVH(numpy.zeros((0, 2, 3), dtype = numpy.float32), empty, empty,
+                   numpy.zeros((0, 3, 3), dtype = numpy.float32), empty, sources)
+
+    boxes = numpy.concatenate((corners.min(axis = 1), corners.max(axis = 1)), axis = 1).T
+    span = 2 * float((boxes[3:].max(axis = 1) - boxes[:3].min(axis = 1)).max()) + 1
+    # the triangles of the nodes being split, sorted by centroid along each
+    # axis (ids) with their boxes, grouped by node: the nodes of a level
+    # are contiguous ranges of these arrays, partitioned stably for the
+    # next level
+    ids = [numpy.argsort(boxes[axis] + boxes[axis + 3], kind = 'stable') for axis in range(3)]
+    sorted_boxes = [boxes[:, i] for i in ids]
+    right_side = numpy.zeros(nb_triangles, dtype = bool)
+    order = numpy.empty(nb_triangles, dtype = numpy.intp)
+
+    bounds, first, counts = [], [], []
+    level_starts = numpy.zeros(1, dtype = numpy.intp)
+    level_counts = numpy.full(1, nb_triangles, dtype = numpy.intp)
+    nb_nodes = 1
+    while len(level_starts):
+        nb_level = len(level_starts)
+        segment = numpy.repeat(numpy.arange(nb_level), level_counts)
+        offsets = numpy.cumsum(level_counts) - level_counts
+        rank = numpy.arange(len(segment)) - offsets[segment]
+
+        node_lower = numpy.minimum.reduceat(sorted_boxes[0][:3], offsets, axis = 1).T
+        node_upper = numpy.maximum.reduceat(sorted_boxes[0][3:], offsets, axis = 1).T
+        bounds.append(numpy.stack((node_lower, node_upper), axis = 1))
+
+        costs = numpy.full(nb_level, numpy.inf)
+        split_axis = numpy.zeros(nb_level, dtype = numpy.intp)
+        split_rank = numpy.zeros(nb_level, dtype = numpy.intp)
+        node_area = _areas(node_lower.astype(numpy.float64), node_upper)[segment]
+        shift = segment * span
+        segment_counts = level_counts[segment]
+        for axis, axis_boxes in enumerate(sorted_boxes):
+            cost = _sweep(axis_boxes, shift, rank, segment_counts, node_area)
+            best = numpy.minimum.reduceat(cost, offsets)
+            # the first triangle reaching the best cost of its node
+            reached = numpy.flatnonzero(cost == best[segment])
+            reached = reached[numpy.r_[True, segment[reached][1:] != segment[reached][:-1]]]
+            better = best[segment[reached]] < costs[segment[reached]]
+            nodes = segment[reached[better]]
+            costs[nodes] = best[nodes]
+            split_axis[nodes] = axis
+            split_rank[nodes] = rank[reached[better]]
+
+        split = (level_counts > leaf_size) & ((costs < level_counts) | (level_counts > MAX_LEAF_SIZE))
+        # large nodes the SAH would not split are cut in halves along the
+        # axis where their centroids spread the most
+        forced = split & ~(costs < level_counts)
+        if forced.any():
+            centroids = sorted_boxes[0][:3] + sorted_boxes[0][3:]
+            spread = (numpy.maximum.reduceat(centroids, offsets, axis = 1)
+                      - numpy.minimum.reduceat(centroids, offsets, axis = 1)).T
+            split_axis[forced] = spread[forced].argmax(axis = 1)
+            split_rank[forced] = level_counts[forced] // 2 - 1
+
+        moving = split[segment]
+        leaves = ~moving
+        order[level_starts[segment[leaves]] + rank[leaves]] = ids[0][leaves]
+        for axis, axis_ids in enumerate(ids):
+            chosen = moving & (split_axis[segment] == axis)
+            right_side[axis_ids[chosen]] = rank[chosen] > split_rank[segment[chosen]]
+
+        # stable partition of the split nodes, left children first
+        split_counts = numpy.where(split, level_counts, 0)
+        compacted = numpy.cumsum(split_counts) - split_counts
+        left_counts = None
+        for axis in range(3):
+            side = right_side[ids[axis]]
+            left = ~side & moving
+            before = numpy.cumsum(left) - left
+            left_rank = before - before[offsets][segment]
+            if left_counts is None:
+                left_counts = numpy.bincount(segment, weights = left, minlength = nb_level).astype(numpy.intp)
+            destination = (compacted[segment] + numpy.where(side, left_counts[segment] + rank - left_rank, left_rank))[moving]
+            axis_ids = numpy.empty(len(destination), dtype = numpy.intp)
+            axis_ids[destination] = ids[axis][moving]
+            axis_boxes = numpy.empty((6, len(destination)), dtype = numpy.float32)
+            axis_boxes[:, destination] = sorted_boxes[axis][:, moving]
+            ids[axis], sorted_boxes[axis] = axis_ids, axis_boxes
+
+        children = nb_nodes + 2 * numpy.arange(split.sum())
+        level_first = level_starts.copy()
+        level_first[split] = children
+        first.append(level_first)
+        counts.append(numpy.where(split, 0, level_counts))
+        nb_nodes += 2 * len(children)
+
+        parent_starts = level_starts[split]
+        left_counts = left_counts[split]
+        level_starts = numpy.stack((parent_starts, parent_starts + left_counts), axis = 1).ravel()
+        level_counts = numpy.stack((left_counts, level_counts[split] - left_counts), axis = 1).ravel()
+
+    # the levels list the nodes in index order
+    bvh = BVH(numpy.concatenate(bounds),
+              numpy.concatenate(first).astype(numpy.int32),
+              numpy.concatenate(counts).astype(numpy.int32),
+              corners[order],
+              order.astype(numpy.int32),
+              sources)
+    logger.debug("Built %r" % bvh)
+    return bvh
+
+def _triangle_faces(mesh):
+    """ The triangles of a mesh, as (face indices, (T, 3) vertex indices). """
+    offsets = numpy.asarray(mesh.faceoffsets)
+    indices = numpy.asarray(mesh.indices)
+    sizes = numpy.diff(offsets)
+    faces = numpy.flatnonzero(sizes == 3)
+    return faces, indices[offsets[faces][:, numpy.newaxis] + numpy.arange(3)]
+
+def build_scene(scene, leaf_size = DEFAULT_LEAF_SIZE):
+    """
+    Builds a BVH over the triangles of all the mesh instances of a scene,
+    in world space (faces that are not triangles are skipped). The hits
+    report the node, mesh and face of the triangles (see RayHits).
+
+    Works with the scenes of pyassimp.load() and of SceneCache.load().
+    """
+    flat = core.flatten(scene)
+    meshes = dict((id(m), i) for i, m in enumerate(scene.meshes))
+    vertices, triangles, nodes, mesh_ids, faces = [], [], [], [], []
+    nb_vertices = 0
+    for position, (node, world) in enumerate(zip(flat.nodes, flat.world)):
+        for mesh in node.meshes:
+            ids, tris = _triangle_faces(mesh)
+            if not len(ids):
+                continue
+            vertices.append(numpy.dot(mesh.vertices, world[:3, :3].T) + world[:3, 3])
+            triangles.append(tris + nb_vertices)
+            nodes.append(numpy.full(len(ids), position, dtype = numpy.int32))
+            mesh_ids.append(numpy.full(len(ids), meshes[id(mesh)], dtype = numpy.int32))
+            faces.append(ids.astype(numpy.int32))
+            nb_vertices += len(mesh.vertices)
+
+    if not triangles:
+        empty = numpy.zeros(0, dtype = numpy.int32)
+        return build(numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype = numpy.intp), leaf_size, (empty, empty, empty))
+    return build(numpy.concatenate(vertices), numpy.concatenate(triangles), leaf_size,
+                 (numpy.concatenate(nodes), numpy.concatenate(mesh_ids), numpy.concatenate(faces)))
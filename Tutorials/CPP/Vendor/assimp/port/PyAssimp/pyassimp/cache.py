@@ -0,0 +1,442 @@
+#-*- coding: UTF-8 -*-
+
+"""
+On-disk cache of converted scenes.
+
+Importing a large model with Assimp and converting it to Python takes
+time. SceneCache stores the result of a conversion (mesh arrays,
+materials and node hierarchy) keyed by the content of the file, the
+postprocessing flags and the version of the Assimp library, so that
+the next loads only have to memory-map the arrays back:
+
+    from pyassimp.cache import SceneCache
+
+    cache = SceneCache()
+    scene = cache.load('hello.3ds')
+    print(scene.meshes[0].vertices[0])
+
+Each entry is a directory holding a JSON header and one '.npy' file per
+array. The cache is bounded in size: the least recently used entries are
+evicted first.
+
+SceneCache.load_bvh() also stores the BVH of the scene (see pyassimp.bvh)
+in its entry.
+
+The cache can be inspected and purged from the command-line:
+
+    $ python -m pyassimp.cache list
+    $ python -m pyassimp.cache purge [key ...]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import base64
+import hashlib
+import tempfile
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import bvh
+from . import core
+from . import helper
+from . import lod
+from . import postprocess
+from .errors import AssimpError
+
+FORMAT_VERSION = 3
+
+DEFAULT_MAX_SIZE = 4 * 1024 ** 3 # 4GiB
+
+HEADER = "header.json"
+
+# per-vertex and per-face arrays of the meshes stored in the cache
+MESH_ARRAYS = ("vertices",
+               "normals",
+               "tangents",
+               "bitangents",
+               "colors",
+               "texturecoords",
+               "indices",
+               "faceoffsets")
+
+def default_directory():
+    """ The cache directory: 'scenes' in $PYASSIMP_CACHE_DIR or
+    ~/.cache/pyassimp, apart from the other files cached by pyassimp. """
+    return os.path.join(helper.cache_directory(), "scenes")
+
+def library_version():
+    dll = core._assimp_lib.dll
+    return "%d.%d.%d" % (dll.aiGetVersionMajor(), dll.aiGetVersionMinor(), dll.aiGetVersionRevision())
+
+def file_digest(filename, chunk_size = 1024 ** 2):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedObject(object):
+    """ Plain Python counterpart of a pyassimp struct, as read from the cache. """
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + getattr(self, "name", "") + ")"
+
+    def __str__(self):
+        return getattr(self, "name", "")
+
+class CachedScene(CachedObject):
+    flatten = core.flatten
+
+class CachedNode(CachedObject): pass
+class CachedMesh(CachedObject): pass
+class CachedMaterial(CachedObject): pass
+
+
+class SceneCache(object):
+    """
+    Content-addressed cache of converted scenes.
+
+    :param directory: where the entries are stored (see default_directory())
+    :param max_size: maximum size of the cache, in bytes
+    """
+    def __init__(self, directory = None, max_size = DEFAULT_MAX_SIZE):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+
+    def key(self, filename, processing = postprocess.aiProcess_Triangulate, lods = None):
+        """ The key of a file in the cache. It covers the content of the file,
+        the postprocessing flags, the levels of detail and the versions of
+        Assimp and of the cache format.
+        """
+        digest = hashlib.sha1()
+        digest.update(file_digest(filename).encode("ascii"))
+        digest.update(("%d/%s/%d" % (processing, library_version(), FORMAT_VERSION)).encode("ascii"))
+        if lods:
+            # generate_lods() sorts the ratios: their order does not matter
+            digest.update(("/lods:" + ",".join(repr(float(r)) for r in sorted(lods, reverse = True))).encode("ascii"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path(key), HEADER))
+
+    def load(self, filename, processing = postprocess.aiProcess_Triangulate, lods = None):
+        """
+        Load a model through the cache. On a miss, the model is imported
+        with pyassimp.load() and stored in the cache.
+
+        If 'lods' is a list of ratios, levels of detail are generated for
+        the triangle meshes (see pyassimp.lod.generate_lods()) and stored
+        with them: mesh.lods and mesh.loderrors are read back from the cache.
+
+        Returns a CachedScene. It mirrors the scenes returned by pyassimp.load()
+        (meshes, materials, rootnode, index) but does not need to be released.
+        Mesh arrays are read-only memory-mapped views on the cache files.
+        """
+        key = self.key(filename, processing, lods)
+        if key not in self:
+            logger.debug("Cache miss for " + filename)
+            scene = core.load(filename, processing = processing)
+            try:
+                if lods:
+                    for mesh in scene.meshes:
+                        if len(mesh.indices) and (numpy.diff(mesh.faceoffsets) == 3).all():
+                            lod.generate_lods(mesh, lods)
+                self.store(key, scene, source = filename, processing = processing)
+            finally:
+                core.release(scene, keep_arrays = False)
+            self.evict(keep = key)
+        return self.read(key)
+
+    def load_bvh(self, filename, processing = postprocess.aiProcess_Triangulate, leaf_size = bvh.DEFAULT_LEAF_SIZE):
+        """
+        The BVH of a model (see pyassimp.bvh.build_scene()), through the
+        cache. On a miss, it is built from the cached scene and stored in
+        the entry of the scene, so it is evicted with it.
+
+        The node indices of the hits refer to scene.index.nodes, for the
+        scene returned by load() with the same arguments.
+        """
+        scene = self.load(filename, processing)
+        key = self.key(filename, processing)
+        path = os.path.join(self.path(key), "bvh%d.npz" % leaf_size)
+        if os.path.exists(path):
+            return bvh.read(path)
+
+        logger.debug("Cache miss for the BVH of " + filename)
+        result = bvh.build_scene(scene, leaf_size)
+        fd, tmp = tempfile.mkstemp(prefix = ".tmp-", suffix = ".npz", dir = self.path(key))
+        os.close(fd)
+        try:
+            result.write(tmp)
+            os.rename(tmp, path)
+        except OSError:
+            # another process stored the same BVH in the meantime
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if not os.path.exists(path):
+                raise
+        self.evict(keep = key)
+        return result
+
+    def store(self, key, scene, source = None, processing = None):
+        """ Write a scene loaded by pyassimp.load() in the cache. """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp = tempfile.mkdtemp(prefix = ".tmp-", dir = self.directory)
+
+        try:
+            header = {"format": FORMAT_VERSION,
+                      "source": os.path.abspath(source) if source else None,
+                      "processing": processing,
+                      "created": time.time(),
+                      "meshes": [],
+                      "materials": [_encode_properties(m) for m in scene.materials],
+                      "nodes": []}
+
+            for i, mesh in enumerate(scene.meshes):
+                arrays = []
+                for name in MESH_ARRAYS:
+                    value = getattr(mesh, name, None)
+                    if value is None or not len(value):
+                        continue
+                    numpy.save(os.path.join(tmp, "mesh%d_%s.npy" % (i, name)), numpy.ascontiguousarray(value))
+                    arrays.append(name)
+
+                for j, indices in enumerate(getattr(mesh, "lods", [])):
+                    numpy.save(os.path.join(tmp, "mesh%d_lod%d.npy" % (i, j)), numpy.ascontiguousarray(indices))
+
+                header["meshes"].append({"name": mesh.name,
+                                         "materialindex": mesh.materialindex,
+                                         "primitivetypes": mesh.primitivetypes,
+                                         "numuvcomponents": [int(n) for n in mesh.numuvcomponents],
+                                         "arrays": arrays,
+                                         "loderrors": [float(e) for e in getattr(mesh, "loderrors", [])]})
+
+            meshes = dict((id(m), i) for i, m in enumerate(scene.meshes))
+            for node, parent in zip(scene.index.nodes, scene.index.parents):
+                header["nodes"].append({"name": node.name,
+                                        "parent": parent,
+                                        "transformation": numpy.asarray(node.transformation).ravel().tolist(),
+                                        "meshes": [meshes[id(m)] for m in node.meshes]})
+
+            with open(os.path.join(tmp, HEADER), "w") as f:
+                json.dump(header, f)
+
+            try:
+                os.rename(tmp, self.path(key))
+            except OSError:
+                # another process stored the same entry in the meantime
+                shutil.rmtree(tmp, ignore_errors = True)
+        except:
+            shutil.rmtree(tmp, ignore_errors = True)
+            raise
+
+    def read(self, key):
+        """ Read a scene from the cache. Raises AssimpError if it is not cached. """
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, HEADER)) as f:
+                header = json.load(f)
+        except (IOError, OSError, ValueError):
+            raise AssimpError("No (valid) cache entry " + key)
+
+        # record the access for the LRU eviction
+        os.utime(os.path.join(path, HEADER), None)
+
+        materials = []
+        for encoded in header["materials"]:
+            material = CachedMaterial()
+            core._set_material_properties(material, _decode_properties(encoded))
+            materials.append(material)
+
+        meshes = []
+        for i, desc in enumerate(header["meshes"]):
+            mesh = CachedMesh(name = desc["name"],
+                              materialindex = desc["materialindex"],
+                              primitivetypes = desc["primitivetypes"],
+                              numuvcomponents = numpy.array(desc["numuvcomponents"], dtype = numpy.uint32),
+                              material = materials[desc["materialindex"]] if materials else None)
+            for name in MESH_ARRAYS:
+                if name in desc["arrays"]:
+                    value = numpy.load(os.path.join(path, "mesh%d_%s.npy" % (i, name)), mmap_mode = "r")
+                else:
+                    value = numpy.zeros(0, dtype = numpy.uint32 if name in ("indices", "faceoffsets") else numpy.float32)
+                setattr(mesh, name, value)
+            mesh.loderrors = desc["loderrors"]
+            mesh.lods = [numpy.load(os.path.join(path, "mesh%d_lod%d.npy" % (i, j)), mmap_mode = "r")
+                         for j in range(len(mesh.loderrors))]
+            if len(mesh.faceoffsets):
+                mesh.faces = core._split_faces(mesh.indices, mesh.faceoffsets)
+            else:
+                mesh.faces = mesh.indices
+            meshes.append(mesh)
+
+        nodes = []
+        for desc in header["nodes"]:
+            parent = nodes[desc["parent"]] if desc["parent"] >= 0 else None
+            node = CachedNode(name = desc["name"],
+                              parent = parent,
+                              transformation = numpy.array(desc["transformation"]).reshape((4, 4)),
+                              meshes = [meshes[m] for m in desc["meshes"]],
+                              children = [])
+            if parent is not None:
+                parent.children.append(node)
+            nodes.append(node)
+
+        scene = CachedScene(name = key,
+                            meshes = meshes,
+                            materials = materials,
+                            rootnode = nodes[0],
+                            cameras = [],
+                            lights = [],
+                            textures = [],
+                            animations = [])
+        scene.rootnode.parent = scene
+        scene.index = core.SceneIndex(scene.rootnode)
+        return scene
+
+    def entries(self):
+        """
+        Returns the list of entries of the cache as (key, size in bytes,
+        last access time, source filename) tuples, most recently used first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        for key in os.listdir(self.directory):
+            header = os.path.join(self.path(key), HEADER)
+            if key.startswith(".") or not os.path.exists(header):
+                continue
+            try:
+                with open(header) as f:
+                    source = json.load(f).get("source")
+            except ValueError:
+                source = None
+            size = sum(os.path.getsize(os.path.join(self.path(key), f)) for f in os.listdir(self.path(key)))
+            entries.append((key, size, os.path.getmtime(header), source))
+
+        return sorted(entries, key = lambda e: e[2], reverse = True)
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def purge(self, keys = None):
+        """ Remove some entries (all of them by default) from the cache.
+
+        Only keys of existing entries are removed: returns the list of the
+        other keys, which are left alone.
+        """
+        existing = [e[0] for e in self.entries()]
+        if keys is None:
+            keys = existing
+        known = set(existing)
+        unknown = [key for key in keys if not _is_key(key) or key not in known]
+        for key in keys:
+            if key in unknown:
+                logger.warning("Not a cache entry: " + repr(key))
+                continue
+            shutil.rmtree(self.path(key), ignore_errors = True)
+        return unknown
+
+    def evict(self, keep = None):
+        """ Remove the least recently used entries until the cache
+        fits in max_size. The entry 'keep' is never evicted.
+        """
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        evicted = []
+        for key, size, _, _ in reversed(entries):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            logger.debug("Evicting " + key + " from the cache")
+            evicted.append(key)
+            total -= size
+        if evicted:
+            self.purge(evicted)
+
+
+def _is_key(key):
+    """ Whether key has the format of the keys of SceneCache.key() (a SHA-1
+    hex digest), and can not name anything outside of the cache directory. """
+    return len(key) == 40 and all(c in "0123456789abcdef" for c in key)
+
+def _encode_properties(material):
+    # the properties dict only keeps the last texture of each type
+    props = [(key, semantic, 0, value) for (key, semantic), value in dict.items(material.properties)
+             if key != "file"]
+    for semantic, paths in material.textures.items():
+        props.extend(("file", semantic, index, path) for index, path in enumerate(paths))
+
+    encoded = []
+    for key, semantic, index, value in props:
+        if isinstance(value, bytes):
+            value = {"bytes": base64.b64encode(value).decode("ascii")}
+        elif hasattr(value, "tolist"):
+            value = value.tolist()
+        encoded.append([key, semantic, index, value])
+    return encoded
+
+def _decode_properties(encoded):
+    props = []
+    for key, semantic, index, value in encoded:
+        if isinstance(value, dict):
+            value = base64.b64decode(value["bytes"])
+        elif isinstance(value, list):
+            value = numpy.array(value, dtype = numpy.int32 if all(isinstance(v, int) for v in value) else numpy.float32)
+        props.append((key, semantic, index, value))
+    return props
+
+
+def main(argv = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog = "python -m pyassimp.cache",
+                                     description = "Inspect and purge the pyassimp scene cache.")
+    parser.add_argument("--dir", default = None, help = "cache directory (default: %s)" % default_directory())
+    commands = parser.add_subparsers(dest = "command")
+    commands.add_parser("list", help = "list the entries, most recently used first")
+    purge = commands.add_parser("purge", help = "remove entries (all of them if no key is given)")
+    purge.add_argument("keys", nargs = "*")
+    trim = commands.add_parser("trim", help = "evict the least recently used entries")
+    trim.add_argument("max_size", type = int, help = "maximum size of the cache, in bytes")
+    args = parser.parse_args(argv)
+
+    cache = SceneCache(args.dir)
+
+    if args.command == "list":
+        entries = cache.entries()
+        for key, size, atime, source in entries:
+            print("%s %10.1fMB  %s  %s" % (key, size / 1024. ** 2,
+                                          time.strftime("%Y-%m-%d %H:%M", time.localtime(atime)),
+                                          source))
+        print("%d entries, %.1fMB in %s" % (len(entries), sum(e[1] for e in entries) / 1024. ** 2, cache.directory))
+    elif args.command == "purge":
+        unknown = cache.purge(args.keys or None)
+        for key in unknown:
+            sys.stderr.write("unknown cache key: %s\n" % key)
+        if unknown:
+            return 1
+    elif args.command == "trim":
+        cache.max_size = args.max_size
+        cache.evict()
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
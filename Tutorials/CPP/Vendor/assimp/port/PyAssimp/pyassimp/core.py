@@ -14,10 +14,15 @@ if sys.version_info >= (3,0):
     xrange = range
 
 import ctypes
+import mmap
 import os
+import struct
+import time
+import threading
+import weakref
 
-try: import numpy
-except: numpy = None
+try: _intern = sys.intern
+except AttributeError: _intern = intern
 
 import logging
 logger = logging.getLogger("pyassimp")
@@ -27,15 +32,27 @@ logger.addHandler(logging.NullHandler())
 
 from . import structs
 from . import helper
+# numpy is imported on first use, see helper.LazyModule
+from .helper import numpy
 from . import postprocess
+from . import material
 from .errors import AssimpError
 from .formats import available_formats
 
 class AssimpLib(object):
     """
     Assimp-Singleton
+
+    The library is searched for (see helper.search_library()) the first time
+    one of its functions is used, not when pyassimp is imported.
     """
-    load, load_mem, export, release, dll = helper.search_library()
+    _functions = ("load", "load_mem", "export", "release", "dll")
+
+    def __getattr__(self, name):
+        if name not in AssimpLib._functions:
+            raise AttributeError(name)
+        self.load, self.load_mem, self.export, self.release, self.dll = helper.search_library()
+        return getattr(self, name)
 _assimp_lib = AssimpLib()
 
 def make_tuple(ai_obj, type = None):
@@ -66,6 +83,81 @@ def make_tuple(ai_obj, type = None):
 
     return res
 
+def _tuple_layout(struct_type):
+    """
+    Returns the (ctypes scalar type, numpy shape) of one element of
+    a struct listed in structs.assimp_structs_as_tuple.
+    """
+    ctype = struct_type._fields_[0][1]
+    if struct_type is structs.Matrix4x4:
+        return ctype, (4, 4)
+    if struct_type is structs.Matrix3x3:
+        return ctype, (3, 3)
+    return ctype, (len(struct_type._fields_),)
+
+class _SceneMemory(object):
+    """
+    Owner of the memory Assimp allocated for an imported scene.
+
+    The scene and every numpy view on its memory (through their 'base')
+    reference it: the memory is freed once the scene has been released
+    (or garbage collected, with autorelease) and no view on it remains.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.releasable = False
+
+    def __del__(self):
+        if self.releasable and _assimp_lib is not None:
+            _assimp_lib.release(ctypes.c_void_p(self.address))
+
+class _View(object):
+    """ Exposes a block of memory to numpy (see _view()), keeping its
+    owner alive as long as the arrays viewing it. """
+    def __init__(self, address, shape, dtype, owner):
+        self.__array_interface__ = {'version': 3,
+                                    'data': (address, False),
+                                    'shape': tuple(shape),
+                                    'typestr': numpy.dtype(dtype).str}
+        self.owner = owner
+
+# the owner of the memory of the scene being converted, in each thread
+_conversion = threading.local()
+
+def _view(address, shape, dtype):
+    """
+    A numpy array on the memory at 'address', without copying it. The
+    array keeps the owner of the scene being converted alive.
+    """
+    return numpy.asarray(_View(address, shape, dtype, getattr(_conversion, 'owner', None)))
+
+def _view_owner(array):
+    """ The owner of the memory an array from _view() is on (following
+    the views taken on it), or None for arrays owning their data. """
+    while isinstance(array, numpy.ndarray):
+        array = array.base
+    return array.owner if isinstance(array, _View) else None
+
+def _converting(owner, function, *args):
+    """ Calls function(*args) with the views created meanwhile owned by 'owner'. """
+    previous = getattr(_conversion, 'owner', None)
+    _conversion.owner = owner
+    try:
+        return function(*args)
+    finally:
+        _conversion.owner = previous
+
+def _as_numpy(ptr, length):
+    """
+    Wraps a C array of 'length' tuple-like structs (aiVector3D, aiColor4D...)
+    as a numpy array, without copying.
+
+    The returned array is a view on Assimp's memory: it keeps the scene
+    being converted alive (see _SceneMemory).
+    """
+    ctype, shape = _tuple_layout(ptr._type_)
+    return _view(ctypes.cast(ptr, ctypes.c_void_p).value, (length,) + shape, ctype)
+
 # It is faster and more correct to have an init function for each assimp class
 def _init_face(aiFace):
     aiFace.indices = [aiFace.mIndices[i] for i in range(aiFace.mNumIndices)]
@@ -91,17 +183,59 @@ def _is_init_type(obj):
     return not (tname[:2] == 'c_' or tname == 'Structure' \
             or tname == 'POINTER') and not isinstance(obj,int)
                     
-def _init(self, target = None, parent = None):
+class _LazyStruct(object):
+    """
+    Mixin for the structs returned by load(..., lazy=True).
+
+    The pythonized attributes of the struct (see _init) are only computed
+    the first time one of them is accessed, and are then cached on the
+    instance. The sub-structs listed in _lazy_types are in turn wrapped
+    without being converted.
+    """
+    def __getattr__(self, name):
+        if name.startswith('_') or '_materialized' in vars(self):
+            raise AttributeError(name)
+        if '_released' in vars(self._scene):
+            raise AssimpError("Can not access '" + name + "': the scene has been released!")
+        self._materialized = True
+        _converting(vars(self._scene).get('_memory'), self._materialize)
+        return getattr(self, name)
+
+    def _materialize(self):
+        _init(self, parent = vars(self).get('_parent'), lazy = True)
+        _pythonize_lazy(self, self._scene)
+
+_lazy_types = dict((cls, type(cls.__name__, (_LazyStruct, cls), {}))
+                   for cls in (structs.Scene,
+                               structs.Node,
+                               structs.Mesh,
+                               structs.Material,
+                               structs.Animation))
+
+def _lazy_type(ptr_type):
+    """ Returns the lazy struct pointed to by ptr_type, or None. """
+    return _lazy_types.get(getattr(ptr_type, '_type_', None))
+
+def _wrap_lazy(ptr, parent):
+    obj = ctypes.cast(ptr, ctypes.POINTER(_lazy_type(type(ptr)))).contents
+    obj._parent = parent
+    obj._scene = parent._scene
+    return obj
+
+def _init(self, target = None, parent = None, lazy = False):
     """
     Custom initialize() for C structs, adds safely accessible member functionality.
 
     :param target: set the object which receive the added methods. Useful when manipulating
     pointers, to skip the intermediate 'contents' deferencing.
+    :param lazy: if True, sub-structs with a lazy counterpart (see _lazy_types)
+    are wrapped but not initialized.
     """
     if not target:
         target = self
     
-    dirself = dir(self) 
+    # process the name first: it is used by __str__ in the debug messages
+    dirself = sorted(dir(self), key = lambda m: m != 'mName')
     for m in dirself:
 
         if m.startswith("_"):
@@ -117,6 +251,9 @@ def _init(self, target = None, parent = None):
                 setattr(target, name, obj)
                 continue
 
+        if m == 'mFaces' and numpy and isinstance(self, structs.Mesh):
+            continue # read in bulk by _finalize_mesh
+
         if m == 'mName':
             obj = self.mName
             target.name = str(obj.data.decode("utf-8"))
@@ -148,7 +285,7 @@ def _init(self, target = None, parent = None):
                 # -> special case: properties are
                 # stored as a dict.
                 if m == 'mProperties':
-                    setattr(target, name, _get_properties(obj, length))
+                    _set_material_properties(target, _read_properties(obj, length))
                     continue
 
 
@@ -161,14 +298,17 @@ def _init(self, target = None, parent = None):
                 try:
                     if obj._type_ in structs.assimp_structs_as_tuple:
                         if numpy:
-                            setattr(target, name, numpy.array([make_tuple(obj[i]) for i in range(length)], dtype=numpy.float32))
+                            setattr(target, name, _as_numpy(obj, length))
 
-                            logger.debug(str(self) + ": Added an array of numpy arrays (type "+ str(type(obj)) + ") as self." + name)
+                            logger.debug(str(self) + ": Added a numpy view (type "+ str(type(obj)) + ") as self." + name)
                         else:
                             setattr(target, name, [make_tuple(obj[i]) for i in range(length)])
                             
                             logger.debug(str(self) + ": Added a list of lists (type "+ str(type(obj)) + ") as self." + name)
 
+                    elif lazy and _lazy_type(obj._type_):
+                        setattr(target, name, [_wrap_lazy(obj[i], target) for i in range(length)])
+
                     else:
                         setattr(target, name, [obj[i] for i in range(length)]) #TODO: maybe not necessary to recreate an array?
 
@@ -193,16 +333,13 @@ def _init(self, target = None, parent = None):
                 except ValueError as e:
                     
                     logger.error("In " + str(self) +  "->" + name + ": " + str(e) + ". Quitting now.")
-                    if "setting an array element with a sequence" in str(e):
-                        logger.error("Note that pyassimp does not currently "
-                                     "support meshes with mixed triangles "
-                                     "and quads. Try to load your mesh with"
-                                     " a post-processing to triangulate your"
-                                     " faces.")
                     raise e
                     
 
 
+            elif lazy and _lazy_type(type(obj)) and obj:
+                setattr(target, name, _wrap_lazy(obj, target))
+
             else: # starts with 'm' but not iterable
                 setattr(target, name, obj)
                 logger.debug("Added " + name + " as self." + name + " (type: " + str(type(obj)) + ")")
@@ -240,15 +377,10 @@ def pythonize_assimp(type, obj, scene):
         return meshes
 
     if type == "ADDTRANSFORMATION":
-        def getnode(node, name):
-            if node.name == name: return node
-            for child in node.children:
-                n = getnode(child, name)
-                if n: return n
-
-        node = getnode(scene.rootnode, obj.name)
+        node = scene.index.find(obj.name)
         if not node:
             raise AssimpError("Object " + str(obj) + " has no associated node!")
+        setattr(obj, "node", node)
         setattr(obj, "transformation", node.transformation)
 
 def recur_pythonize(node, scene):
@@ -260,22 +392,325 @@ def recur_pythonize(node, scene):
     node.meshes = pythonize_assimp("MESH", node.meshes, scene)
     for mesh in node.meshes:
         mesh.material = scene.materials[mesh.materialindex]
-    for cam in scene.cameras:
-        pythonize_assimp("ADDTRANSFORMATION", cam, scene)
     for c in node.children:
         recur_pythonize(c, scene)
 
-def load(filename, 
+def _pythonize_scene(scene):
+    '''
+    Attach cameras, lights and bones to their nodes, using scene.index.
+    '''
+    for cam in scene.cameras:
+        pythonize_assimp("ADDTRANSFORMATION", cam, scene)
+    for light in scene.lights:
+        # like bones, lights may have no node
+        light.node = scene.index.find(light.name)
+        if light.node is None:
+            logger.warning("Light " + str(light) + " has no associated node: using an identity transformation")
+            light.transformation = _identity()
+        else:
+            light.transformation = light.node.transformation
+
+def _pythonize_bones(mesh, scene):
+    for bone in mesh.bones:
+        bone.node = scene.index.find(bone.name)
+
+def _identity():
+    if numpy:
+        return numpy.identity(4)
+    return [[float(i == j) for j in range(4)] for i in range(4)]
+
+def _dot(a, b):
+    if numpy:
+        return numpy.dot(a, b)
+    return [[sum(x * y for x, y in zip(row, col)) for col in zip(*b)] for row in a]
+
+class SceneIndex(object):
+    '''
+    Lookup tables over the node hierarchy of a scene, built in a single
+    depth-first traversal when the scene is loaded (see scene.index).
+
+    Attributes
+    ----------
+    nodes:   every node of the scene, parents before their children.
+    parents: for each node, the position of its parent in 'nodes'
+             (-1 for the root node).
+    world:   for each node, its transformation relative to the
+             scene (ie, the product of the transformations of all
+             its ancestors and its own).
+    '''
+    def __init__(self, rootnode):
+        self.nodes = []
+        self.parents = []
+        self.world = []
+        self._byname = {}
+        self._positions = {}
+
+        stack = [(rootnode, -1)]
+        while stack:
+            node, parent = stack.pop()
+            position = len(self.nodes)
+
+            self.nodes.append(node)
+            self.parents.append(parent)
+            if parent < 0:
+                self.world.append(node.transformation)
+            else:
+                self.world.append(_dot(self.world[parent], node.transformation))
+            self._byname.setdefault(node.name, node)
+            self._positions[id(node)] = position
+
+            # reversed, so that children are visited in order
+            stack.extend((child, position) for child in reversed(node.children))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, name):
+        return name in self._byname
+
+    def __getitem__(self, name):
+        return self._byname[name]
+
+    def find(self, name):
+        '''
+        Returns the first node (in depth-first order) called 'name', or None.
+        '''
+        return self._byname.get(name)
+
+    def position(self, node):
+        '''
+        Returns the position of a node in self.nodes.
+        '''
+        try:
+            return self._positions[id(node)]
+        except KeyError:
+            raise AssimpError("Node " + str(node) + " does not belong to this scene!")
+
+    def parent(self, node):
+        '''
+        Returns the parent of a node, or None for the root node.
+        '''
+        parent = self.parents[self.position(node)]
+        return self.nodes[parent] if parent >= 0 else None
+
+    def world_transformation(self, node):
+        '''
+        Returns the transformation of a node relative to the scene.
+        '''
+        return self.world[self.position(node)]
+
+class FlatScene(object):
+    '''
+    The node hierarchy of a scene flattened into arrays, to compute the
+    world transformations of all the nodes in a few batched operations
+    (see flatten()). Requires numpy.
+
+    Attributes
+    ----------
+    nodes:   every node of the scene, parents before their children
+             (same order as scene.index.nodes).
+    parents: (N,) array, position of the parent of each node (-1 for the root).
+    levels:  the positions of the nodes, grouped by depth in the hierarchy.
+    local:   (N,4,4) array, the transformation of each node.
+    world:   (N,4,4) array, the transformation of each node relative to
+             the scene.
+    '''
+    def __init__(self, index):
+        self.nodes = index.nodes
+        self.parents = numpy.array(index.parents, dtype=numpy.intp)
+        self._index = index
+
+        n = len(self.nodes)
+        depth = numpy.zeros(n, dtype=numpy.intp)
+        # end of the subtree of each node: the nodes are in depth-first
+        # order, so the descendants of node i are the nodes i+1..end[i]-1
+        self._ends = numpy.arange(1, n + 1)
+        for i in xrange(1, n):
+            depth[i] = depth[self.parents[i]] + 1
+        for i in xrange(n - 1, 0, -1):
+            parent = self.parents[i]
+            self._ends[parent] = max(self._ends[parent], self._ends[i])
+        order = numpy.argsort(depth, kind='mergesort')
+        bounds = numpy.searchsorted(depth[order], numpy.arange(depth.max() + 2 if n else 1))
+        self.levels = [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+        self.local = numpy.array([numpy.asarray(node.transformation, dtype=numpy.float64) for node in self.nodes])
+        self.world = numpy.empty_like(self.local)
+        self._compute(numpy.ones(n, dtype=bool))
+
+    def position(self, node):
+        '''
+        Returns the position of a node in the arrays.
+        '''
+        return self._index.position(node)
+
+    def subtree(self, node):
+        '''
+        Returns the slice of the positions of a node and its descendants
+        (they are contiguous in the arrays).
+        '''
+        if not isinstance(node, (int, numpy.integer)):
+            node = self.position(node)
+        return slice(node, int(self._ends[node]))
+
+    def _compute(self, affected):
+        for depth, level in enumerate(self.levels):
+            level = level[affected[level]]
+            if not len(level):
+                continue
+            if depth == 0:
+                self.world[level] = self.local[level]
+            else:
+                self.world[level] = numpy.matmul(self.world[self.parents[level]], self.local[level])
+
+    def update(self, changed = None):
+        '''
+        Re-reads the transformation of some nodes and recomputes the world
+        transformations of these nodes and of their descendants only.
+
+        :param changed: nodes (or positions) whose transformation changed.
+        All the nodes by default.
+        '''
+        if changed is None:
+            changed = range(len(self.nodes))
+        affected = numpy.zeros(len(self.nodes), dtype=bool)
+        for i in changed:
+            if not isinstance(i, (int, numpy.integer)):
+                i = self.position(i)
+            self.local[i] = numpy.asarray(self.nodes[i].transformation, dtype=numpy.float64)
+            affected[self.subtree(i)] = True
+        self._compute(affected)
+
+    def set_transformation(self, node, transformation):
+        '''
+        Sets the transformation of a node and updates the world
+        transformations of its subtree.
+        '''
+        node.transformation = numpy.asarray(transformation, dtype=numpy.float64)
+        self.update([node])
+
+def flatten(scene):
+    '''
+    Returns the FlatScene of a scene. It is computed on the first call and
+    shared by the later ones (also available as scene.flatten()); call its
+    update() method after modifying transformations.
+    '''
+    if not numpy:
+        raise AssimpError("flatten() requires numpy")
+    flat = vars(scene).get('_flat')
+    if flat is None:
+        flat = scene._flat = FlatScene(scene.index)
+    return flat
+
+structs.Scene.flatten = flatten
+
+def _pythonize_lazy(obj, scene):
+    '''
+    Counterpart of recur_pythonize for lazy scenes, applied
+    to a single struct when it gets initialized.
+    '''
+    if isinstance(obj, structs.Node):
+        obj.meshes = pythonize_assimp("MESH", obj.meshes, scene)
+    elif isinstance(obj, structs.Mesh):
+        obj.material = scene.materials[obj.materialindex]
+        _pythonize_bones(obj, scene)
+    elif isinstance(obj, structs.Scene):
+        obj.index = SceneIndex(obj.rootnode)
+        _pythonize_scene(obj)
+
+def _is_buffer(obj):
+    # bytes are filenames: model data in bytes is passed as load(data = ...)
+    if isinstance(obj, (str, bytes)):
+        return False
+    try:
+        memoryview(obj)
+    except TypeError:
+        return False
+    return True
+
+def _file_buffer(fileobj):
+    '''
+    Returns the content of a file object, from its current position, as a
+    (data, mapping) pair. When possible, 'data' is a memoryview on the
+    content of the file (the buffer of a BytesIO or a memory-mapping of a
+    regular file) instead of a copy: the position of the file is then left
+    unchanged. 'mapping' is the mmap object to close after the import, if
+    any.
+    '''
+    position = fileobj.tell() if hasattr(fileobj, 'tell') else 0
+
+    if hasattr(fileobj, 'getbuffer'): # io.BytesIO
+        return fileobj.getbuffer()[position:], None
+
+    try:
+        mapping = mmap.mmap(fileobj.fileno(), 0, access = mmap.ACCESS_READ)
+    except Exception:
+        # not a regular file (pipe, socket, custom stream...)
+        return fileobj.read(), None
+    return memoryview(mapping)[position:], mapping
+
+def _load_buffer(data, processing, file_type):
+    '''
+    Imports a model from a buffer-protocol object (bytes, bytearray, mmap,
+    memoryview, numpy array...). Its memory is passed to
+    aiImportFileFromMemory without being copied, except for read-only,
+    non-bytes buffers when numpy is missing and for non-contiguous buffers.
+    '''
+    view = memoryview(data)
+    if view.ndim != 1 or view.itemsize != 1:
+        try:
+            view = view.cast('B')
+        except TypeError: # non contiguous
+            view = memoryview(view.tobytes())
+
+    pointer = None
+    try:
+        if not view.nbytes:
+            raise AssimpError('Can not import an empty buffer!')
+        if view.nbytes > 0xffffffff:
+            raise AssimpError('Buffers larger than 4GB can not be imported from memory!')
+
+        if isinstance(view.obj, bytes) and len(view.obj) == view.nbytes:
+            pointer = view.obj
+        elif not view.readonly:
+            pointer = (ctypes.c_char * view.nbytes).from_buffer(view)
+        elif numpy:
+            pointer = numpy.frombuffer(view, dtype = numpy.uint8).ctypes.data_as(ctypes.c_void_p)
+        else:
+            pointer = view.tobytes()
+
+        return _assimp_lib.load_mem(pointer,
+                                    view.nbytes,
+                                    processing,
+                                    file_type.encode("ascii"))
+    finally:
+        # let the caller close or resize the buffer, even on errors
+        del pointer
+        view.release()
+
+def load(filename = None,
          file_type  = None,
-         processing = postprocess.aiProcess_Triangulate):
+         processing = postprocess.aiProcess_Triangulate,
+         lazy       = False,
+         io_system  = None,
+         autorelease = False,
+         data       = None):
     '''
     Load a model into a scene. On failure throws AssimpError.
+
+    The scene must be released with release(), or used as a context
+    manager ('with load(filename) as scene:'), which releases it on exit.
     
     Arguments
     ---------
-    filename:   Either a filename or a file object to load model from.
-                If a file object is passed, file_type MUST be specified
+    filename:   Either a filename (str or bytes), a file object or a buffer
+                (bytearray, mmap, memoryview, numpy array...) to load model from.
+                If a file object or a buffer is passed, file_type MUST be specified
                 Otherwise Assimp has no idea which importer to use.
+                Buffers, BytesIO objects and regular files are passed to
+                Assimp without being copied. File objects are read from their
+                current position, and left at the end of the model once it is
+                loaded.
                 This is named 'filename' so as to not break legacy code. 
     processing: assimp postprocessing parameters. Verbose keywords are imported
                 from postprocessing, and the parameters can be combined bitwise to
@@ -284,13 +719,36 @@ def load(filename,
                 processing = (pyassimp.postprocess.aiProcess_Triangulate | 
                               pyassimp.postprocess.aiProcess_OptimizeMeshes)
     file_type:  string of file extension, such as 'stl'
+    lazy:       if True, the scene, its nodes, meshes, materials and animations
+                are only converted to Python when one of their attributes is
+                first accessed. Useful when only a part of the scene is needed
+                (for instance, the node hierarchy).
+    io_system:  a pyassimp.fileio.IOSystem through which Assimp reads
+                'filename' and the files it references (materials,
+                textures...), for instance from a stream or an archive.
+    autorelease: if True, the scene is released when it gets garbage
+                collected. Its meshes, textures... keep it alive, and the
+                numpy arrays taken from them keep its memory alive.
+                Otherwise a scene collected without being released is
+                reported as leaked (see live_scenes()).
+    data:       the model itself, as a buffer of any type (including bytes),
+                instead of 'filename'. file_type MUST be specified.
         
     Returns
     ---------
     Scene object with model data
     '''
     
-    if hasattr(filename, 'read'):
+    if data is not None:
+        if filename is not None:
+            raise AssimpError('Pass either a filename or data, not both!')
+        if file_type == None:
+            raise AssimpError('File type must be specified when passing data!')
+        model = _load_buffer(data, processing, file_type)
+    elif io_system is not None:
+        # Assimp reads the file (and the files it references) through io_system
+        model = io_system.import_file(_assimp_lib.dll, filename, processing)
+    elif hasattr(filename, 'read'):
         '''
         This is the case where a file object has been passed to load. 
         It is calling the following function:
@@ -301,21 +759,193 @@ def load(filename,
         '''
         if file_type == None:
             raise AssimpError('File type must be specified when passing file objects!')
-        data  = filename.read()
-        model = _assimp_lib.load_mem(data, 
-                                     len(data), 
-                                     processing, 
-                                     file_type)
+        content, mapping = _file_buffer(filename)
+        model = None
+        try:
+            model = _load_buffer(content, processing, file_type)
+        finally:
+            if isinstance(content, memoryview):
+                # the file was not read: move past the model
+                size = content.nbytes
+                content.release()
+                if model:
+                    filename.seek(size, os.SEEK_CUR)
+            if mapping is not None:
+                mapping.close()
+    elif _is_buffer(filename):
+        if file_type == None:
+            raise AssimpError('File type must be specified when passing buffers!')
+        model = _load_buffer(filename, processing, file_type)
     else:
         # a filename string has been passed
-        model = _assimp_lib.load(filename.encode("ascii"), processing)
+        path = filename if isinstance(filename, bytes) else filename.encode("ascii")
+        model = _assimp_lib.load(path, processing)
         
     if not model:
         raise AssimpError('Could not import file!')
-    scene = _init(model.contents)
+    memory = _SceneMemory(ctypes.addressof(model.contents))
+    if lazy:
+        scene = ctypes.cast(model, ctypes.POINTER(_lazy_types[structs.Scene])).contents
+        scene._scene = scene
+        scene._memory = memory
+    else:
+        scene = _pythonize(model.contents, memory)
+        scene._memory = memory
+    _register(scene, filename if data is None else "<%s>" % type(data).__name__, autorelease)
+    return scene
+
+def _pythonize(scene, owner = None):
+    '''
+    Adds the python attributes (meshes, rootnode...) to an aiScene struct.
+    The numpy views on the memory of the scene keep 'owner' alive.
+    '''
+    return _converting(owner, _pythonize_struct, scene)
+
+def _pythonize_struct(scene):
+    scene = _init(scene)
+    scene.index = SceneIndex(scene.rootnode)
     recur_pythonize(scene.rootnode, scene)
+    _pythonize_scene(scene)
+    for mesh in scene.meshes:
+        _pythonize_bones(mesh, scene)
     return scene
 
+class LoadResult(object):
+    '''
+    Outcome of the import of one file by load_many().
+
+    Attributes
+    ----------
+    filename: the imported file.
+    scene:    the loaded scene, if no callback was passed to load_many().
+              It must be released by the caller.
+    result:   the value returned by the callback, if any.
+    error:    the exception raised while importing the file (or in the
+              callback), None on success.
+    duration: time spent importing the file (and running the callback),
+              in seconds.
+    '''
+    def __init__(self, filename, scene = None, result = None, error = None, duration = 0.):
+        self.filename = filename
+        self.scene = scene
+        self.result = result
+        self.error = error
+        self.duration = duration
+
+    def __repr__(self):
+        status = "failed: " + str(self.error) if self.error is not None else "ok"
+        return "LoadResult(%s, %s, %.3fs)" % (self.filename, status, self.duration)
+
+def _load_one(filename, processing, callback):
+    start = time.time()
+    try:
+        scene = load(filename, processing = processing)
+        if callback is None:
+            return LoadResult(filename, scene = scene, duration = time.time() - start)
+        try:
+            result = callback(scene)
+        finally:
+            release(scene)
+        return LoadResult(filename, result = result, duration = time.time() - start)
+    except (Exception, AssimpError) as e:
+        logger.warning("Could not import " + str(filename) + ": " + str(e))
+        return LoadResult(filename, error = e, duration = time.time() - start)
+
+def load_many(filenames,
+              processing    = postprocess.aiProcess_Triangulate,
+              workers       = None,
+              backend       = "thread",
+              callback      = None,
+              max_in_flight = None):
+    '''
+    Load several models concurrently. Returns an iterator over LoadResult
+    objects, yielded in completion order. Import errors do not stop the
+    iteration: they are reported in LoadResult.error.
+
+    Arguments
+    ---------
+    filenames:     iterable of filenames to load.
+    processing:    assimp postprocessing parameters, see load().
+    workers:       number of concurrent imports. Defaults to the number of CPUs.
+    backend:       "thread" or "process".
+                   With "thread", Assimp imports run in parallel since ctypes
+                   releases the GIL while aiImportFile runs (the conversion to
+                   Python objects does not).
+                   With "process", files are imported in separate processes;
+                   a callback is required since scenes can not be sent back
+                   to the calling process.
+    callback:      function called in the worker with each loaded scene. Its
+                   return value is stored in LoadResult.result (it must be
+                   picklable with the "process" backend), and the scene is
+                   released right after it. Without callback, the scenes are
+                   returned in LoadResult.scene and must be released by the
+                   caller.
+    max_in_flight: maximum number of files being imported or waiting to be
+                   consumed at any time, to bound the memory used by loaded
+                   scenes. Defaults to 'workers'.
+    '''
+    try: from concurrent import futures
+    except ImportError:
+        raise AssimpError("load_many requires the concurrent.futures module!")
+
+    workers = workers or _cpu_count()
+    max_in_flight = max(max_in_flight or workers, 1)
+
+    if backend == "thread":
+        executor = futures.ThreadPoolExecutor(workers)
+    elif backend == "process":
+        if callback is None:
+            raise AssimpError("The 'process' backend of load_many needs a callback!")
+        executor = futures.ProcessPoolExecutor(workers)
+    else:
+        raise AssimpError("Unknown load_many backend: " + str(backend))
+
+    filenames = iter(filenames)
+    # submitted futures whose result has not been yielded yet -> filename
+    unconsumed = {}
+    try:
+        while True:
+            for filename in filenames:
+                unconsumed[executor.submit(_load_one, filename, processing, callback)] = filename
+                if len(unconsumed) >= max_in_flight:
+                    break
+            if not unconsumed:
+                break
+
+            done, _ = futures.wait(list(unconsumed), return_when = futures.FIRST_COMPLETED)
+            for future in done:
+                yield _future_result(future, unconsumed.pop(future))
+    finally:
+        # the iteration has been interrupted: do not leak the scenes
+        # that have been loaded but not consumed.
+        for future in unconsumed:
+            future.cancel()
+        executor.shutdown(wait = True)
+        for future, filename in unconsumed.items():
+            if not future.cancelled():
+                result = _future_result(future, filename)
+                if result.scene is not None:
+                    release(result.scene, keep_arrays = False)
+
+def _future_result(future, filename):
+    '''
+    The LoadResult of a future of load_many(). Failures of the executor
+    itself (eg. a callback result that can not be pickled by the process
+    backend) are reported in LoadResult.error too.
+    '''
+    try:
+        return future.result()
+    except (Exception, AssimpError) as e:
+        logger.warning("Could not import " + str(filename) + ": " + str(e))
+        return LoadResult(filename, error = e)
+
+def _cpu_count():
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
 def export(scene,
            filename, 
            file_type  = None,
@@ -343,14 +973,223 @@ def export(scene,
     if exportStatus != 0:
         raise AssimpError('Could not export scene!')
 
-def release(scene):
-    from ctypes import pointer
-    _assimp_lib.release(pointer(scene))
+def release(scene, keep_arrays=True):
+    '''
+    Release the memory allocated by Assimp for a scene.
+
+    The numpy arrays of the scene (mesh vertices, normals...) are views on
+    Assimp's memory, which is only freed once no view on it remains: the
+    arrays taken from the scene stay valid after release().
+
+    Arguments
+    ---------
+    scene:       scene returned by load().
+    keep_arrays: if True, the arrays stored on the meshes and textures are
+                 copied, so that the memory of the scene is freed right
+                 away (unless arrays taken from the scene remain). If
+                 False, they are not copied: the memory is freed once the
+                 meshes and textures are garbage collected.
+    '''
+    if getattr(scene, '_builder', None) is not None:
+        # built by pyassimp.builder: the memory belongs to Python
+        return
+    if '_released' in vars(scene):
+        logger.warning("The scene has already been released")
+        return
+    if keep_arrays and numpy:
+        for mesh in vars(scene).get('meshes', []):
+            _detach_arrays(mesh)
+        for texture in vars(scene).get('textures', []):
+            _detach_arrays(texture)
+    scene._released = True
+    _live_scenes.pop(ctypes.addressof(scene), None)
+    memory = vars(scene).pop('_memory')
+    memory.releasable = True
+
+def _scene_enter(scene):
+    return scene
+
+def _scene_exit(scene, *exc_info):
+    release(scene)
+
+structs.Scene.__enter__ = _scene_enter
+structs.Scene.__exit__ = _scene_exit
+
+def _assimp_memory(address):
+    info = structs.MemoryInfo()
+    _assimp_lib.dll.aiGetMemoryRequirements(ctypes.c_void_p(address), ctypes.byref(info))
+    return dict((name, getattr(info, name)) for name, _ in info._fields_)
+
+def _python_bytes(scene):
+    """
+    Size of the numpy arrays allocated by pyassimp for a scene (copies,
+    index buffers, caches...), without the views on Assimp's memory.
+    Only the attributes already computed are visited: lazy structs are
+    not converted.
+    """
+    if not numpy:
+        return 0
+    owners = set()
+    seen = set()
+    total = 0
+    stack = [scene]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, numpy.ndarray):
+            while isinstance(obj.base, numpy.ndarray):
+                obj = obj.base
+            if obj.flags.owndata and id(obj) not in owners:
+                owners.add(id(obj))
+                total += obj.nbytes
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+            stack.extend(v for k, v in vars(obj).items() if k != '_scene')
+    return total
+
+def memory_info(scene):
+    '''
+    Returns the memory used by a scene (also available as
+    scene.memory_info()), as a dict of byte counts: the fields of
+    structs.MemoryInfo computed by Assimp (textures, materials, meshes,
+    nodes, animations, cameras, lights and their total) and 'python', the
+    size of the numpy arrays pyassimp allocated for the scene. The scenes
+    made by pyassimp.builder only hold numpy arrays: Assimp reports 0.
+    '''
+    if '_released' in vars(scene):
+        raise AssimpError("The scene has been released!")
+    info = _assimp_memory(ctypes.addressof(scene))
+    info['python'] = _python_bytes(scene)
+    return info
+
+structs.Scene.memory_info = memory_info
+
+class SceneRecord(object):
+    '''
+    A scene loaded and not released yet (see live_scenes()).
+
+    Attributes
+    ----------
+    source:      the file the scene was loaded from.
+    loaded:      time of the import (time.time()).
+    address:     address of the aiScene.
+    autorelease: whether the scene is released when it gets garbage collected.
+    leaked:      True once the scene was garbage collected without being
+                 released: its Assimp memory can not be freed anymore.
+    '''
+    def __init__(self, source, address, autorelease):
+        self.source = source
+        self.loaded = time.time()
+        self.address = address
+        self.autorelease = autorelease
+        self.leaked = False
+        self._scene = None
+        self._memory = None
+
+    @property
+    def scene(self):
+        ''' The scene, None if it has been garbage collected. '''
+        return self._scene() if self._scene is not None else None
+
+    def memory_info(self):
+        ''' memory_info() of the scene ('python' is 0 once it leaked). '''
+        scene = self.scene
+        if scene is not None:
+            return memory_info(scene)
+        info = _assimp_memory(self.address)
+        info['python'] = 0
+        return info
+
+    def __repr__(self):
+        info = self.memory_info()
+        return "SceneRecord(%s, %d bytes%s)" % (self.source, info['total'] + info['python'],
+                                                ", leaked" if self.leaked else "")
+
+# aiScene address -> SceneRecord of the scenes returned by load() and not
+# released yet
+_live_scenes = {}
+
+def _source_name(source):
+    if hasattr(source, 'read') or _is_buffer(source):
+        return str(getattr(source, 'name', None) or "<%s>" % type(source).__name__)
+    if isinstance(source, bytes) and not isinstance(source, str):
+        return source.decode(sys.getfilesystemencoding(), 'replace')
+    return str(source)
+
+def _register(scene, source, autorelease):
+    address = ctypes.addressof(scene)
+    record = SceneRecord(_source_name(source), address, autorelease)
+    record._scene = weakref.ref(scene, lambda ref: _collected(address))
+    record._memory = scene._memory
+    _live_scenes[address] = record
+
+def _collected(address):
+    record = _live_scenes.get(address)
+    if record is None: # released
+        return
+    if not record.autorelease:
+        # the record keeps the memory alive: it can not be freed anymore
+        record.leaked = True
+        logger.warning("The scene loaded from " + record.source + " was garbage collected without being released: its memory leaked")
+        return
+    del _live_scenes[address]
+    # freed once the arrays taken from the scene are garbage collected too
+    record._memory.releasable = True
+    record._memory = None
+
+def live_scenes():
+    '''
+    Returns the SceneRecord of the scenes loaded by load() and not released
+    yet, in the order they were loaded. Scenes garbage collected without
+    being released (and without autorelease) stay listed as leaked.
+    '''
+    return sorted(_live_scenes.values(), key = lambda record: record.loaded)
+
+def _detach_arrays(target):
+    """
+    Replaces the numpy views stored on target by copies owning their data.
+
+    The faces of meshes are views on their index buffer: they are rebuilt
+    from the copy of the buffer rather than copied separately.
+    """
+    attributes = vars(target)
+    faces = 'indices' in attributes and 'faceoffsets' in attributes
+    for name, value in list(attributes.items()):
+        if faces and name == 'faces':
+            continue
+        if isinstance(value, numpy.ndarray) and not value.flags.owndata:
+            setattr(target, name, value.copy())
+    if faces:
+        target.faces = _split_faces(target.indices, target.faceoffsets)
 
 def _finalize_texture(tex, target):
+    """ Embedded textures are either compressed (mHeight == 0: pcData holds
+    mWidth bytes of a file whose format is given by achFormatHint) or
+    mHeight x mWidth BGRA texels.
+
+    With numpy, 'data' is a uint8 view on Assimp's memory: the raw file bytes
+    of compressed textures, a (height, width, 4) BGRA array otherwise.
+    """
     setattr(target, "achformathint", tex.achFormatHint)
-    if numpy:
-        data = numpy.array([make_tuple(getattr(tex, "pcData")[i]) for i in range(tex.mWidth * tex.mHeight)])
+    setattr(target, "formathint", tex.achFormatHint.decode("ascii", "replace"))
+    setattr(target, "compressed", tex.mHeight == 0)
+
+    if tex.mHeight == 0:
+        size, shape = tex.mWidth, (tex.mWidth,)
+    else:
+        size, shape = tex.mWidth * tex.mHeight * 4, (tex.mHeight, tex.mWidth, 4)
+
+    if not tex.pcData or not size:
+        data = numpy.zeros(0, dtype=numpy.uint8) if numpy else []
+    elif numpy:
+        data = _view(ctypes.cast(tex.pcData, ctypes.c_void_p).value, shape, numpy.uint8)
+    elif tex.mHeight == 0:
+        data = ctypes.string_at(tex.pcData, size)
     else:
         data = [make_tuple(getattr(tex, "pcData")[i]) for i in range(tex.mWidth * tex.mHeight)]
     setattr(target, "data", data)
@@ -370,8 +1209,7 @@ def _finalize_mesh(mesh, target):
         mAttr = getattr(mesh, name)
         if numpy:
             if mAttr:
-                data = numpy.array([make_tuple(getattr(mesh, name)[i]) for i in range(nb_vertices)], dtype=numpy.float32)
-                setattr(target, name[1:].lower(), data)
+                setattr(target, name[1:].lower(), _as_numpy(mAttr, nb_vertices))
             else:
                 setattr(target, name[1:].lower(), numpy.array([], dtype="float32"))
         else:
@@ -384,14 +1222,19 @@ def _finalize_mesh(mesh, target):
     def fillarray(name):
         mAttr = getattr(mesh, name)
 
-        data = []
-        for index, mSubAttr in enumerate(mAttr):
-            if mSubAttr:
-                data.append([make_tuple(getattr(mesh, name)[index][i]) for i in range(nb_vertices)])
-
         if numpy:
-            setattr(target, name[1:].lower(), numpy.array(data, dtype=numpy.float32))
+            data = [_as_numpy(mSubAttr, nb_vertices) for mSubAttr in mAttr if mSubAttr]
+            if len(data) == 1:
+                # single set (the common case): keep it a view
+                data = data[0][numpy.newaxis]
+            else:
+                data = numpy.array(data, dtype=numpy.float32)
+            setattr(target, name[1:].lower(), data)
         else:
+            data = []
+            for index, mSubAttr in enumerate(mAttr):
+                if mSubAttr:
+                    data.append([make_tuple(getattr(mesh, name)[index][i]) for i in range(nb_vertices)])
             setattr(target, name[1:].lower(), data)
 
     fill("mNormals")
@@ -403,11 +1246,179 @@ def _finalize_mesh(mesh, target):
     
     # prepare faces
     if numpy:
-        faces = numpy.array([f.indices for f in target.faces], dtype=numpy.int32)
+        indices, offsets = _read_faces(mesh)
+        setattr(target, 'indices', indices)
+        setattr(target, 'faceoffsets', offsets)
+        faces = _split_faces(indices, offsets)
     else:
         faces = [f.indices for f in target.faces]
     setattr(target, 'faces', faces)
 
+    # pack the bone weights
+    if numpy:
+        boneindices, boneweights = _pack_bone_weights(mesh)
+        setattr(target, 'boneindices', boneindices)
+        setattr(target, 'boneweights', boneweights)
+
+def _vertex_weights(bone):
+    """ The weights of a bone, as a structured numpy view (with 'vertex' and
+    'weight' fields) on Assimp's memory.
+    """
+    dtype = numpy.dtype({'names': ['vertex', 'weight'],
+                         'formats': [numpy.uint32, numpy.float32],
+                         'offsets': [structs.VertexWeight.mVertexId.offset,
+                                     structs.VertexWeight.mWeight.offset],
+                         'itemsize': ctypes.sizeof(structs.VertexWeight)})
+    return numpy.ctypeslib.as_array(ctypes.cast(bone.mWeights, ctypes.POINTER(ctypes.c_ubyte)),
+                                    shape=(bone.mNumWeights * dtype.itemsize,)).view(dtype)
+
+# maximum number of bones influencing a vertex in mesh.boneindices/boneweights
+MAX_BONE_INFLUENCES = 4
+
+def _pack_bone_weights(mesh, influences = MAX_BONE_INFLUENCES):
+    """ Reads the weights of all the bones of a mesh into fixed-width
+    (vertices, influences) arrays: the indices of the bones (in mesh.bones)
+    and their weights, sorted by decreasing weight.
+
+    Vertices influenced by more bones keep the largest weights, renormalized
+    to sum to 1. Unused slots have a bone index and a weight of 0. Meshes
+    without bones get empty (0, influences) arrays.
+    """
+    nb_vertices = mesh.mNumVertices if mesh.mNumBones else 0
+    indices = numpy.zeros((nb_vertices, influences), dtype=numpy.uint32)
+    weights = numpy.zeros((nb_vertices, influences), dtype=numpy.float32)
+    if not mesh.mNumBones:
+        return indices, weights
+
+    vertex, weight, bone = [], [], []
+    for i in range(mesh.mNumBones):
+        b = mesh.mBones[i].contents
+        if not b.mNumWeights:
+            continue
+        raw = _vertex_weights(b)
+        vertex.append(raw['vertex'])
+        weight.append(raw['weight'])
+        bone.append(numpy.full(b.mNumWeights, i, dtype=numpy.uint32))
+    if not vertex:
+        return indices, weights
+    vertex, weight, bone = numpy.concatenate(vertex), numpy.concatenate(weight), numpy.concatenate(bone)
+
+    # sort by vertex, then by decreasing weight, and rank the
+    # influences of each vertex
+    order = numpy.lexsort((-weight, vertex))
+    vertex, weight, bone = vertex[order], weight[order], bone[order]
+    starts = numpy.searchsorted(vertex, vertex)
+    rank = numpy.arange(len(vertex)) - starts
+
+    kept = rank < influences
+    indices[vertex[kept], rank[kept]] = bone[kept]
+    weights[vertex[kept], rank[kept]] = weight[kept]
+
+    if not kept.all():
+        logger.debug(str(mesh) + ": dropping " + str((~kept).sum()) + " bone weights beyond " + str(influences) + " per vertex")
+        truncated = numpy.unique(vertex[~kept])
+        weights[truncated] /= weights[truncated].sum(axis=1, keepdims=True)
+    return indices, weights
+
+def _split_faces(indices, offsets):
+    """ Builds the 'faces' of a mesh from its flat index buffer.
+
+    Meshes made of a single primitive type get a (faces, n) view
+    on the buffer, meshes mixing polygon sizes one array per face.
+    """
+    sizes = numpy.unique(numpy.diff(offsets))
+    if len(sizes) == 1 and not sizes[0]:
+        # faces without indices
+        return numpy.zeros((len(offsets) - 1, 0), dtype=indices.dtype)
+    elif len(sizes) == 1:
+        return indices.reshape((-1, int(sizes[0])))
+    elif len(sizes) == 0:
+        return indices
+    else:
+        return numpy.split(indices, offsets[1:-1])
+
+def _face_dtype():
+    return numpy.dtype({'names': ['count', 'address'],
+                        'formats': [numpy.uint32, numpy.uintp],
+                        'offsets': [structs.Face.mNumIndices.offset,
+                                    structs.Face.mIndices.offset],
+                        'itemsize': ctypes.sizeof(structs.Face)})
+
+def _face_blocks(mesh):
+    """ Groups the index arrays of the faces of a mesh into blocks of memory.
+
+    Each aiFace owns its own mIndices allocation. Allocations closer than a
+    memory page to each other are accessed as a single block (every byte in
+    between belongs to a page that is mapped), which lets us gather or
+    scatter all the indices with a few vectorized operations instead of one
+    Python operation per face.
+
+    Returns the offsets of the faces in the flat index buffer (see
+    _read_faces) and yields, for each block, a uint32 view on the block and
+    the positions of its indices in the block and in the flat buffer.
+    """
+    nb_faces = mesh.mNumFaces
+    offsets = numpy.zeros(nb_faces + 1, dtype=numpy.uint32)
+    if not nb_faces:
+        return offsets, []
+
+    raw = numpy.ctypeslib.as_array(ctypes.cast(mesh.mFaces, ctypes.POINTER(ctypes.c_ubyte)),
+                                   shape=(nb_faces * ctypes.sizeof(structs.Face),))
+    faces = raw.view(_face_dtype())
+    counts = faces['count'].astype(numpy.intp)
+    numpy.cumsum(counts, out=offsets[1:])
+
+    used = numpy.flatnonzero(counts)
+    if not len(used):
+        # only faces without indices
+        return offsets, []
+    order = numpy.argsort(faces['address'][used], kind='mergesort')
+    used = used[order]
+    starts = faces['address'][used].astype(numpy.intp)
+    counts = counts[used]
+    ends = starts + counts * ctypes.sizeof(ctypes.c_uint)
+
+    gaps = numpy.flatnonzero(starts[1:] - ends[:-1] >= mmap.PAGESIZE) + 1
+    bounds = numpy.concatenate(([0], gaps, [len(used)]))
+
+    def blocks():
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            base = int(starts[lo])
+            block = (ctypes.c_uint * ((int(ends[lo:hi].max()) - base) // ctypes.sizeof(ctypes.c_uint))).from_address(base)
+            block = numpy.ctypeslib.as_array(block)
+
+            n = counts[lo:hi]
+            within = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+            src = numpy.repeat((starts[lo:hi] - base) // ctypes.sizeof(ctypes.c_uint), n) + within
+            dst = numpy.repeat(offsets[used[lo:hi]].astype(numpy.intp), n) + within
+            yield block, src, dst
+
+    return offsets, blocks()
+
+def _read_faces(mesh):
+    """ Reads the indices of all the faces of a mesh at once.
+
+    Returns a (indices, offsets) pair: 'indices' is a flat uint32 buffer
+    holding the indices of every face one after the other (ready to be sent
+    to glBufferData for triangulated meshes) and face i is
+    indices[offsets[i]:offsets[i+1]].
+    """
+    offsets, blocks = _face_blocks(mesh)
+    indices = numpy.empty(offsets[-1], dtype=numpy.uint32)
+    for block, src, dst in blocks:
+        indices[dst] = block[src]
+    return indices, offsets
+
+def _write_faces(mesh, indices):
+    """ Writes a flat index buffer back into the faces of a mesh. The
+    number of indices of each face must be unchanged.
+    """
+    offsets, blocks = _face_blocks(mesh)
+    if offsets[-1] != len(indices):
+        raise AssimpError("Can not change the number of face indices of a mesh!")
+    for block, src, dst in blocks:
+        block[src] = indices[dst]
+
 
 class PropertyGetter(dict):
     def __getitem__(self, key):
@@ -429,37 +1440,114 @@ class PropertyGetter(dict):
             yield k[0], v
 
 
-def _get_properties(properties, length): 
+# raw property key -> parsed, interned key
+_property_keys = {}
+
+_property_dtypes = {material.aiPTI_Float: ('f', ctypes.c_float),
+                    material.aiPTI_Double: ('d', ctypes.c_double),
+                    material.aiPTI_Integer: ('i', ctypes.c_int)}
+
+# materials colors exposed as attributes
+_material_colors = ("diffuse", "ambient", "specular", "emissive", "transparent", "reflective")
+
+def _property_key(raw):
+    try:
+        return _property_keys[raw]
+    except KeyError:
+        key = raw.decode("utf-8").split('.')
+        # "$clr.diffuse" -> "diffuse", "$tex.blend.x" -> "blend" (as always)
+        key = _intern(str(key[1] if len(key) > 1 else key[0]))
+        _property_keys[raw] = key
+        return key
+
+def _read_properties(properties, length):
     """
-    Convenience Function to get the material properties as a dict
-    and values in a python format.
+    Reads the material properties as a list of (key, semantic, index, value)
+    tuples.
+
+    Numerical values are copied in one go from Assimp's buffers into numpy
+    arrays (or tuples when numpy is not available). Values made of a single
+    element are returned as scalars.
     """
-    result = {}
-    #read all properties
-    for p in [properties[i] for i in range(length)]:
-        #the name
-        p = p.contents
-        key = (str(p.mKey.data.decode("utf-8")).split('.')[1], p.mSemantic)
-
-        #the data
-        from ctypes import POINTER, cast, c_int, c_float, sizeof
-        if p.mType == 1:
-            arr = cast(p.mData, POINTER(c_float * int(p.mDataLength/sizeof(c_float)) )).contents
-            value = [x for x in arr]
-        elif p.mType == 3: #string can't be an array
-            value = cast(p.mData, POINTER(structs.MaterialPropertyString)).contents.data.decode("utf-8")
-        elif p.mType == 4:
-            arr = cast(p.mData, POINTER(c_int * int(p.mDataLength/sizeof(c_int)) )).contents
-            value = [x for x in arr]
+    result = []
+    if not length:
+        return result
+
+    key_offset = structs.MaterialProperty.mKey.offset
+    data_offset = structs.String.data.offset
+    addresses = ctypes.cast(properties, ctypes.POINTER(ctypes.c_void_p * length)).contents
+
+    for address in addresses:
+        p = structs.MaterialProperty.from_address(address)
+        key_length = ctypes.c_uint32.from_address(address + key_offset).value
+        key = _property_key(ctypes.string_at(address + key_offset + data_offset, key_length))
+        data = ctypes.cast(p.mData, ctypes.c_void_p).value
+
+        if p.mType in _property_dtypes:
+            code, ctype = _property_dtypes[p.mType]
+            count = p.mDataLength // ctypes.sizeof(ctype)
+            if numpy:
+                value = numpy.empty(count, dtype = code)
+                ctypes.memmove(value.ctypes.data, data, count * ctypes.sizeof(ctype))
+                if count == 1:
+                    value = value.item()
+            else:
+                value = struct.unpack('%d%s' % (count, code), ctypes.string_at(data, count * ctypes.sizeof(ctype)))
+                if count == 1:
+                    [value] = value
+                else:
+                    value = list(value)
+        elif p.mType == material.aiPTI_String: # string can't be an array
+            value = ctypes.string_at(data + 4, ctypes.c_uint32.from_address(data).value).decode("utf-8")
+            if len(value) == 1:
+                [value] = value
         else:
-            value = p.mData[:p.mDataLength]
+            value = ctypes.string_at(data, p.mDataLength)
+            if len(value) == 1:
+                [value] = value
+
+        result.append((key, p.mSemantic, p.mIndex, value))
 
-        if len(value) == 1:
-            [value] = value
+    return result
 
-        result[key] = value
+def _get_properties(properties, length): 
+    """
+    Convenience Function to get the material properties as a dict
+    and values in a python format.
+    """
+    return PropertyGetter(((key, semantic), value)
+                          for key, semantic, index, value in _read_properties(properties, length))
 
-    return PropertyGetter(result)
+def _set_material_properties(target, props):
+    """
+    Sets the properties of a material, as returned by _read_properties(),
+    on target, as a dict ('properties') and as typed attributes:
+
+     - name
+     - diffuse, ambient, specular, emissive, transparent, reflective:
+       RGBA colors (float32[4] with numpy), or None
+     - shininess, opacity: floats, or None
+     - textures: a dict mapping the texture types (see pyassimp.material)
+       to the list of the paths of the textures of that type
+    """
+    target.properties = PropertyGetter(((key, semantic), value)
+                                       for key, semantic, index, value in props)
+
+    target.name = target.properties.get(("name", 0), "")
+    for key in _material_colors:
+        color = target.properties.get((key, 0))
+        if color is not None:
+            color = list(color) + [1.] * (4 - len(color))
+            if numpy:
+                color = numpy.array(color[:4], dtype = numpy.float32)
+        setattr(target, key, color)
+    target.shininess = target.properties.get(("shininess", 0))
+    target.opacity = target.properties.get(("opacity", 0))
+
+    textures = {}
+    for key, semantic, index, value in sorted(p for p in props if p[0] == "file"):
+        textures.setdefault(semantic, []).append(value)
+    target.textures = textures
 
 def decompose_matrix(matrix):
     if not isinstance(matrix, structs.Matrix4x4):
@@ -0,0 +1,256 @@
+#-*- coding: UTF-8 -*-
+
+"""
+View-frustum culling of the nodes of a scene.
+
+FrustumCuller keeps the world-space bounding box of every node (of its own
+meshes, and of its whole subtree) and classifies them against the frustum
+of a camera, given by its projection·view matrix. The hierarchy is walked
+one level at a time, testing all the boxes of a level against the six
+planes at once; the subtrees entirely inside or outside the frustum are
+not tested further:
+
+    from pyassimp.culling import FrustumCuller
+
+    culler = FrustumCuller(scene)
+    result = culler.cull(numpy.dot(projection_matrix, view_matrix))
+    for node in result.visible_nodes():
+        draw(node)
+    print(result)  # statistics
+
+The boxes follow the world transformations of scene.flatten(): call
+update() after FlatScene.update() to take moved nodes into account
+(update(nodes) only refits the subtrees of the moved nodes).
+
+Requires numpy.
+"""
+
+import numpy
+
+from . import core
+from . import helper
+
+# classification of a box against a frustum
+OUTSIDE = 0
+INTERSECTING = 1
+INSIDE = 2
+
+def frustum_planes(matrix):
+    """
+    The planes of the frustum of a projection·view matrix (column vectors
+    convention, ie. not transposed for OpenGL).
+
+    :returns: a (6, 4) array of (a, b, c, d) planes, in the order left,
+    right, bottom, top, near, far. (a, b, c) is the unit normal, pointing
+    inside: the points p of the frustum satisfy a*x + b*y + c*z + d >= 0.
+    """
+    m = numpy.asarray(matrix, dtype = numpy.float64)
+    planes = numpy.array([m[3] + m[0], m[3] - m[0],
+                          m[3] + m[1], m[3] - m[1],
+                          m[3] + m[2], m[3] - m[2]])
+    return planes / numpy.sqrt((planes[:, :3] ** 2).sum(axis = 1))[:, numpy.newaxis]
+
+def classify_boxes(planes, lower, upper):
+    """
+    Classifies (K, 3) boxes against the planes of a frustum. Empty boxes
+    (lower > upper) are OUTSIDE.
+
+    :returns: (K,) int8 array of OUTSIDE, INTERSECTING or INSIDE.
+    """
+    empty = (lower > upper).any(axis = 1)
+    lower = numpy.where(empty[:, numpy.newaxis], 0, lower)
+    upper = numpy.where(empty[:, numpy.newaxis], 0, upper)
+
+    # signed distances of the centers to the planes, against the
+    # projections of the half extents on the normals
+    distances = numpy.dot((lower + upper) / 2, planes[:, :3].T) + planes[:, 3]
+    radii = numpy.dot((upper - lower) / 2, numpy.abs(planes[:, :3]).T)
+
+    result = numpy.full(len(lower), INTERSECTING, dtype = numpy.int8)
+    result[(distances >= radii).all(axis = 1)] = INSIDE
+    result[(distances < -radii).any(axis = 1) | empty] = OUTSIDE
+    return result
+
+class CullResult(object):
+    """
+    The nodes of a scene visible from a camera.
+
+    Attributes
+    ----------
+    visible:          (N,) bool array, for the nodes of scene.flatten():
+                      whether the meshes of the node must be drawn.
+    states:           (N,) int8 array, the classification of the subtree
+                      of each node (OUTSIDE, INTERSECTING or INSIDE). The
+                      subtrees of OUTSIDE nodes can be skipped altogether.
+    tested:           the number of boxes tested against the frustum.
+    nodes:            the number of nodes with meshes.
+    nodes_culled:     how many of them are not visible.
+    triangles:        the number of triangles of the mesh instances.
+    triangles_culled: how many of them are not visible.
+    """
+    def __init__(self, flat, visible, states, tested, triangles):
+        self._flat = flat
+        self.visible = visible
+        self.states = states
+        self.tested = tested
+        has_meshes = triangles >= 0
+        self.nodes = int(has_meshes.sum())
+        self.nodes_culled = int((has_meshes & ~visible).sum())
+        triangles = numpy.maximum(triangles, 0)
+        self.triangles = int(triangles.sum())
+        self.triangles_culled = int(triangles[~visible].sum())
+
+    def visible_nodes(self):
+        """ The nodes whose meshes must be drawn. """
+        return [self._flat.nodes[i] for i in numpy.flatnonzero(self.visible)]
+
+    def __repr__(self):
+        return "CullResult(%d/%d nodes culled, %d/%d triangles culled, %d boxes tested)" % (
+                self.nodes_culled, self.nodes, self.triangles_culled, self.triangles, self.tested)
+
+class FrustumCuller(object):
+    """
+    Hierarchical view-frustum culling of the nodes of a scene.
+
+    :param scene: a scene from pyassimp.load() or SceneCache.load().
+    :param flat: the FlatScene giving the world transformations of the
+    nodes (scene.flatten() by default).
+
+    Attributes
+    ----------
+    lower, upper:                 (N, 3) world-space bounding boxes of the
+                                  meshes of each node (empty without meshes).
+    subtree_lower, subtree_upper: (N, 3) world-space bounding boxes of the
+                                  meshes of each subtree.
+    triangles:                    (N,) number of triangles of the meshes of
+                                  each node, -1 for nodes without meshes.
+    """
+    def __init__(self, scene, flat = None):
+        self.flat = flat if flat is not None else core.flatten(scene)
+
+        positions, lower, upper = [], [], []
+        self.triangles = numpy.full(len(self.flat.nodes), -1, dtype = numpy.int64)
+        for position, node in enumerate(self.flat.nodes):
+            for mesh in node.meshes:
+                self.triangles[position] = max(self.triangles[position], 0) \
+                        + int((numpy.diff(numpy.asarray(mesh.faceoffsets)) == 3).sum())
+                box = helper.get_mesh_bounding_box(mesh)
+                if box is None:
+                    continue
+                positions.append(position)
+                lower.append(box[0])
+                upper.append(box[1])
+
+        # the mesh instances, and the corners of their boxes in local space
+        self._positions = numpy.array(positions, dtype = numpy.intp)
+        lower = numpy.array(lower, dtype = numpy.float64).reshape((-1, 3))
+        upper = numpy.array(upper, dtype = numpy.float64).reshape((-1, 3))
+        corners = numpy.array([[(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]], dtype = bool)
+        self._corners = numpy.where(corners, upper[:, numpy.newaxis], lower[:, numpy.newaxis])
+
+        # the depth of each node, and its children (CSR layout) to refit
+        # the ancestors of moved subtrees
+        n = len(self.flat.nodes)
+        self._depth = numpy.zeros(n, dtype = numpy.intp)
+        for depth, level in enumerate(self.flat.levels):
+            self._depth[level] = depth
+        self._children = numpy.argsort(self.flat.parents, kind = 'mergesort')[1:]
+        self._child_offsets = numpy.searchsorted(self.flat.parents[self._children], numpy.arange(n + 1))
+
+        self.update()
+
+    def _boxes(self, instances, nodes):
+        """ Recomputes the world-space boxes of the meshes of some nodes,
+        given the slice of their mesh instances. """
+        world = self.flat.world[self._positions[instances]]
+        corners = numpy.einsum('nij,nkj->nki', world[:, :3, :3], self._corners[instances]) + world[:, numpy.newaxis, :3, 3]
+        self.lower[nodes] = numpy.inf
+        self.upper[nodes] = -numpy.inf
+        numpy.minimum.at(self.lower, self._positions[instances], corners.min(axis = 1))
+        numpy.maximum.at(self.upper, self._positions[instances], corners.max(axis = 1))
+
+    def _refit(self, levels):
+        """ Recomputes the subtree boxes of groups of nodes, given from the
+        deepest up, from the boxes of their children. """
+        for level in levels:
+            parents = self.flat.parents[level]
+            numpy.minimum.at(self.subtree_lower, parents, self.subtree_lower[level])
+            numpy.maximum.at(self.subtree_upper, parents, self.subtree_upper[level])
+
+    def update(self, nodes = None):
+        """
+        Recomputes the world-space boxes, after the world transformations
+        of the FlatScene changed.
+
+        :param nodes: the nodes (or positions) whose transformation changed,
+        as passed to FlatScene.update(): only the boxes of their subtrees
+        and of their ancestors are recomputed. All the nodes by default.
+        """
+        if nodes is not None:
+            for node in nodes:
+                self._update_subtree(self.flat.subtree(node))
+            return
+
+        n = len(self.flat.nodes)
+        self.lower = numpy.empty((n, 3))
+        self.upper = numpy.empty((n, 3))
+        self._boxes(slice(None), slice(None))
+
+        # the subtrees, from the deepest level up
+        self.subtree_lower = self.lower.copy()
+        self.subtree_upper = self.upper.copy()
+        self._refit(reversed(self.flat.levels[1:]))
+
+    def _update_subtree(self, subtree):
+        # the mesh instances are sorted by node position
+        first, last = numpy.searchsorted(self._positions, (subtree.start, subtree.stop))
+        if first == last:
+            return # no meshes: no box changes
+        self._boxes(slice(first, last), subtree)
+
+        # the subtree, from its deepest level up
+        self.subtree_lower[subtree] = self.lower[subtree]
+        self.subtree_upper[subtree] = self.upper[subtree]
+        nodes = numpy.arange(subtree.start + 1, subtree.stop)
+        depth = self._depth[nodes]
+        order = numpy.argsort(-depth, kind = 'mergesort')
+        nodes = nodes[order]
+        self._refit(numpy.split(nodes, numpy.flatnonzero(numpy.diff(depth[order])) + 1))
+
+        # then its ancestors
+        node = self.flat.parents[subtree.start]
+        while node >= 0:
+            children = self._children[self._child_offsets[node]:self._child_offsets[node + 1]]
+            self.subtree_lower[node] = numpy.minimum(self.lower[node], self.subtree_lower[children].min(axis = 0))
+            self.subtree_upper[node] = numpy.maximum(self.upper[node], self.subtree_upper[children].max(axis = 0))
+            node = self.flat.parents[node]
+
+    def cull(self, matrix):
+        """
+        Classifies the nodes against the frustum of a projection·view
+        matrix (see frustum_planes()). Returns a CullResult.
+        """
+        planes = frustum_planes(matrix)
+        n = len(self.flat.nodes)
+        states = numpy.full(n, OUTSIDE, dtype = numpy.int8)
+        tested = 0
+
+        for depth, level in enumerate(self.flat.levels):
+            if depth:
+                # the children of the nodes entirely inside or outside
+                # inherit their state
+                states[level] = states[self.flat.parents[level]]
+                level = level[states[level] == INTERSECTING]
+            if len(level):
+                states[level] = classify_boxes(planes, self.subtree_lower[level], self.subtree_upper[level])
+                tested += len(level)
+
+        # the meshes of the nodes whose subtree is only partly visible
+        visible = states == INSIDE
+        partial = numpy.flatnonzero((states == INTERSECTING) & (self.triangles >= 0))
+        if len(partial):
+            visible[partial] = classify_boxes(planes, self.lower[partial], self.upper[partial]) != OUTSIDE
+            tested += len(partial)
+        visible &= self.triangles >= 0
+
+        return CullResult(self.flat, visible, states, tested, self.triangles)
@@ -0,0 +1,329 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Custom IO systems, to let Assimp read a model and the files it references
+(materials, textures, external buffers...) from Python file objects instead
+of the file system.
+
+An IOSystem is passed to pyassimp.load(); Assimp then calls back into it
+(through the aiFileIO/aiFile structures of cfileio.h) to open, read and seek
+each file, so the data is streamed chunk by chunk into Assimp's own buffers
+instead of being first read as a whole in Python:
+
+    from pyassimp import load
+    from pyassimp.fileio import ZipIOSystem
+
+    scene = load('models/spider.obj', io_system = ZipIOSystem('models.zip'))
+"""
+
+import io
+import ctypes
+import zipfile
+import posixpath
+from ctypes import POINTER, CFUNCTYPE, Structure, c_char_p, c_size_t, c_void_p, c_int
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import structs
+
+# aiReturn
+SUCCESS = 0
+FAILURE = -1
+
+# aiOrigin, matching the whence values of io
+SEEK_ORIGINS = {0: io.SEEK_SET, 1: io.SEEK_CUR, 2: io.SEEK_END}
+
+class File(Structure):
+    """
+    See 'cfileio.h' for details.
+    """
+    pass
+
+class FileIO(Structure):
+    """
+    See 'cfileio.h' for details.
+    """
+    pass
+
+# ctypes callbacks can not return pointers: the aiFile* are passed as addresses
+ReadProc = CFUNCTYPE(c_size_t, c_void_p, c_void_p, c_size_t, c_size_t)
+WriteProc = CFUNCTYPE(c_size_t, c_void_p, c_void_p, c_size_t, c_size_t)
+TellProc = CFUNCTYPE(c_size_t, c_void_p)
+SeekProc = CFUNCTYPE(c_int, c_void_p, c_size_t, c_int)
+FlushProc = CFUNCTYPE(None, c_void_p)
+OpenProc = CFUNCTYPE(c_void_p, c_void_p, c_char_p, c_char_p)
+CloseProc = CFUNCTYPE(None, c_void_p, c_void_p)
+
+File._fields_ = [
+            # Callback to read from a file
+            ("ReadProc", ReadProc),
+
+            # Callback to write to a file
+            ("WriteProc", WriteProc),
+
+            # Callback to retrieve the current position of the file cursor
+            ("TellProc", TellProc),
+
+            # Callback to retrieve the size of the file, in bytes
+            ("FileSizeProc", TellProc),
+
+            # Callback to set the current position of the file cursor
+            ("SeekProc", SeekProc),
+
+            # Callback to flush the file contents
+            ("FlushProc", FlushProc),
+
+            # User-defined, opaque data
+            ("UserData", c_void_p),
+        ]
+
+FileIO._fields_ = [
+            # Function used to open a new file
+            ("OpenProc", OpenProc),
+
+            # Function used to close an existing file
+            ("CloseProc", CloseProc),
+
+            # User-defined, opaque data
+            ("UserData", c_void_p),
+        ]
+
+
+class IOSystem(object):
+    """
+    Base class of the IO systems.
+
+    Subclasses implement open(path, mode), returning a binary file-like
+    object (with read(), and seek()/tell() when possible), or None if the
+    file does not exist. The file objects are closed by Assimp through
+    close() once it is done with them.
+
+    Non-seekable streams are buffered in memory on open, since most
+    importers need to know the size of the file and to seek in it.
+    """
+    def __init__(self):
+        # the callbacks must outlive the import: keep references to them
+        self._procs = dict(read = ReadProc(self._read),
+                           write = WriteProc(self._write),
+                           tell = TellProc(self._tell),
+                           size = TellProc(self._size),
+                           seek = SeekProc(self._seek),
+                           flush = FlushProc(self._flush),
+                           open = OpenProc(self._open),
+                           close = CloseProc(self._close))
+        self._fileio = FileIO(self._procs['open'], self._procs['close'], None)
+        # address of the aiFile struct -> (aiFile struct, file object, size)
+        self._files = {}
+
+    def open(self, path, mode):
+        raise NotImplementedError()
+
+    def close(self, fileobj):
+        fileobj.close()
+
+    def import_file(self, dll, filename, processing):
+        """ Imports 'filename' with aiImportFileEx, reading it through this IO system. """
+        dll.aiImportFileEx.restype = POINTER(structs.Scene)
+        try:
+            return dll.aiImportFileEx(filename.encode("utf-8"), processing, ctypes.byref(self._fileio))
+        finally:
+            # importers failing midway may not close all their files
+            for file, fileobj, _ in list(self._files.values()):
+                self.close(fileobj)
+            self._files.clear()
+
+    def _fileobj(self, file):
+        return self._files[file][1]
+
+    def _open(self, fileio, path, mode):
+        path = path.decode("utf-8")
+        mode = mode.decode("ascii")
+        try:
+            fileobj = self.open(path, mode)
+        except (IOError, OSError) as e:
+            logger.debug("Could not open " + path + ": " + str(e))
+            fileobj = None
+        if fileobj is None:
+            return None
+
+        if not _seekable(fileobj):
+            fileobj = io.BytesIO(fileobj.read())
+        position = fileobj.tell()
+        size = fileobj.seek(0, io.SEEK_END)
+        if size is None: # python 2 file objects
+            size = fileobj.tell()
+        fileobj.seek(position)
+
+        file = File(self._procs['read'],
+                    self._procs['write'],
+                    self._procs['tell'],
+                    self._procs['size'],
+                    self._procs['seek'],
+                    self._procs['flush'],
+                    None)
+        self._files[ctypes.addressof(file)] = (file, fileobj, size)
+        return ctypes.addressof(file)
+
+    def _close(self, fileio, file):
+        file, fileobj, _ = self._files.pop(file)
+        self.close(fileobj)
+
+    def _read(self, file, buffer, size, count):
+        fileobj = self._fileobj(file)
+        if not size or not count:
+            return 0
+        view = memoryview((ctypes.c_char * (size * count)).from_address(buffer)).cast('B')
+        total = 0
+        try:
+            # read straight into Assimp's buffer
+            while total < len(view):
+                if hasattr(fileobj, 'readinto'):
+                    n = fileobj.readinto(view[total:])
+                else:
+                    data = fileobj.read(len(view) - total)
+                    n = len(data)
+                    view[total:total + n] = data
+                if not n:
+                    break
+                total += n
+        except Exception as e:
+            logger.error("Error while reading: " + str(e))
+        return total // size
+
+    def _write(self, file, buffer, size, count):
+        fileobj = self._fileobj(file)
+        try:
+            fileobj.write(ctypes.string_at(buffer, size * count))
+        except Exception as e:
+            logger.error("Error while writing: " + str(e))
+            return 0
+        return count
+
+    def _tell(self, file):
+        return self._fileobj(file).tell()
+
+    def _size(self, file):
+        return self._files[file][2]
+
+    def _seek(self, file, offset, origin):
+        # offsets relative to the current position or the end of
+        # the file may be negative
+        offset = ctypes.c_ssize_t(offset).value
+        try:
+            self._fileobj(file).seek(offset, SEEK_ORIGINS[origin])
+        except Exception as e:
+            logger.debug("Could not seek: " + str(e))
+            return FAILURE
+        return SUCCESS
+
+    def _flush(self, file):
+        fileobj = self._fileobj(file)
+        if hasattr(fileobj, 'flush'):
+            fileobj.flush()
+
+def _seekable(fileobj):
+    if hasattr(fileobj, 'seekable'):
+        try:
+            return fileobj.seekable()
+        except Exception:
+            return False
+    return hasattr(fileobj, 'seek') and hasattr(fileobj, 'tell')
+
+
+class _View(object):
+    """
+    Read-only file object on a shared stream, with its own position.
+    Lets the same stream be opened several times by an importer.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.stream.seek(0, io.SEEK_END)
+        if offset < 0:
+            raise IOError("Negative seek position")
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        self.stream.seek(self.position)
+        n = self.stream.readinto(buffer)
+        self.position += n or 0
+        return n
+
+    def read(self, size = -1):
+        self.stream.seek(self.position)
+        data = self.stream.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        pass
+
+class MappingIOSystem(IOSystem):
+    """
+    IO system serving files from a dictionary.
+
+    :param files: maps paths (as referenced by the model, relative to the
+    imported file or not) to bytes-like objects or binary file objects.
+    The file objects are not closed.
+    """
+    def __init__(self, files):
+        IOSystem.__init__(self)
+        self.files = dict((_normalize(path), data) for path, data in files.items())
+
+    def open(self, path, mode):
+        if 'r' not in mode:
+            return None
+        data = self.files.get(_normalize(path))
+        if data is None:
+            return None
+        if hasattr(data, 'read'):
+            if not _seekable(data):
+                data = self.files[_normalize(path)] = data.read()
+            else:
+                return _View(data)
+        return io.BytesIO(data)
+
+class ZipIOSystem(IOSystem):
+    """
+    IO system reading the files from a zip archive. Members are
+    decompressed on the fly as Assimp reads them.
+
+    :param archive: filename or file object of the archive, or a zipfile.ZipFile.
+    """
+    def __init__(self, archive):
+        IOSystem.__init__(self)
+        if isinstance(archive, zipfile.ZipFile):
+            self.archive = archive
+        else:
+            self.archive = zipfile.ZipFile(archive)
+        self.members = dict((_normalize(name), name) for name in self.archive.namelist())
+
+    def open(self, path, mode):
+        if 'r' not in mode:
+            return None
+        name = self.members.get(_normalize(path))
+        if name is None:
+            return None
+        fileobj = self.archive.open(name)
+        # compressed members are not seekable before python 3.7
+        if not _seekable(fileobj):
+            return io.BytesIO(fileobj.read())
+        return fileobj
+
+def _normalize(path):
+    path = posixpath.normpath(path.replace('\\', '/'))
+    if path.startswith('./'):
+        path = path[2:]
+    return path.lstrip('/')
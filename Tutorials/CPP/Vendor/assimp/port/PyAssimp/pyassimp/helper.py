@@ -6,11 +6,42 @@ Some fancy helper functions.
 
 import os
 import ctypes
+import importlib
 from ctypes import POINTER
 import operator
 
-try: import numpy
-except: numpy = None
+class LazyModule(object):
+    """
+    Stand-in for an optional module, imported the first time it is used.
+
+    It is false if the module is not installed, so that 'if numpy:' checks
+    work unchanged while keeping the import out of 'import pyassimp'.
+    """
+    _unresolved = object()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = LazyModule._unresolved
+
+    def _resolve(self):
+        if self._module is LazyModule._unresolved:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                self._module = None
+        return self._module
+
+    def __getattr__(self, name):
+        module = self._resolve()
+        if module is None:
+            raise AttributeError(name)
+        return getattr(module, name)
+
+    def __bool__(self):
+        return self._resolve() is not None
+    __nonzero__ = __bool__
+
+numpy = LazyModule("numpy")
 
 import logging;logger = logging.getLogger("pyassimp")
 
@@ -95,57 +126,233 @@ def _inv(matrix4x4):
             ( m0[2]*m1[1]*m3[0] - m0[1]*m1[2]*m3[0] - m0[2]*m1[0]*m3[1] + m0[0]*m1[2]*m3[1] + m0[1]*m1[0]*m3[2] - m0[0]*m1[1]*m3[2]) /det,
             ( m0[1]*m1[2]*m2[0] - m0[2]*m1[1]*m2[0] + m0[2]*m1[0]*m2[1] - m0[0]*m1[2]*m2[1] - m0[1]*m1[0]*m2[2] + m0[0]*m1[1]*m2[2]) /det]]
    
-def get_bounding_box(scene):
-    bb_min = [1e10, 1e10, 1e10] # x,y,z
-    bb_max = [-1e10, -1e10, -1e10] # x,y,z
-    inv = numpy.linalg.inv if numpy else _inv
-    return get_bounding_box_for_node(scene.rootnode, bb_min, bb_max, inv(scene.rootnode.transformation))
+def _mat_mul(t, T):
+    """ Product of two 4x4 matrices given as nested lists. """
+    return [[sum(t[i][k] * T[k][j] for k in range(4)) for j in range(4)] for i in range(4)]
 
-def get_bounding_box_for_node(node, bb_min, bb_max, transformation):
+def _corners(bb_min, bb_max):
+    """ The 8 corners of a box. """
+    return [[x, y, z] for x in (bb_min[0], bb_max[0])
+                      for y in (bb_min[1], bb_max[1])
+                      for z in (bb_min[2], bb_max[2])]
 
+def _transform_points(points, matrix4x4):
+    """ Apply a transformation matrix to a (N, 3) array of points at once. """
     if numpy:
-        transformation = numpy.dot(transformation, node.transformation)
+        m = numpy.asarray(matrix4x4, dtype = numpy.float64)
+        return numpy.dot(points, m[:3, :3].T) + m[:3, 3]
+    return [transform(p, matrix4x4)[:3] for p in points]
+
+def _points_bounds(points):
+    if numpy:
+        points = numpy.asarray(points)
+        return points.min(axis = 0), points.max(axis = 0)
+    return [min(c) for c in zip(*points)], [max(c) for c in zip(*points)]
+
+def get_mesh_bounding_box(mesh):
+    """
+    Returns the (min, max) corners of the axis-aligned bounding box of a mesh,
+    in the mesh's own coordinate system, or None for meshes without vertices.
+
+    The box is computed once and cached on the mesh as 'mesh.aabb'.
+    """
+    try:
+        return mesh.aabb
+    except AttributeError:
+        pass
+    if len(mesh.vertices):
+        mesh.aabb = _points_bounds(mesh.vertices)
     else:
-        t0,t1,t2,t3 = transformation
-        T0,T1,T2,T3 = node.transformation
-        transformation = [ [
-                t0[0]*T0[0] + t0[1]*T1[0] + t0[2]*T2[0] + t0[3]*T3[0],
-                t0[0]*T0[1] + t0[1]*T1[1] + t0[2]*T2[1] + t0[3]*T3[1],
-                t0[0]*T0[2] + t0[1]*T1[2] + t0[2]*T2[2] + t0[3]*T3[2],
-                t0[0]*T0[3] + t0[1]*T1[3] + t0[2]*T2[3] + t0[3]*T3[3]
-            ],[
-                t1[0]*T0[0] + t1[1]*T1[0] + t1[2]*T2[0] + t1[3]*T3[0],
-                t1[0]*T0[1] + t1[1]*T1[1] + t1[2]*T2[1] + t1[3]*T3[1],
-                t1[0]*T0[2] + t1[1]*T1[2] + t1[2]*T2[2] + t1[3]*T3[2],
-                t1[0]*T0[3] + t1[1]*T1[3] + t1[2]*T2[3] + t1[3]*T3[3]
-            ],[
-                t2[0]*T0[0] + t2[1]*T1[0] + t2[2]*T2[0] + t2[3]*T3[0],
-                t2[0]*T0[1] + t2[1]*T1[1] + t2[2]*T2[1] + t2[3]*T3[1],
-                t2[0]*T0[2] + t2[1]*T1[2] + t2[2]*T2[2] + t2[3]*T3[2],
-                t2[0]*T0[3] + t2[1]*T1[3] + t2[2]*T2[3] + t2[3]*T3[3]
-            ],[
-                t3[0]*T0[0] + t3[1]*T1[0] + t3[2]*T2[0] + t3[3]*T3[0],
-                t3[0]*T0[1] + t3[1]*T1[1] + t3[2]*T2[1] + t3[3]*T3[1],
-                t3[0]*T0[2] + t3[1]*T1[2] + t3[2]*T2[2] + t3[3]*T3[2],
-                t3[0]*T0[3] + t3[1]*T1[3] + t3[2]*T2[3] + t3[3]*T3[3]
-            ] ]
-    
-    for mesh in node.meshes:
-        for v in mesh.vertices:
-            v = transform(v, transformation)
-            bb_min[0] = min(bb_min[0], v[0])
-            bb_min[1] = min(bb_min[1], v[1])
-            bb_min[2] = min(bb_min[2], v[2])
-            bb_max[0] = max(bb_max[0], v[0])
-            bb_max[1] = max(bb_max[1], v[1])
-            bb_max[2] = max(bb_max[2], v[2])
+        mesh.aabb = None
+    return mesh.aabb
 
+def _node_transformations(scene):
+    """
+    Yields the nodes of the scene with their transformation relative to the
+    root node's parent space (the root node's own transformation is left out).
+    """
+    inv = numpy.linalg.inv if numpy else _inv
+    root = inv(scene.rootnode.transformation)
+    index = getattr(scene, 'index', None)
+    if numpy and index is not None:
+        flat = scene.flatten()
+        for node, world in zip(flat.nodes, numpy.matmul(root, flat.world)):
+            yield node, world
+        return
+    if index is not None:
+        for node, world in zip(index.nodes, index.world):
+            yield node, _mat_mul(root, world)
+        return
 
-    for child in node.children:
-        bb_min, bb_max = get_bounding_box_for_node(child, bb_min, bb_max, transformation)
+    stack = [(scene.rootnode, root)]
+    while stack:
+        node, transformation = stack.pop()
+        if numpy:
+            transformation = numpy.dot(transformation, node.transformation)
+        else:
+            transformation = _mat_mul(transformation, node.transformation)
+        yield node, transformation
+        stack.extend((child, transformation) for child in reversed(node.children))
 
+def _node_points(node, transformation, exact):
+    """
+    The points bounding the meshes of a node, transformed by 'transformation':
+    all the vertices if 'exact', the 8 corners of each mesh box otherwise.
+    Returns None for nodes without geometry.
+    """
+    if exact:
+        points = [m.vertices for m in node.meshes if len(m.vertices)]
+        if numpy and points:
+            points = numpy.concatenate(points)
+        else:
+            points = [v for vertices in points for v in vertices]
+    else:
+        points = []
+        for mesh in node.meshes:
+            box = get_mesh_bounding_box(mesh)
+            if box is not None:
+                points.extend(_corners(*box))
+
+    if not len(points):
+        return None
+    return _transform_points(points, transformation)
+
+def get_node_bounding_boxes(scene, exact = False):
+    """
+    Computes the bounding box of every node of the scene, including the
+    meshes of its children.
+
+    The boxes are expressed in the same coordinate system as
+    get_bounding_box().
+
+    :param exact: if False, the boxes are computed from the transformed corners
+    of the (cached) mesh boxes, which is much faster but may be larger than the
+    tightest box. If True, all the vertices are transformed, in one batch per node.
+    :returns: a list of (node, bb_min, bb_max) tuples, parents first.
+    bb_min and bb_max are None for nodes without geometry in their subtree.
+    """
+    nodes = []
+    positions = {}
+    for node, transformation in _node_transformations(scene):
+        points = _node_points(node, transformation, exact)
+        positions[id(node)] = len(nodes)
+        nodes.append([node, None, None] if points is None else [node] + list(_points_bounds(points)))
+
+    # grow the boxes of the parents with the boxes of their children
+    for node, bb_min, bb_max in reversed(nodes):
+        parent = positions.get(id(node.parent)) if node is not scene.rootnode else None
+        if parent is None or bb_min is None:
+            continue
+        parent = nodes[parent]
+        if parent[1] is None:
+            parent[1], parent[2] = bb_min, bb_max
+        elif numpy:
+            parent[1], parent[2] = numpy.minimum(parent[1], bb_min), numpy.maximum(parent[2], bb_max)
+        else:
+            parent[1] = [min(a, b) for a, b in zip(parent[1], bb_min)]
+            parent[2] = [max(a, b) for a, b in zip(parent[2], bb_max)]
+
+    return [tuple(n) for n in nodes]
+
+def get_bounding_box(scene, exact = True):
+    """
+    Returns the (min, max) corners of the bounding box of the scene, in the
+    coordinate system of the root node (its own transformation is not applied).
+
+    The box is tight by default; pass exact = False for the faster, possibly
+    larger box built from the mesh boxes (see get_node_bounding_boxes()).
+    """
+    bb_min, bb_max = get_node_bounding_boxes(scene, exact)[0][1:]
+    if bb_min is None:
+        return [1e10, 1e10, 1e10], [-1e10, -1e10, -1e10]
     return bb_min, bb_max
 
+def get_bounding_sphere(scene, exact = False):
+    """
+    Returns the (center, radius) of a sphere enclosing the scene, in the
+    same coordinate system as get_bounding_box().
+
+    The center is the center of the bounding box; the radius is the
+    distance to the farthest vertex (if 'exact') or mesh box corner.
+    """
+    points = [p for p in (_node_points(node, transformation, exact)
+                          for node, transformation in _node_transformations(scene))
+              if p is not None]
+    if not points:
+        return [0., 0., 0.], 0.
+
+    if numpy:
+        points = numpy.concatenate(points)
+        bb_min, bb_max = _points_bounds(points)
+        center = (bb_min + bb_max) / 2.
+        return center, float(numpy.sqrt(((points - center) ** 2).sum(axis = 1).max()))
+
+    points = [p for node_points in points for p in node_points]
+    bb_min, bb_max = _points_bounds(points)
+    center = [(a + b) / 2. for a, b in zip(bb_min, bb_max)]
+    radius = max(sum((a - b) ** 2 for a, b in zip(p, center)) for p in points) ** .5
+    return center, radius
+
+def get_bounding_box_for_node(node, bb_min, bb_max, transformation):
+    """
+    Grows the box (bb_min, bb_max) with the vertices of the meshes of 'node'
+    and of its children, 'transformation' being the transformation of the
+    parent of 'node'.
+    """
+    stack = [(node, transformation)]
+    while stack:
+        node, transformation = stack.pop()
+        if numpy:
+            transformation = numpy.dot(transformation, node.transformation)
+        else:
+            transformation = _mat_mul(transformation, node.transformation)
+
+        points = _node_points(node, transformation, exact = True)
+        if points is not None:
+            node_min, node_max = _points_bounds(points)
+            bb_min = [min(a, b) for a, b in zip(bb_min, node_min)]
+            bb_max = [max(a, b) for a, b in zip(bb_max, node_max)]
+
+        stack.extend((child, transformation) for child in node.children)
+
+    return bb_min, bb_max
+
+def get_texture_rgba(texture):
+    """
+    Returns the pixels of an embedded texture as a (height, width, 4) uint8
+    RGBA array, ready to be uploaded with glTexImage2D (GL_RGBA,
+    GL_UNSIGNED_BYTE). Note that the first row is the top of the image.
+
+    Compressed textures (PNG, JPEG...) are decoded with PIL (Pillow) the first
+    time this is called; the result is cached on the texture as 'texture.rgba'.
+    Requires numpy.
+    """
+    try:
+        return texture.rgba
+    except AttributeError:
+        pass
+
+    if not numpy:
+        raise AssimpError("get_texture_rgba requires numpy")
+
+    if texture.compressed:
+        try:
+            from PIL import Image
+        except ImportError:
+            raise AssimpError("Decoding compressed textures ('%s') requires PIL" % texture.formathint)
+        import io
+        try:
+            image = Image.open(io.BytesIO(texture.data.tobytes())).convert("RGBA")
+        except Exception as e:
+            raise AssimpError("Could not decode the '%s' texture: %s" % (texture.formathint, e))
+        rgba = numpy.asarray(image, dtype = numpy.uint8)
+    else:
+        # BGRA -> RGBA
+        rgba = numpy.ascontiguousarray(texture.data[..., [2, 1, 0, 3]])
+
+    texture.rgba = rgba
+    return rgba
+
 def try_load_functions(library_path, dll):
     '''
     Try to bind to aiImportFile and aiReleaseImport
@@ -183,66 +390,143 @@ def try_load_functions(library_path, dll):
     load_mem.restype = POINTER(Scene)
     return (library_path, load, load_mem, export, release, dll)
 
-def search_library():
+# environment variables overriding the search of the library
+LIBRARY_ENV = "PYASSIMP_LIBRARY"
+LIBRARY_VERSION_ENV = "PYASSIMP_LIBRARY_VERSION"
+
+def cache_directory():
+    """ The pyassimp cache directory: $PYASSIMP_CACHE_DIR, or ~/.cache/pyassimp """
+    return os.environ.get("PYASSIMP_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"), ".cache", "pyassimp"))
+
+def library_cache_file(version = None):
+    """ File remembering the path of the library found by search_library(),
+    in the pyassimp cache directory (see cache_directory()). """
+    return os.path.join(cache_directory(), "library" + ("-" + version if version else "") + ".path")
+
+def _library_version(dll):
+    return (dll.aiGetVersionMajor(), dll.aiGetVersionMinor())
+
+def _parse_version(version):
+    return tuple(int(v) for v in version.split("."))[:2]
+
+def _open_library(library_path, version = None):
+    """ Loads a library, and returns the result of try_load_functions() if
+    it is a (matching) assimp library, None otherwise. """
+    logger.debug('Try ' + library_path)
+    try:
+        dll = ctypes.cdll.LoadLibrary(library_path)
+    except Exception as e:
+        logger.warning(str(e))
+        # OK, this except is evil. But different OSs will throw different
+        # errors. So just ignore any errors.
+        return None
+    # see if the functions we need are in the dll
+    loaded = try_load_functions(library_path, dll)
+    if loaded and version:
+        try:
+            found = _library_version(dll)
+        except AttributeError:
+            return None
+        if found[:len(_parse_version(version))] != _parse_version(version):
+            logger.debug(library_path + ' is version %d.%d' % found)
+            return None
+    return loaded
+
+def _candidates(version = None):
+    """ The files that may be the assimp library, newest first. Versioned
+    sonames (libassimp.so.5.2) are only considered if a version is requested.
+    """
+    #this path
+    folder = os.path.dirname(__file__)
+
+    candidates = []
+    for curfolder in [folder]+additional_dirs:
+        if not os.path.isdir(curfolder):
+            continue
+        for filename in os.listdir(curfolder):
+            # our minimum requirement for candidates is that
+            # they should contain 'assimp' somewhere in
+            # their name
+            if filename.lower().find('assimp')==-1:
+                continue
+            if os.path.splitext(filename)[-1].lower() not in ext_whitelist and \
+                    not (version and '.so.' in filename):
+                continue
+            library_path = os.path.join(curfolder, filename)
+            candidates.append((os.lstat(library_path).st_mtime, library_path))
+
+    candidates.sort(key=operator.itemgetter(0), reverse=True)
+    return [library_path for _, library_path in candidates]
+
+def search_library(version = None):
     '''
-    Loads the assimp library. 
+    Loads the assimp library.
     Throws exception AssimpError if no library_path is found
-    
-    Returns: tuple, (load from filename function, 
+
+    The library is looked for, in this order:
+    - at the path given by the PYASSIMP_LIBRARY environment variable,
+    - at the path remembered by the previous search (see library_cache_file()),
+    - in the pyassimp folder and the system library folders: the newest
+      file that is an assimp library is used, and the search stops there.
+
+    Arguments
+    ---------
+    version: "major" or "major.minor" version the library must have.
+             Defaults to the PYASSIMP_LIBRARY_VERSION environment variable.
+
+    Returns: tuple, (load from filename function,
                      load from memory function,
                      export to filename function,
-                     release function, 
+                     release function,
                      dll)
     '''
-    #this path
-    folder = os.path.dirname(__file__)
+    version = version or os.environ.get(LIBRARY_VERSION_ENV) or None
 
     # silence 'DLL not found' message boxes on win
     try:
         ctypes.windll.kernel32.SetErrorMode(0x8007)
     except AttributeError:
-        pass    
+        pass
 
-    candidates = []
-    # test every file
-    for curfolder in [folder]+additional_dirs:
-        if os.path.isdir(curfolder):
-            for filename in os.listdir(curfolder):
-                # our minimum requirement for candidates is that
-                # they should contain 'assimp' somewhere in 
-                # their name
-                if filename.lower().find('assimp')==-1 or\
-                    os.path.splitext(filename)[-1].lower() not in ext_whitelist:
-                    continue
-
-                library_path = os.path.join(curfolder, filename)
-                logger.debug('Try ' + library_path)
-                try:
-                    dll = ctypes.cdll.LoadLibrary(library_path)
-                except Exception as e:
-                    logger.warning(str(e))
-                    # OK, this except is evil. But different OSs will throw different
-                    # errors. So just ignore any errors.
-                    continue
-                # see if the functions we need are in the dll
-                loaded = try_load_functions(library_path, dll)
-                if loaded: candidates.append(loaded)
-
-    if not candidates:
-        # no library found
-        raise AssimpError("assimp library not found")
+    if os.environ.get(LIBRARY_ENV):
+        res = _open_library(os.environ[LIBRARY_ENV], version)
+        if not res:
+            raise AssimpError("%s=%s is not a%s assimp library" % (LIBRARY_ENV, os.environ[LIBRARY_ENV],
+                                                                 " version " + version if version else "n"))
+        return res[1:]
+
+    cache_file = library_cache_file(version)
+    try:
+        with open(cache_file) as f:
+            cached = f.read().strip()
+    except (IOError, OSError):
+        cached = None
+    if cached and os.path.exists(cached):
+        res = _open_library(cached, version)
+        if res:
+            logger.debug('Using assimp library located at ' + res[0])
+            return res[1:]
+
+    for library_path in _candidates(version):
+        res = _open_library(library_path, version)
+        if res:
+            break
     else:
-        # get the newest library_path
-        candidates = map(lambda x: (os.lstat(x[0])[-2], x), candidates)
-        res = max(candidates, key=operator.itemgetter(0))[1]
-        logger.debug('Using assimp library located at ' + res[0])
+        # no library found
+        raise AssimpError("assimp library%s not found" % (" version " + version if version else ""))
 
-        # XXX: if there are 1000 dll/so files containing 'assimp'
-        # in their name, do we have all of them in our address
-        # space now until gc kicks in?
+    logger.debug('Using assimp library located at ' + res[0])
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        with open(cache_file, "w") as f:
+            f.write(os.path.abspath(res[0]))
+    except (IOError, OSError) as e:
+        logger.debug('Could not remember the library path: ' + str(e))
 
-        # XXX: take version postfix of the .so on linux?
-        return res[1:]
+    # XXX: take version postfix of the .so on linux?
+    return res[1:]
 
 def hasattr_silent(object, name):
     """
@@ -0,0 +1,389 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Level-of-detail generation by mesh simplification.
+
+generate_lods() decimates a triangulated mesh with the quadric error
+metric of Garland and Heckbert ("Surface Simplification Using Quadric
+Error Metrics", 1997): edges are collapsed cheapest first, the cost of a
+collapse being the squared distance of the new position to the planes of
+the triangles merged into it.
+
+The quadrics and the costs are computed with numpy for all the triangles
+at once, and the edges are collapsed in passes: each pass picks a batch of
+cheap collapses far enough apart not to interfere (their neighbourhoods do
+not overlap), checks them all at once and applies the cheapest valid ones.
+Only the costs around the vertices that moved are updated between passes.
+
+Collapses move a vertex onto one of its neighbours (half-edge collapses),
+so no new vertex is created: every level of detail is an index buffer
+into the vertex buffer of the original mesh, and all the per-vertex
+attributes (normals, texture coordinates...) are kept as they are.
+
+    from pyassimp import load
+    from pyassimp.lod import generate_lods
+
+    scene = load('dragon.ply')
+    mesh = scene.meshes[0]
+    generate_lods(mesh, ratios = (0.5, 0.25, 0.1))
+    for indices, error in zip(mesh.lods, mesh.loderrors):
+        print(len(indices) // 3, error)
+
+Vertices sharing a position but not their attributes (UV seams, hard
+edges) only collapse together, along the seam, so the seams are never
+torn open. Open borders are kept in place by extra quadrics.
+
+Requires numpy.
+"""
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import optimize
+from .errors import AssimpError
+
+DEFAULT_RATIOS = (0.5, 0.25, 0.125)
+
+# weight of the quadrics keeping the open borders in place, relative to
+# the quadrics of the triangles
+BORDER_WEIGHT = 10.
+
+# collapses considered per pass: up to this many times the cost of the
+# cheapest ones needed for the next level (at least _MIN_CANDIDATES, or a
+# sixteenth of all the collapses on small meshes)
+_PASS_BOUND = 1.5
+_MIN_CANDIDATES = 1024
+
+# rounds of selection of independent collapses per pass
+_ROUNDS = 16
+
+# the collapses along the edges of a triangle, in both directions: the
+# corners moving (p) and the corners they move onto (q)
+_P = [0, 1, 2, 1, 2, 0]
+_Q = [1, 2, 0, 0, 1, 2]
+
+# quadric layout: the 10 coefficients of the symmetric 4x4 matrix
+# (aa ab ac ad bb bc bd cc cd dd) followed by the total area
+_QSIZE = 11
+
+def _plane_quadrics(planes, weights):
+    a, b, c, d = planes.T
+    return numpy.stack((a * a, a * b, a * c, a * d, b * b, b * c, b * d, c * c, c * d, d * d), axis = 1) \
+            * weights[:, numpy.newaxis]
+
+def _quadrics(positions, triangles, border_weight):
+    """ The quadric of each position: the sum of the area-weighted planes of
+    its triangles, and of the planes orthogonal to its border edges. """
+    p0, p1, p2 = (positions[triangles[:, i]] for i in range(3))
+    normals = numpy.cross(p1 - p0, p2 - p0)
+    areas = numpy.sqrt((normals ** 2).sum(axis = 1))
+    normals /= numpy.maximum(areas, 1e-30)[:, numpy.newaxis]
+    areas *= .5
+    planes = numpy.concatenate((normals, -(normals * p0).sum(axis = 1)[:, numpy.newaxis]), axis = 1)
+
+    quadrics = numpy.zeros((len(triangles), _QSIZE))
+    quadrics[:, :10] = _plane_quadrics(planes, areas)
+    quadrics[:, 10] = areas
+    corners = triangles.ravel()
+    quadrics = numpy.repeat(quadrics, 3, axis = 0)
+
+    # border edges are used by a single triangle
+    edges = numpy.stack((triangles, numpy.roll(triangles, -1, axis = 1)), axis = 2).reshape((-1, 2))
+    keys = numpy.sort(edges, axis = 1)
+    keys = keys[:, 0] * len(positions) + keys[:, 1]
+    _, inverse, counts = numpy.unique(keys, return_inverse = True, return_counts = True)
+    border = numpy.flatnonzero(counts[inverse.ravel()] == 1)
+    if len(border):
+        start, end = positions[edges[border, 0]], positions[edges[border, 1]]
+        lengths = numpy.sqrt(((end - start) ** 2).sum(axis = 1))
+        normal = numpy.cross(end - start, normals[border // 3])
+        normal /= numpy.maximum(numpy.sqrt((normal ** 2).sum(axis = 1)), 1e-30)[:, numpy.newaxis]
+        planes = numpy.concatenate((normal, -(normal * start).sum(axis = 1)[:, numpy.newaxis]), axis = 1)
+        extra = numpy.zeros((len(border), _QSIZE))
+        extra[:, :10] = _plane_quadrics(planes, border_weight * lengths ** 2)
+        corners = numpy.concatenate((corners, edges[border].ravel()))
+        quadrics = numpy.concatenate((quadrics, numpy.repeat(extra, 2, axis = 0)))
+
+    return numpy.stack([numpy.bincount(corners, quadrics[:, i], minlength = len(positions))
+                        for i in range(_QSIZE)], axis = 1)
+
+def _errors(quadrics, points):
+    """ Vectorized quadric errors of points. """
+    q = quadrics.T
+    x, y, z = points.T
+    return q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x \
+         + q[4] * y * y + 2 * q[5] * y * z + 2 * q[6] * y \
+         + q[7] * z * z + 2 * q[8] * z + q[9]
+
+def _costs(quadrics, positions, ptris):
+    """ The costs of the collapses along the edges of triangles (see _P and
+    _Q), as a (T, 6) array: the errors of the positions q for the summed
+    quadrics of p and q, one coefficient at a time. """
+    a, b = ptris[:, _P].ravel(), ptris[:, _Q].ravel()
+    x, y, z = positions[b].T
+    monomials = (lambda: x * x, lambda: 2 * x * y, lambda: 2 * x * z, lambda: 2 * x,
+                 lambda: y * y, lambda: 2 * y * z, lambda: 2 * y,
+                 lambda: z * z, lambda: 2 * z)
+    costs = quadrics[a, 9] + quadrics[b, 9]
+    for k, monomial in enumerate(monomials):
+        costs += (quadrics[a, k] + quadrics[b, k]) * monomial()
+    return costs.reshape((-1, 6))
+
+def _normals(corners):
+    return numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+def _independent(ptris, src, dst, candidates, locked, guarded):
+    """
+    Chooses collapses among candidates (sorted by cost) such that no
+    triangle holds the p of a collapse and a position of another one: each
+    collapse is then checked and applied on triangles that no other one
+    modifies. They are chosen in rounds: the candidates that are the
+    cheapest of all those touching the triangles around their two
+    positions are taken, and the candidates they exclude are dropped.
+
+    :param locked, guarded: (positions,) bool arrays, updated: the
+    positions around the p (no collapse from or to them) and around the q
+    (no collapse from them) of the chosen collapses.
+    :returns: the chosen candidates.
+    """
+    candidates = candidates[~(locked[src[candidates]] | locked[dst[candidates]] | guarded[src[candidates]])]
+    nb_positions = len(locked)
+    endpoints = numpy.zeros(nb_positions, dtype = bool)
+    endpoints[src[candidates]] = endpoints[dst[candidates]] = True
+    local = ptris[endpoints[ptris].any(axis = 1)]
+
+    chosen = [candidates[:0]]
+    for _ in range(_ROUNDS):
+        if not len(candidates):
+            break
+        nb = len(candidates)
+        ranks = numpy.arange(nb)
+        lowest = numpy.full(nb_positions, nb)
+        numpy.minimum.at(lowest, src[candidates], ranks)
+        numpy.minimum.at(lowest, dst[candidates], ranks)
+        around = lowest[local].min(axis = 1)
+        near = around < nb
+        lowest[:] = nb
+        numpy.minimum.at(lowest, local[near].ravel(), around[near].repeat(3))
+        independent = (lowest[src[candidates]] == ranks) & (lowest[dst[candidates]] == ranks)
+        chosen.append(candidates[independent])
+
+        for taken, mask in ((src[chosen[-1]], locked), (dst[chosen[-1]], guarded)):
+            endpoints[:] = False
+            endpoints[taken] = True
+            mask[local[endpoints[local].any(axis = 1)]] = True
+        candidates = candidates[~(independent | locked[src[candidates]] | locked[dst[candidates]]
+                                  | guarded[src[candidates]])]
+    return numpy.concatenate(chosen)
+
+def simplify(vertices, triangles, targets, max_error = None, border_weight = BORDER_WEIGHT):
+    """
+    Decimates a triangle mesh.
+
+    The edges are collapsed in passes of independent collapses (see
+    _independent()), taken cheapest first among the collapses that can
+    still be done before the next target, checked and applied at once.
+
+    :param vertices: (V, 3) positions.
+    :param triangles: (T, 3) vertex indices.
+    :param targets: triangle counts of the levels of detail to generate.
+    A single simplification pass produces all of them.
+    :param max_error: stop once collapses move the surface farther than
+    this distance. The remaining levels are then copies of the last one.
+    :returns: a list of (triangles, error) pairs, one per target in
+    decreasing order: (n, 3) uint32 indices into 'vertices', and the
+    largest (area-weighted RMS) distance a collapse moved the surface by.
+    """
+    vertices = numpy.asarray(vertices, dtype = numpy.float64)
+    triangles = numpy.asarray(triangles, dtype = numpy.intp).reshape((-1, 3))
+    targets = sorted(targets, reverse = True)
+    nb_vertices = len(vertices)
+
+    # vertices sharing their position (seams) share their quadric
+    positions, pos = numpy.unique(vertices, axis = 0, return_inverse = True)
+    pos = pos.ravel()
+    nb_positions = len(positions)
+    scale = numpy.int64(nb_positions)
+    ptris = pos[triangles]
+    valid = (ptris[:, 0] != ptris[:, 1]) & (ptris[:, 1] != ptris[:, 2]) & (ptris[:, 2] != ptris[:, 0])
+    triangles, ptris = triangles[valid], ptris[valid]
+
+    quadrics = _quadrics(positions, ptris, border_weight)
+
+    # the costs of the collapses along the edges of each triangle (see _P
+    # and _Q), updated around the collapses. The collapses that fail cost
+    # infinity until a collapse ends on one of the positions around them.
+    costs = _costs(quadrics, positions, ptris)
+
+    lods = []
+    error = 0.
+    while len(lods) < len(targets):
+        if len(triangles) <= targets[len(lods)]:
+            lods.append((triangles.astype(numpy.uint32), error))
+            continue
+
+        # independent collapses among the cheapest ones: as many as needed to
+        # reach the next target (each removes up to 2 triangles), and all
+        # those within _PASS_BOUND times their costs, for enough of them to
+        # be independent
+        src, dst, flat = ptris[:, _P].ravel(), ptris[:, _Q].ravel(), costs.ravel()
+        candidates = numpy.flatnonzero(numpy.isfinite(flat))
+        limit = max(1, (len(triangles) - targets[len(lods)] + 1) // 2)
+        rank = max(limit, min(_MIN_CANDIDATES, len(candidates) // 16))
+        if rank < len(candidates):
+            bound = flat[candidates[numpy.argpartition(flat[candidates], rank - 1)[rank - 1]]]
+            candidates = candidates[flat[candidates] <= max(bound * _PASS_BOUND, 0)]
+        if max_error is not None:
+            # the area-weighted RMS distances the collapses move the surface by
+            areas = quadrics[src[candidates], 10] + quadrics[dst[candidates], 10]
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                candidates = candidates[numpy.where(areas > 0, numpy.maximum(flat[candidates], 0) / areas, 0)
+                                        <= max_error ** 2]
+        candidates = candidates[numpy.argsort(flat[candidates], kind = 'mergesort')]
+        # each collapse is found in the two triangles of its edge
+        _, first = numpy.unique(src[candidates] * scale + dst[candidates], return_index = True)
+        selected = _independent(ptris, src, dst, candidates[numpy.sort(first)],
+                                numpy.zeros(nb_positions, dtype = bool), numpy.zeros(nb_positions, dtype = bool))
+        if not len(selected):
+            break
+
+        p, q = src[selected], dst[selected]
+        nb_selected = len(selected)
+        invalid = numpy.zeros(nb_selected, dtype = bool)
+
+        # the corners of the triangles around each p, and their vertex
+        # of q if they are removed by the collapse
+        which = numpy.full(nb_positions, -1)
+        which[p] = numpy.arange(nb_selected)
+        corners = numpy.flatnonzero(which[ptris.ravel()] >= 0)
+        t, j = corners // 3, corners % 3
+        e = which[ptris[t, j]]
+        following, preceding = ptris[t, (j + 1) % 3], ptris[t, (j + 2) % 3]
+        shared = (following == q[e]) | (preceding == q[e])
+        a = triangles[t, j]
+        b = numpy.where(following == q[e], triangles[t, (j + 1) % 3], triangles[t, (j + 2) % 3])
+
+        # seams: every vertex of p moves onto a single vertex of q, sharing
+        # a triangle with it, and no two of them onto the same one
+        pairs = numpy.unique(a[shared].astype(numpy.int64) * nb_vertices + b[shared])
+        pa, pb = pairs // nb_vertices, pairs % nb_vertices
+        invalid[e[numpy.bincount(pa, minlength = nb_vertices)[a] != 1]] = True
+        invalid[which[pos[pa[numpy.bincount(pb, minlength = nb_vertices)[pb] > 1]]]] = True
+
+        # flips: the triangles moved with p keep their orientation
+        kept = numpy.flatnonzero(~shared)
+        before = positions[ptris[t[kept]]]
+        after = before.copy()
+        after[numpy.arange(len(kept)), j[kept]] = positions[q[e[kept]]]
+        flipped = numpy.einsum('ij,ij->i', _normals(before), _normals(after)) <= 0
+        invalid[e[kept[flipped]]] = True
+
+        # link condition: p and q only share the neighbours of their common
+        # triangles (the collapse keeps the mesh manifold)
+        thirds = numpy.unique(e[shared] * scale + numpy.where(following == q[e], preceding, following)[shared])
+        whichq = numpy.full(nb_positions, -1)
+        whichq[q] = numpy.arange(nb_selected)
+        qcorners = numpy.flatnonzero(whichq[ptris.ravel()] >= 0)
+        tq, jq = qcorners // 3, qcorners % 3
+        eq = whichq[ptris[tq, jq]]
+        common = numpy.intersect1d(numpy.concatenate((e * scale + following, e * scale + preceding)),
+                                   numpy.concatenate((eq * scale + ptris[tq, (jq + 1) % 3],
+                                                      eq * scale + ptris[tq, (jq + 2) % 3])))
+        invalid |= numpy.bincount(common // scale, minlength = nb_selected) != \
+                   numpy.bincount(thirds // scale, minlength = nb_selected)
+
+        # the failed collapses, in both triangles of their edge
+        failed = invalid[e]
+        rows, ids = t[failed], e[failed]
+        costs[rows] = numpy.where((ptris[rows][:, _P] == p[ids, numpy.newaxis]) &
+                                  (ptris[rows][:, _Q] == q[ids, numpy.newaxis]), numpy.inf, costs[rows])
+
+        # apply the cheapest valid collapses, as many as needed
+        done = numpy.flatnonzero(~invalid)
+        if len(done) > limit:
+            done = done[numpy.argpartition(flat[selected[done]], limit - 1)[:limit]]
+        if len(done):
+            sums = quadrics[p[done]] + quadrics[q[done]]
+            areas = sums[:, 10]
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                distances = numpy.where(areas > 0, numpy.maximum(flat[selected[done]], 0) / areas, 0)
+            error = max(error, float(numpy.sqrt(distances.max())))
+            quadrics[q[done]] = sums
+
+        applied = numpy.zeros(nb_selected, dtype = bool)
+        applied[done] = True
+        moving = applied[which[pos[pa]]]
+        vmap = numpy.arange(nb_vertices)
+        vmap[pa[moving]] = pb[moving]
+        triangles = vmap[triangles]
+        ptris = pos[triangles]
+        valid = (ptris[:, 0] != ptris[:, 1]) & (ptris[:, 1] != ptris[:, 2]) & (ptris[:, 2] != ptris[:, 0])
+        triangles, ptris, costs = triangles[valid], ptris[valid], costs[valid]
+
+        # the collapses around the positions whose quadric changed
+        absorbing = numpy.zeros(nb_positions, dtype = bool)
+        absorbing[q[done]] = True
+        dirty = numpy.flatnonzero(absorbing[ptris].any(axis = 1))
+        costs[dirty] = _costs(quadrics, positions, ptris[dirty])
+
+    if len(lods) < len(targets):
+        logger.debug("Could only simplify down to %d triangles" % len(triangles))
+    while len(lods) < len(targets):
+        lods.append((triangles.astype(numpy.uint32), error))
+    return lods
+
+def generate_lods(mesh, ratios = DEFAULT_RATIOS, max_error = None, cache_optimize = True):
+    """
+    Generates the levels of detail of a triangulated mesh.
+
+    They are stored on the mesh: mesh.lods is a list of flat uint32 index
+    buffers (like mesh.indices) into the vertices of the mesh, one per
+    ratio, from the finest to the coarsest level (ie. by decreasing ratio,
+    whatever the order of 'ratios'), and mesh.loderrors the matching
+    simplification errors (see simplify()).
+
+    :param ratios: fractions of the triangles of the mesh to keep.
+    :param cache_optimize: reorder the triangles of each level for the
+    vertex cache (see pyassimp.optimize).
+    :returns: mesh.lods
+    """
+    offsets = numpy.asarray(mesh.faceoffsets)
+    if len(offsets) > 1 and (numpy.diff(offsets) != 3).any():
+        raise AssimpError(str(mesh) + " is not triangulated (use aiProcess_Triangulate)")
+    triangles = numpy.asarray(mesh.indices).reshape((-1, 3))
+
+    # meshes imported without aiProcess_JoinIdenticalVertices have
+    # unconnected triangles: use the first of identical vertices
+    columns = [numpy.asarray(mesh.vertices, dtype = numpy.float32)]
+    for name in ("normals", "tangents", "bitangents", "colors", "texturecoords"):
+        value = numpy.asarray(getattr(mesh, name, []), dtype = numpy.float32)
+        if value.size:
+            if value.ndim == 3: # (sets, vertices, components)
+                value = value.transpose((1, 0, 2)).reshape((len(columns[0]), -1))
+            columns.append(value)
+    _, first, inverse = numpy.unique(numpy.concatenate(columns, axis = 1), axis = 0,
+                                     return_index = True, return_inverse = True)
+    triangles = first[inverse.ravel()][triangles]
+
+    targets = [int(len(triangles) * ratio) for ratio in sorted(ratios, reverse = True)]
+    lods = simplify(mesh.vertices, triangles, targets, max_error)
+
+    mesh.lods, mesh.loderrors = [], []
+    for tris, error in lods:
+        if cache_optimize and len(tris):
+            tris = tris[optimize.tipsify(tris, len(mesh.vertices))[0]]
+        mesh.lods.append(tris.ravel())
+        mesh.loderrors.append(error)
+    logger.debug(str(mesh) + ": levels of detail of " + ", ".join(str(len(i) // 3) for i in mesh.lods) + " triangles")
+    return mesh.lods
+
+def select_lod(mesh, tolerance):
+    """ The index buffer of the coarsest level of detail of a mesh whose
+    error is below 'tolerance' (mesh.indices if there is none). """
+    indices = mesh.indices
+    for lod, error in zip(getattr(mesh, "lods", []), getattr(mesh, "loderrors", [])):
+        if error > tolerance:
+            break
+        indices = lod
+    return indices
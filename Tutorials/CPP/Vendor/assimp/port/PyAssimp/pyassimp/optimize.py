@@ -0,0 +1,319 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Vertex cache, overdraw and vertex fetch optimization of triangle meshes.
+
+optimize_mesh() reorders the triangles of a mesh so that the GPU
+post-transform vertex cache is reused as much as possible (the Tipsify
+algorithm of Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex
+Locality and Reduced Overdraw", 2007), then reorders the vertices in the
+order the triangles first use them, so that vertex fetches are sequential:
+
+    from pyassimp import load, export
+    from pyassimp.optimize import optimize_mesh
+
+    scene = load('bunny.ply', processing = postprocess.aiProcess_Triangulate)
+    for mesh in scene.meshes:
+        stats = optimize_mesh(mesh)
+        print("ACMR %.3f -> %.3f" % stats["acmr"])
+    export(scene, 'bunny.dae', 'collada')
+
+The quality of an ordering is measured with a simulated FIFO cache:
+
+- ACMR (average cache miss ratio): transformed vertices per triangle. It is
+  3 in the worst case and tends to 0.5 for large regular meshes.
+- ATVR (average transform to vertex ratio): transformed vertices per vertex
+  of the mesh. 1 is optimal.
+
+Requires numpy.
+"""
+
+import numpy
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from . import core
+from . import structs
+from .errors import AssimpError
+
+# size of the simulated FIFO cache. GPUs have caches of 16 to 32 entries;
+# optimizing for a smaller cache than the real one is harmless.
+DEFAULT_CACHE_SIZE = 16
+
+# clusters whose ACMR is below this value can be split by the overdraw pass
+DEFAULT_OVERDRAW_THRESHOLD = 0.75
+
+# per-vertex attributes of the meshes, and the axis of their vertices
+_ATTRIBUTES = (("vertices", 0), ("normals", 0), ("tangents", 0), ("bitangents", 0),
+               ("colors", 1), ("texturecoords", 1),
+               ("boneindices", 0), ("boneweights", 0))
+
+def _misses(indices, cache_size):
+    """ The number of cache misses of each triangle of a flat index buffer. """
+    # a vertex is in the cache if less than cache_size misses happened
+    # since it was last loaded
+    stamps = [-cache_size - 1] * (int(indices.max()) + 1)
+    missed = []
+    misses = 0
+    for v in indices.tolist():
+        if misses - stamps[v] > cache_size - 1:
+            stamps[v] = misses
+            misses += 1
+        missed.append(misses)
+    missed = numpy.array(missed[2::3], dtype = numpy.intp)
+    missed[1:] -= missed[:-1].copy()
+    return missed
+
+def cache_statistics(triangles, cache_size = DEFAULT_CACHE_SIZE):
+    """
+    Simulates a FIFO vertex cache of 'cache_size' entries.
+
+    :param triangles: (T, 3) array of vertex indices, or a flat index buffer.
+    :returns: the (ACMR, ATVR) of the triangles.
+    """
+    indices = numpy.asarray(triangles).ravel()
+    if not len(indices):
+        return 0., 0.
+    misses = float(_misses(indices, cache_size).sum())
+    return misses / (len(indices) // 3), misses / len(numpy.unique(indices))
+
+def _adjacency(triangles, nb_vertices):
+    """ The triangles using each vertex, as a (offsets, triangles) pair of lists. """
+    flat = triangles.ravel()
+    order = numpy.argsort(flat, kind = 'mergesort')
+    offsets = numpy.zeros(nb_vertices + 1, dtype = numpy.intp)
+    numpy.cumsum(numpy.bincount(flat, minlength = nb_vertices), out = offsets[1:])
+    return offsets.tolist(), (order // 3).tolist()
+
+def tipsify(triangles, nb_vertices = None, cache_size = DEFAULT_CACHE_SIZE):
+    """
+    Reorders triangles for the vertex cache, in linear time.
+
+    The triangles around a 'fanning' vertex are emitted together; the next
+    fanning vertex is picked among the vertices just emitted, preferring
+    those still in the cache and having few triangles left.
+
+    :param triangles: (T, 3) array of vertex indices.
+    :returns: (order, boundaries): the new order of the triangles and the
+    positions in 'order' where the cache had to be restarted from a vertex
+    emitted long ago (used by optimize_overdraw()).
+    """
+    triangles = numpy.asarray(triangles, dtype = numpy.intp).reshape((-1, 3))
+    if nb_vertices is None:
+        nb_vertices = int(triangles.max()) + 1 if len(triangles) else 0
+    offsets, adjacent = _adjacency(triangles, nb_vertices)
+    corners = triangles.tolist()
+
+    live = numpy.diff(offsets).tolist() # triangles left per vertex
+    stamps = [0] * nb_vertices          # time each vertex entered the cache
+    emitted = [False] * len(corners)
+    dead_ends = []
+    order = []
+    boundaries = [0]
+
+    time = cache_size + 1
+    cursor = 0
+    fanning = 0 if len(corners) else -1
+    while fanning >= 0:
+        candidates = []
+        for t in adjacent[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in corners[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamps[v] > cache_size:
+                    stamps[v] = time
+                    time += 1
+
+        # next fanning vertex: the candidate that will stay in the cache
+        # the longest while all its remaining triangles are emitted
+        fanning, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = time - stamps[v] if time - stamps[v] + 2 * live[v] <= cache_size else 0
+                if priority > best:
+                    fanning, best = v, priority
+        if fanning >= 0:
+            continue
+
+        # dead end: restart from a recently emitted vertex, or from the
+        # next vertex in input order having triangles left
+        while dead_ends:
+            v = dead_ends.pop()
+            if live[v] > 0:
+                fanning = v
+                break
+        else:
+            while cursor < nb_vertices:
+                if live[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+        if fanning >= 0 and time - stamps[fanning] > cache_size:
+            boundaries.append(len(order))
+
+    return numpy.array(order, dtype = numpy.intp), numpy.array(boundaries, dtype = numpy.intp)
+
+def optimize_overdraw(triangles, vertices, order, boundaries,
+                      cache_size = DEFAULT_CACHE_SIZE,
+                      threshold = DEFAULT_OVERDRAW_THRESHOLD):
+    """
+    Reorders clusters of triangles to reduce overdraw.
+
+    The triangle order of tipsify() is split into clusters at the cache
+    restarts that do not cost much vertex locality (the ACMR of the
+    cluster so far is below 'threshold'). The clusters are then sorted
+    by decreasing occlusion potential: clusters facing away from the
+    center of the mesh likely occlude the others from any viewpoint, so
+    they are drawn first.
+
+    :returns: the new order of the triangles.
+    """
+    triangles = numpy.asarray(triangles, dtype = numpy.intp).reshape((-1, 3))
+    if len(boundaries) < 2:
+        return order
+    tris = triangles[order]
+
+    # soft boundaries
+    misses = numpy.concatenate(([0], numpy.cumsum(_misses(tris.ravel(), cache_size))))
+    starts = [0]
+    for start in boundaries[1:].tolist():
+        if start > starts[-1] and float(misses[start] - misses[starts[-1]]) / (start - starts[-1]) < threshold:
+            starts.append(start)
+    if len(starts) < 2:
+        return order
+
+    corners = numpy.asarray(vertices, dtype = numpy.float64)[tris]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = numpy.sqrt((normals ** 2).sum(axis = 1))
+    centroids = corners.mean(axis = 1)
+    center = (centroids * areas[:, numpy.newaxis]).sum(axis = 0) / max(areas.sum(), 1e-30)
+
+    cluster_normals = numpy.add.reduceat(normals, starts)
+    cluster_areas = numpy.add.reduceat(areas, starts)
+    cluster_centroids = numpy.add.reduceat(centroids * areas[:, numpy.newaxis], starts) \
+            / numpy.maximum(cluster_areas, 1e-30)[:, numpy.newaxis]
+    length = numpy.sqrt((cluster_normals ** 2).sum(axis = 1))
+    potential = ((cluster_centroids - center) * cluster_normals).sum(axis = 1) / numpy.maximum(length, 1e-30)
+
+    ends = starts[1:] + [len(tris)]
+    clusters = numpy.argsort(-potential, kind = 'mergesort')
+    return numpy.concatenate([order[starts[c]:ends[c]] for c in clusters])
+
+def optimize_vertex_fetch(triangles, nb_vertices):
+    """
+    Numbers the vertices in the order the triangles first use them, so
+    that vertex fetches are as sequential as possible. Unused vertices are
+    moved to the end.
+
+    :returns: (triangles, order): the renumbered triangles, and the old
+    index of each new vertex (new attributes are attribute[order]).
+    """
+    triangles = numpy.asarray(triangles).reshape((-1, 3))
+    flat = triangles.ravel()
+    used, first = numpy.unique(flat, return_index = True)
+    used = flat[numpy.sort(first)]
+    unused = numpy.setdiff1d(numpy.arange(nb_vertices), used, assume_unique = True)
+    order = numpy.concatenate((used, unused)).astype(numpy.intp)
+
+    remap = numpy.empty(nb_vertices, dtype = numpy.uint32)
+    remap[order] = numpy.arange(nb_vertices, dtype = numpy.uint32)
+    return remap[triangles], order
+
+def _mesh_struct(mesh):
+    """ The aiMesh behind a mesh while its scene is loaded and not
+    released, or None: after release() or for scenes built by
+    pyassimp.builder, the struct must not be written to. """
+    if isinstance(mesh, structs.Mesh):
+        struct = mesh
+    elif hasattr(mesh, 'contents'):
+        struct = mesh.contents
+    else:
+        return None # cached mesh
+    scene = vars(mesh).get('_scene')
+    if scene is not None:
+        # lazy mesh
+        return None if '_released' in vars(scene) else struct
+    memory = core._view_owner(getattr(mesh, "vertices", None))
+    if not isinstance(memory, core._SceneMemory) or memory.releasable:
+        return None # released, detached or built
+    return struct
+
+def _permute_struct(struct, triangles, order, remap):
+    """ Applies the new triangles and vertex order to Assimp's memory, so
+    that the scene can be exported. """
+    n = struct.mNumVertices
+    arrays = [struct.mVertices, struct.mNormals, struct.mTangents, struct.mBitangents]
+    arrays.extend(struct.mColors)
+    arrays.extend(struct.mTextureCoords)
+    for ptr in arrays:
+        if ptr:
+            view = core._as_numpy(ptr, n)
+            view[...] = view[order]
+
+    core._write_faces(struct, triangles.astype(numpy.uint32).ravel())
+
+    for i in range(struct.mNumBones):
+        bone = struct.mBones[i].contents
+        if bone.mNumWeights:
+            weights = core._vertex_weights(bone)
+            weights['vertex'] = remap[weights['vertex']]
+
+def optimize_mesh(mesh, cache_size = DEFAULT_CACHE_SIZE, overdraw = False,
+                  threshold = DEFAULT_OVERDRAW_THRESHOLD):
+    """
+    Optimizes a triangulated mesh for the vertex cache (and optionally
+    for overdraw), then for vertex fetches.
+
+    The mesh is modified in place: its faces and per-vertex attributes are
+    reordered, in the pythonized attributes and, as long as the scene has
+    not been released, in Assimp's memory too, so that export() writes the
+    optimized mesh.
+
+    :param overdraw: if True, also run optimize_overdraw() (slightly
+    increases the ACMR).
+    :returns: a dict mapping "acmr" and "atvr" to their (before, after) values.
+    """
+    offsets = numpy.asarray(mesh.faceoffsets)
+    if len(offsets) > 1 and (numpy.diff(offsets) != 3).any():
+        raise AssimpError(str(mesh) + " is not triangulated (use aiProcess_Triangulate)")
+    triangles = numpy.asarray(mesh.indices, dtype = numpy.intp).reshape((-1, 3))
+    nb_vertices = len(mesh.vertices)
+
+    before = cache_statistics(triangles, cache_size)
+    order, boundaries = tipsify(triangles, nb_vertices, cache_size)
+    if overdraw:
+        order = optimize_overdraw(triangles, mesh.vertices, order, boundaries, cache_size, threshold)
+    triangles, vertex_order = optimize_vertex_fetch(triangles[order], nb_vertices)
+    after = cache_statistics(triangles, cache_size)
+
+    remap = numpy.empty(nb_vertices, dtype = numpy.uint32)
+    remap[vertex_order] = numpy.arange(nb_vertices, dtype = numpy.uint32)
+
+    struct = _mesh_struct(mesh)
+    if struct is not None:
+        _permute_struct(struct, triangles, vertex_order, remap)
+    for name, axis in _ATTRIBUTES:
+        value = getattr(mesh, name, None)
+        if not isinstance(value, numpy.ndarray) or not value.size:
+            continue
+        if struct is not None and not value.flags.owndata:
+            continue # view on Assimp's memory, already reordered
+        setattr(mesh, name, numpy.take(value, vertex_order, axis = axis))
+
+    for bone in getattr(mesh, "bones", []):
+        for weight in getattr(bone, "weights", []):
+            # pythonized copy of mVertexId
+            if getattr(weight, "vertexid", None) is not None:
+                weight.vertexid = int(remap[weight.vertexid])
+
+    indices = triangles.astype(numpy.uint32).ravel()
+    mesh.indices = indices
+    mesh.faces = core._split_faces(indices, offsets)
+
+    logger.debug(str(mesh) + ": ACMR %.3f -> %.3f, ATVR %.3f -> %.3f" % (before[0], after[0], before[1], after[1]))
+    return {"acmr": (before[0], after[0]), "atvr": (before[1], after[1])}
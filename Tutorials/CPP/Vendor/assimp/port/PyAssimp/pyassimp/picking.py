@@ -0,0 +1,171 @@
+#-*- coding: UTF-8 -*-
+
+"""
+Picking on the CPU: finds the node under the cursor of a 3D view by
+casting a ray through the camera, without rendering anything.
+
+The ray is first tested against the bounding boxes of all the mesh
+instances at once, then against the triangles of the meshes whose boxes
+it crosses, nearest box first:
+
+    from pyassimp.picking import Picker
+
+    picker = Picker(scene)
+    result = picker.pick(x, y, width, height, projection_matrix, view_matrix)
+    if result:
+        print(result.node, result.face, result.point)
+
+The instances are tested in the local space of their node, with the
+current world transformations of scene.flatten(): nodes moved through
+FlatScene.update() are picked where they are drawn. Only the triangles of
+the meshes are considered.
+
+Requires numpy.
+"""
+
+import numpy
+
+from . import bvh
+from . import core
+from . import helper
+
+def screen_ray(x, y, width, height, projection, view):
+    """
+    The ray through a pixel of a view, in world space.
+
+    :param x, y: window coordinates of the pixel, from the bottom-left
+    corner (as for glReadPixels).
+    :param projection, view: the 4x4 projection and view matrices of the
+    camera (column vectors convention, ie. not transposed for OpenGL).
+    :returns: (origin, direction) of the ray, from the near clipping plane;
+    the direction reaches the far clipping plane.
+    """
+    ndc_x = 2. * (x + .5) / width - 1.
+    ndc_y = 2. * (y + .5) / height - 1.
+    inverse = numpy.linalg.inv(numpy.dot(numpy.asarray(projection, dtype = numpy.float64),
+                                         numpy.asarray(view, dtype = numpy.float64)))
+    near, far = numpy.dot(inverse, [[ndc_x, ndc_x], [ndc_y, ndc_y], [-1., 1.], [1., 1.]]).T
+    near = near[:3] / near[3]
+    far = far[:3] / far[3]
+    return near, far - near
+
+class PickResult(object):
+    """
+    The nearest triangle hit by a picking ray.
+
+    Attributes
+    ----------
+    node:     the node of the mesh instance that is hit.
+    position: the position of the node in scene.flatten().nodes.
+    mesh:     the mesh that is hit.
+    face:     the index of the face in the mesh.
+    distance: the distance of the hit along the ray, in units of the
+              length of its direction.
+    point:    the hit point, in world space.
+    """
+    def __init__(self, node, position, mesh, face, distance, point):
+        self.node = node
+        self.position = position
+        self.mesh = mesh
+        self.face = face
+        self.distance = distance
+        self.point = point
+
+    def __repr__(self):
+        return "PickResult(%s, face %d, distance %g)" % (self.node, self.face, self.distance)
+
+class Picker(object):
+    """
+    Casts picking rays against the mesh instances of a scene.
+
+    :param scene: a scene from pyassimp.load() or SceneCache.load().
+    :param flat: the FlatScene giving the world transformations of the
+    nodes (scene.flatten() by default).
+    """
+    def __init__(self, scene, flat = None):
+        self.flat = flat if flat is not None else core.flatten(scene)
+
+        positions, meshes, lower, upper = [], [], [], []
+        for position, node in enumerate(self.flat.nodes):
+            for mesh in node.meshes:
+                box = helper.get_mesh_bounding_box(mesh)
+                if box is None:
+                    continue
+                positions.append(position)
+                meshes.append(mesh)
+                lower.append(box[0])
+                upper.append(box[1])
+
+        # the mesh instances, and their bounding boxes in local space
+        self.positions = numpy.array(positions, dtype = numpy.intp)
+        self.meshes = meshes
+        self.lower = numpy.array(lower, dtype = numpy.float64).reshape((-1, 3))
+        self.upper = numpy.array(upper, dtype = numpy.float64).reshape((-1, 3))
+        self._triangles = {}
+
+    def _mesh_triangles(self, mesh):
+        """ The faces of the triangles of a mesh, and their first vertices
+        and edges for the Möller-Trumbore test (computed once per mesh). """
+        try:
+            return self._triangles[id(mesh)]
+        except KeyError:
+            pass
+        faces, triangles = bvh._triangle_faces(mesh)
+        corners = numpy.asarray(mesh.vertices, dtype = numpy.float64)[triangles]
+        v0 = corners[:, 0]
+        result = self._triangles[id(mesh)] = (faces, v0, corners[:, 1] - v0, corners[:, 2] - v0)
+        return result
+
+    def intersect(self, origin, direction, tmax = numpy.inf):
+        """
+        The nearest triangle hit by a ray (in world space) before tmax, as
+        a PickResult, or None.
+        """
+        origin = numpy.asarray(origin, dtype = numpy.float64)
+        direction = numpy.asarray(direction, dtype = numpy.float64)
+        if not len(self.meshes):
+            return None
+
+        # the ray in the local space of every instance
+        inverse = numpy.linalg.pinv(self.flat.world[self.positions])
+        origins = numpy.einsum('nij,j->ni', inverse[:, :3, :3], origin) + inverse[:, :3, 3]
+        directions = numpy.einsum('nij,j->ni', inverse[:, :3, :3], direction)
+
+        # the affine transformations keep the parametrization of the ray:
+        # the distances are comparable across the instances
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            t0 = (self.lower - origins) / directions
+            t1 = (self.upper - origins) / directions
+        near = numpy.maximum(numpy.fmax.reduce(numpy.fmin(t0, t1), axis = 1), 0)
+        far = numpy.fmin.reduce(numpy.fmax(t0, t1), axis = 1)
+        candidates = numpy.flatnonzero((near <= far) & (near <= tmax))
+
+        best, result = tmax, None
+        for instance in candidates[numpy.argsort(near[candidates], kind = 'stable')]:
+            if near[instance] > best:
+                break
+            mesh = self.meshes[instance]
+            faces, v0, e1, e2 = self._mesh_triangles(mesh)
+            if not len(faces):
+                continue
+            valid, t, _, _ = bvh._moller_trumbore(numpy.broadcast_to(origins[instance], v0.shape),
+                                                   numpy.broadcast_to(directions[instance], v0.shape), v0, e1, e2)
+            with numpy.errstate(invalid = 'ignore'):
+                valid &= (t >= 0) & (t <= best)
+            if not valid.any():
+                continue
+            nearest = numpy.flatnonzero(valid)[numpy.argmin(t[valid])]
+            best = t[nearest]
+            position = self.positions[instance]
+            result = PickResult(self.flat.nodes[position], position, mesh, int(faces[nearest]), float(best),
+                                origin + best * direction)
+        return result
+
+    def pick(self, x, y, width, height, projection, view):
+        """
+        The nearest triangle under a pixel of a view (see screen_ray()), as
+        a PickResult, or None.
+        """
+        origin, direction = screen_ray(x, y, width, height, projection, view)
+        # the far clipping plane is at distance 1
+        return self.intersect(origin, direction, 1.)
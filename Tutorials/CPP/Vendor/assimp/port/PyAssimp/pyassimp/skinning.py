@@ -0,0 +1,115 @@
+#-*- coding: UTF-8 -*-
+
+"""
+CPU linear blend skinning.
+
+Deforms the vertices and normals of a skinned mesh with a set of bone
+matrices, using the fixed-width bone weights packed at load time
+(mesh.boneindices and mesh.boneweights):
+
+    from pyassimp import load
+    from pyassimp.animation import AnimationSampler
+    from pyassimp.skinning import skin
+
+    scene = load('walk.x')
+    mesh = scene.meshes[0]
+    sampler = AnimationSampler(scene)
+    matrices = sampler.skinning_matrices(mesh, [0.5])[0]
+    positions, normals = skin(mesh, matrices)
+
+Large meshes can be processed by chunks, optionally on several threads
+(numpy releases the GIL during the heavy operations).
+
+Requires numpy.
+"""
+
+import numpy
+
+try: from concurrent import futures
+except ImportError: futures = None
+
+import logging;logger = logging.getLogger("pyassimp")
+
+from .errors import AssimpError
+
+DEFAULT_CHUNK_SIZE = 65536
+
+def skin_arrays(vertices, normals, boneindices, boneweights, matrices,
+                out_vertices = None, out_normals = None):
+    """
+    Linear blend skinning of arrays.
+
+    :param vertices: (N, 3) positions
+    :param normals: (N, 3) normals, or None
+    :param boneindices: (N, K) indices of the bones in 'matrices'
+    :param boneweights: (N, K) weights of the bones. Vertices whose weights
+    sum to less than 1 keep the remainder of their rest position.
+    :param matrices: (B, 4, 4) bone matrices
+    :returns: (positions, normals) float32 arrays. normals is None if no
+    normals were given.
+    """
+    matrices = numpy.asarray(matrices, dtype = numpy.float32)
+    weights = numpy.asarray(boneweights, dtype = numpy.float32)
+
+    # per-vertex blended matrix (only the 3x4 affine part is needed)
+    blended = numpy.einsum('nk,nkij->nij', weights, matrices[boneindices][:, :, :3, :])
+    rest = 1 - weights.sum(axis = 1)
+    for i in range(3):
+        blended[:, i, i] += rest
+
+    linear = blended[:, :, :3]
+    positions = numpy.einsum('nij,nj->ni', linear, vertices, out = out_vertices)
+    positions += blended[:, :, 3]
+
+    if normals is None or not len(normals):
+        return positions, None
+    skinned = numpy.einsum('nij,nj->ni', linear, normals, out = out_normals)
+    length = numpy.sqrt((skinned ** 2).sum(axis = 1, keepdims = True))
+    numpy.divide(skinned, length, out = skinned, where = length > 0)
+    return positions, skinned
+
+def skin(mesh, matrices, threads = 1, chunk_size = DEFAULT_CHUNK_SIZE):
+    """
+    Deforms a mesh with a set of bone matrices, one per bone of the mesh
+    (as returned by AnimationSampler.skinning_matrices() for one frame).
+
+    :param threads: number of threads processing the chunks of vertices
+    :param chunk_size: number of vertices processed at once. Bounds the
+    size of the temporary arrays (about 100 bytes per vertex).
+    :returns: (positions, normals), float32 (N, 3) arrays. normals is
+    None if the mesh has no normals.
+    """
+    matrices = numpy.asarray(matrices, dtype = numpy.float32)
+    if len(matrices) != len(mesh.bones):
+        raise AssimpError("Expected %d bone matrices, got %d" % (len(mesh.bones), len(matrices)))
+
+    vertices = numpy.asarray(mesh.vertices, dtype = numpy.float32)
+    normals = numpy.asarray(mesh.normals, dtype = numpy.float32)
+    has_normals = len(normals) > 0
+
+    if not len(matrices):
+        return vertices.copy(), normals.copy() if has_normals else None
+
+    positions = numpy.empty((len(vertices), 3), dtype = numpy.float32)
+    skinned = numpy.empty((len(vertices), 3), dtype = numpy.float32) if has_normals else None
+
+    def process(start):
+        end = min(start + chunk_size, len(vertices))
+        skin_arrays(vertices[start:end],
+                    normals[start:end] if has_normals else None,
+                    mesh.boneindices[start:end],
+                    mesh.boneweights[start:end],
+                    matrices,
+                    positions[start:end],
+                    skinned[start:end] if has_normals else None)
+
+    starts = range(0, len(vertices), chunk_size)
+    if threads > 1 and len(starts) > 1 and futures is not None:
+        with futures.ThreadPoolExecutor(max_workers = threads) as pool:
+            # list() re-raises the exceptions of the workers
+            list(pool.map(process, starts))
+    else:
+        for start in starts:
+            process(start)
+
+    return positions, skinned
@@ -375,16 +375,17 @@ class Texture(Structure):
             ("mHeight", c_uint),
             
             # A hint from the loader to make it easier for applications
-            #  to determine the type of embedded compressed textures.
-            # If mHeight != 0 this member is undefined. Otherwise it
+            #  to determine the type of embedded textures.
+            # If mHeight != 0 it describes the format of the texels
+            # (e.g. 'argb8888'). Otherwise it
             # is set set to '\\0\\0\\0\\0' if the loader has no additional
             # information about the texture file format used OR the
             # file extension of the format without a trailing dot. If there
             # are multiple file extensions for a format, the shortest
             # extension is chosen (JPEG maps to 'jpg', not to 'jpeg').
             # E.g. 'dds\\0', 'pcx\\0', 'jpg\\0'.  All characters are lower-case.
-            # The fourth character will always be '\\0'.
-            ("achFormatHint", c_char*4),
+            # 8 characters and a terminating '\\0'.
+            ("achFormatHint", c_char*9),
             
             # Data of the texture.
             # Points to an array of mWidth
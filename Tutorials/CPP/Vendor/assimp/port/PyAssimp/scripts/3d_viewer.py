@@ -13,6 +13,7 @@ Based on:
 Authors: Séverin Lemaignan, 2012-2016
 """
 import sys
+import ctypes
 import logging
 
 logger = logging.getLogger("pyassimp")
@@ -27,7 +28,6 @@ OpenGL.ERROR_LOGGING = False
 # OpenGL.ERROR_ON_COPY = True
 # OpenGL.FULL_LOGGING = True
 from OpenGL.GL import *
-from OpenGL.arrays import vbo
 from OpenGL.GL import shaders
 
 import pygame
@@ -40,6 +40,9 @@ from numpy import linalg
 import pyassimp
 from pyassimp.postprocess import *
 from pyassimp.helper import *
+from pyassimp.picking import Picker
+from pyassimp.batching import interleave
+from pyassimp.culling import FrustumCuller, OUTSIDE
 import transformations
 
 ROTATION_180_X = numpy.array([[1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]], dtype=numpy.float32)
@@ -50,6 +53,23 @@ COLORS = "COLORS"
 SILHOUETTE = "SILHOUETTE"
 HELPERS = "HELPERS"
 
+# vertex layout of the meshes: the mesh attributes interleaved in their
+# vertex buffer, and the shader attributes they feed, at the same location
+# in all the shaders so that the vertex array objects work with any of them
+VERTEX_ATTRIBUTES = ("vertices", "normals", "texturecoords", "tangents")
+ATTRIBUTE_LOCATIONS = {"vertices": ("a_vertex", 0),
+                       "normals": ("a_normal", 1),
+                       "texturecoords": ("a_texcoord", 2),
+                       "tangents": ("a_tangent", 3)}
+
+# the faces of each size drawn by the viewer, with their GL primitive: the
+# polygons left by the post-processing are skipped
+PRIMITIVES = ((3, GL_TRIANGLES), (2, GL_LINES), (1, GL_POINTS))
+
+# picking methods
+RAYCAST = "RAYCAST"  # CPU ray cast against the meshes
+# COLORS: render the nodes in flat colors and read the pixel under the cursor back
+
 # Entities type
 ENTITY = "entity"
 CAMERA = "camera"
@@ -234,25 +254,46 @@ void main(void){
 DEFAULT_CLIP_PLANE_NEAR = 0.001
 DEFAULT_CLIP_PLANE_FAR = 1000.0
 
+DEFAULT_DIFFUSE = (0.8, 0.8, 0.8, 1.0)
+SELECTED_DIFFUSE = (1.0, 0.0, 0.0, 1.0)  # selected nodes in red
 
-def get_world_transform(scene, node):
-    if node == scene.rootnode:
-        return numpy.identity(4, dtype=numpy.float32)
 
-    parents = reversed(_get_parent_chain(scene, node, []))
-    parent_transform = reduce(numpy.dot, [p.transformation for p in parents])
-    return numpy.dot(parent_transform, node.transformation)
+class FrameState:
+    """ The render state of a frame: the nodes visible from the camera and
+    their matrices, computed at once when the frame starts, and the uniforms
+    last uploaded to each program, to skip redundant uploads between
+    consecutive draws.
+    """
 
+    def __init__(self, projection, view, world, culler):
+        view_projection = numpy.dot(projection, view)
+        self.view_projection = view_projection.astype(numpy.float32)
 
-def _get_parent_chain(scene, node, parents):
-    parent = node.parent
+        # frustum culling (see pyassimp.culling)
+        self.culling = culler.cull(view_projection)
+        visible = self.culling.visible
 
-    parents.append(parent)
+        # (N, 4, 4) model-view matrices, and the (N, 3, 3) normal matrices
+        # (inverse transpose of their linear part) of the visible nodes, in
+        # one batched inversion
+        self.model_views = numpy.zeros(world.shape, dtype=numpy.float32)
+        self.normal_matrices = numpy.zeros((len(world), 3, 3), dtype=numpy.float32)
+        if visible.any():
+            model_views = numpy.matmul(view, world[visible])
+            linear = model_views[:, :3, :3]
+            try:
+                inverses = linalg.inv(linear)
+            except linalg.LinAlgError:  # some singular (eg. zero scale) transformations
+                inverses = linalg.pinv(linear)
+            self.model_views[visible] = model_views
+            self.normal_matrices[visible] = inverses.transpose((0, 2, 1))
 
-    if parent == scene.rootnode:
-        return parents
+        self.diffuse = {}  # program -> last uploaded diffuse color
 
-    return _get_parent_chain(scene, parent, parents)
+    def set_diffuse(self, shader, diffuse):
+        if self.diffuse.get(shader) != diffuse:
+            glUniform4f(shader.u_materialDiffuse, *diffuse)
+            self.diffuse[shader] = diffuse
 
 
 class DefaultCamera:
@@ -277,10 +318,11 @@ class DefaultCamera:
 class PyAssimp3DViewer:
     base_name = "PyASSIMP 3D viewer"
 
-    def __init__(self, model, w=1024, h=768):
+    def __init__(self, model, w=1024, h=768, picking=RAYCAST):
 
         self.w = w
         self.h = h
+        self.picking = picking
 
         pygame.init()
         pygame.display.set_caption(self.base_name)
@@ -293,6 +335,12 @@ class PyAssimp3DViewer:
         self.scene = None
         self.meshes = {}  # stores the OpenGL vertex/faces/normals buffers pointers
 
+        self.flat = None  # the node hierarchy as arrays (see pyassimp.core.FlatScene)
+        self.world_transforms = None  # (N, 4, 4) float32 world transformation of each node
+        self.picker = None
+        self.frame = None  # FrameState of the frame being rendered
+        self.culler = None
+
         self.node2colorid = {}  # stores a color ID for each node. Useful for mouse picking and visibility checking
         self.colorid2node = {}  # reverse dict of node2colorid
 
@@ -321,7 +369,7 @@ class PyAssimp3DViewer:
         vertex = shaders.compileShader(BASIC_VERTEX_SHADER, GL_VERTEX_SHADER)
         fragment = shaders.compileShader(BASIC_FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
 
-        self.shader = shaders.compileProgram(vertex, fragment)
+        self.shader = self.link_program(vertex, fragment)
 
         self.set_shader_accessors(('u_modelMatrix',
                                    'u_viewProjectionMatrix',
@@ -333,7 +381,7 @@ class PyAssimp3DViewer:
 
         ### Flat shader
         flatvertex = shaders.compileShader(FLAT_VERTEX_SHADER, GL_VERTEX_SHADER)
-        self.flatshader = shaders.compileProgram(flatvertex, fragment)
+        self.flatshader = self.link_program(flatvertex, fragment)
 
         self.set_shader_accessors(('u_modelMatrix',
                                    'u_viewProjectionMatrix',
@@ -342,7 +390,7 @@ class PyAssimp3DViewer:
 
         ### Silhouette shader
         silh_vertex = shaders.compileShader(SILHOUETTE_VERTEX_SHADER, GL_VERTEX_SHADER)
-        self.silhouette_shader = shaders.compileProgram(silh_vertex, fragment)
+        self.silhouette_shader = self.link_program(silh_vertex, fragment)
 
         self.set_shader_accessors(('u_modelMatrix',
                                    'u_viewProjectionMatrix',
@@ -356,7 +404,7 @@ class PyAssimp3DViewer:
         ### Gooch shader
         gooch_vertex = shaders.compileShader(GOOCH_VERTEX_SHADER, GL_VERTEX_SHADER)
         gooch_fragment = shaders.compileShader(GOOCH_FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
-        self.gooch_shader = shaders.compileProgram(gooch_vertex, gooch_fragment)
+        self.gooch_shader = self.link_program(gooch_vertex, gooch_fragment)
 
         self.set_shader_accessors(('u_modelMatrix',
                                    'u_viewProjectionMatrix',
@@ -371,6 +419,18 @@ class PyAssimp3DViewer:
                                   ('a_vertex',
                                    'a_normal'), self.gooch_shader)
 
+    @staticmethod
+    def link_program(*shader_objects):
+        program = shaders.compileProgram(*shader_objects)
+
+        # relink with the attribute locations of the vertex array objects
+        for name, location in ATTRIBUTE_LOCATIONS.values():
+            glBindAttribLocation(program, location, name)
+        glLinkProgram(program)
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(glGetProgramInfoLog(program))
+        return program
+
     @staticmethod
     def set_shader_accessors(uniforms, attributes, shader):
         # add accessors to the shaders uniforms and attributes
@@ -393,22 +453,62 @@ class PyAssimp3DViewer:
 
         mesh.gl = {}
 
-        # Fill the buffer for vertex and normals positions
-        v = numpy.array(mesh.vertices, 'f')
-        n = numpy.array(mesh.normals, 'f')
+        # The whole vertex layout of the mesh is recorded once in a VAO:
+        # drawing the mesh then only takes binding it.
+        mesh.gl["vao"] = glGenVertexArrays(1)
+        glBindVertexArray(mesh.gl["vao"])
+
+        # Fill a single buffer with the interleaved vertex attributes,
+        # copied straight from the arrays of the mesh
+        vertices, layout = interleave(mesh, VERTEX_ATTRIBUTES)
+        stride = vertices.shape[1] * vertices.itemsize
+
+        mesh.gl["vbo"] = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, mesh.gl["vbo"])
+        glBufferData(GL_ARRAY_BUFFER, vertices, GL_STATIC_DRAW)
+
+        for attribute, offset, size in layout:
+            location = ATTRIBUTE_LOCATIONS[attribute][1]
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, False, stride,
+                                  ctypes.c_void_p(offset * vertices.itemsize))
+
+        # Fill the buffer for the faces, grouped by primitive: one draw call
+        # per primitive type found in the mesh, each over its own range
+        offsets = numpy.asarray(mesh.faceoffsets)
+        indices = numpy.asarray(mesh.indices, dtype=numpy.uint32)
+        sizes = numpy.diff(offsets)
+
+        groups = []
+        mesh.gl["draws"] = []
+        start, skipped = 0, len(sizes)
+        for size, primitive in PRIMITIVES:
+            starts = offsets[:-1][sizes == size]
+            if not len(starts):
+                continue
+            if len(starts) == len(sizes):
+                group = indices
+            else:
+                group = indices[starts[:, numpy.newaxis] + numpy.arange(size)].ravel()
+            groups.append(group)
+            mesh.gl["draws"].append((primitive, len(group), ctypes.c_void_p(start * group.itemsize)))
+            start += len(group)
+            skipped -= len(starts)
 
-        mesh.gl["vbo"] = vbo.VBO(numpy.hstack((v, n)))
+        if skipped:
+            logger.warning(str(mesh) + ": skipping " + str(skipped) + " polygons")
 
-        # Fill the buffer for vertex positions
         mesh.gl["faces"] = glGenBuffers(1)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, mesh.gl["faces"])
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER,
-                     numpy.array(mesh.faces, dtype=numpy.int32),
-                     GL_STATIC_DRAW)
+        if groups:
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, numpy.concatenate(groups), GL_STATIC_DRAW)
 
-        mesh.gl["nbfaces"] = len(mesh.faces)
+        # the material uniforms, as compared between consecutive draws
+        diffuse = mesh.material.diffuse
+        mesh.gl["diffuse"] = DEFAULT_DIFFUSE if diffuse is None else tuple(float(c) for c in diffuse)
 
-        # Unbind buffers
+        # Unbind the VAO first, so that it keeps its index buffer
+        glBindVertexArray(0)
         glBindBuffer(GL_ARRAY_BUFFER, 0)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
@@ -497,10 +597,31 @@ class PyAssimp3DViewer:
 
         self.glize(scene, scene.rootnode)
 
+        # world transformations of all the nodes, computed once, level by level.
+        # get_bounding_box() already flattened the scene: re-read the camera
+        # transformations replaced by glize()
+        self.flat = scene.flatten()
+        self.flat.update()
+        self.world_transforms = self.flat.world.astype(numpy.float32)
+        self.picker = Picker(scene, self.flat)
+        self.culler = FrustumCuller(scene, self.flat)
+
         # Finally release the model
         pyassimp.release(scene)
         logger.info("Ready for 3D rendering!")
 
+    def get_world_transform(self, node):
+        return self.world_transforms[self.flat.position(node)]
+
+    def invalidate_transform(self, node):
+        """ To call after changing the transformation of a node: updates
+        the cached world transformations of the node and its descendants.
+        """
+        self.flat.update([node])
+        subtree = self.flat.subtree(node)
+        self.world_transforms[subtree] = self.flat.world[subtree]
+        self.culler.update([node])
+
     def cycle_cameras(self):
 
         self.current_cam_index = (self.current_cam_index + 1) % len(self.cameras)
@@ -544,6 +665,9 @@ class PyAssimp3DViewer:
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
 
+    def begin_frame(self):
+        self.frame = FrameState(self.projection_matrix, self.view_matrix, self.world_transforms, self.culler)
+
     def render_colors(self):
 
         glEnable(GL_DEPTH_TEST)
@@ -552,44 +676,60 @@ class PyAssimp3DViewer:
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
         glEnable(GL_CULL_FACE)
 
+        self.begin_frame()
         glUseProgram(self.flatshader)
 
-        glUniformMatrix4fv(self.flatshader.u_viewProjectionMatrix, 1, GL_TRUE,
-                           numpy.dot(self.projection_matrix, self.view_matrix))
+        glUniformMatrix4fv(self.flatshader.u_viewProjectionMatrix, 1, GL_TRUE, self.frame.view_projection)
 
         self.recursive_render(self.scene.rootnode, self.flatshader, mode=COLORS)
 
+        glBindVertexArray(0)
         glUseProgram(0)
 
     def get_hovered_node(self, mousex, mousey):
         """
-        Attention: The performances of this method relies heavily on the size of the display!
+        Returns the node under the mouse (in window coordinates, from the
+        bottom-left corner), or None.
+
+        With the RAYCAST picking method, a ray is cast from the camera
+        through the cursor and intersected with the meshes on the CPU (see
+        pyassimp.picking): nothing is rendered. With COLORS, the pixel under
+        the cursor is rendered in flat colors and read back.
         """
 
         # mouse out of the window?
         if mousex < 0 or mousex >= self.w or mousey < 0 or mousey >= self.h:
             return None
 
-        self.render_colors()
-        # Capture image from the OpenGL buffer
-        buf = (GLubyte * (3 * self.w * self.h))(0)
-        glReadPixels(0, 0, self.w, self.h, GL_RGB, GL_UNSIGNED_BYTE, buf)
+        if self.picking == COLORS:
+            return self.get_hovered_node_colorid(mousex, mousey)
 
-        # Reinterpret the RGB pixel buffer as a 1-D array of 24bits colors
-        a = numpy.ndarray(len(buf), numpy.dtype('>u1'), buf)
-        colors = numpy.zeros(len(buf) / 3, numpy.dtype('<u4'))
-        for i in range(3):
-            colors.view(dtype='>u1')[i::4] = a.view(dtype='>u1')[i::3]
+        result = self.picker.pick(mousex, mousey, self.w, self.h, self.projection_matrix, self.view_matrix)
+        return result.node if result else None
 
-        colorid = colors[mousex + mousey * self.w]
+    def get_hovered_node_colorid(self, mousex, mousey):
+
+        # only rasterize the pixel under the cursor
+        glEnable(GL_SCISSOR_TEST)
+        glScissor(mousex, mousey, 1, 1)
+
+        self.render_colors()
+        buf = (GLubyte * 3)(0)
+        glReadPixels(mousex, mousey, 1, 1, GL_RGB, GL_UNSIGNED_BYTE, buf)
 
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glDisable(GL_SCISSOR_TEST)
+
+        r, g, b = buf
+        colorid = r | (g << 8) | (b << 16)
 
         if colorid in self.colorid2node:
             return self.colorid2node[colorid]
 
     def render(self, wireframe=False, twosided=False):
 
+        self.begin_frame()
+
         glEnable(GL_DEPTH_TEST)
         glDepthFunc(GL_LEQUAL)
 
@@ -611,11 +751,11 @@ class PyAssimp3DViewer:
             glUseProgram(shader)
             glUniform1f(shader.u_bordersize, 0.01)
 
-            glUniformMatrix4fv(shader.u_viewProjectionMatrix, 1, GL_TRUE,
-                               numpy.dot(self.projection_matrix, self.view_matrix))
+            glUniformMatrix4fv(shader.u_viewProjectionMatrix, 1, GL_TRUE, self.frame.view_projection)
 
             self.recursive_render(self.scene.rootnode, shader, mode=SILHOUETTE)
 
+            glBindVertexArray(0)
             glUseProgram(0)
 
         ### Then, inner shading
@@ -640,11 +780,11 @@ class PyAssimp3DViewer:
             glUseProgram(shader)
             glUniform3f(shader.u_lightPos, -.5, -.5, .5)
 
-        glUniformMatrix4fv(shader.u_viewProjectionMatrix, 1, GL_TRUE,
-                           numpy.dot(self.projection_matrix, self.view_matrix))
+        glUniformMatrix4fv(shader.u_viewProjectionMatrix, 1, GL_TRUE, self.frame.view_projection)
 
         self.recursive_render(self.scene.rootnode, shader)
 
+        glBindVertexArray(0)
         glUseProgram(0)
 
     def render_axis(self,
@@ -759,20 +899,15 @@ class PyAssimp3DViewer:
             glVertex3f(10.0, i, 0.0)
         glEnd()
 
-    def recursive_render(self, node, shader, mode=BASE, with_normals=True):
+    def recursive_render(self, node, shader, mode=BASE):
         """ Main recursive rendering method.
         """
 
-        normals = with_normals
-
-        if mode == COLORS:
-            normals = False
-
-
         if not hasattr(node, "selected"):
             node.selected = False
 
-        m = get_world_transform(self.scene, node)
+        position = self.flat.position(node)
+        m = self.world_transforms[position]
 
         # HELPERS mode
         ###
@@ -792,69 +927,39 @@ class PyAssimp3DViewer:
 
         # Mesh rendering modes
         ###
-        if node.type == MESH:
-
-            for mesh in node.meshes:
-
-                stride = 24  # 6 * 4 bytes
-
-                if node.selected and mode == SILHOUETTE:
-                    glUniform4f(shader.u_materialDiffuse, 1.0, 0.0, 0.0, 1.0)
-                    glUniformMatrix4fv(shader.u_modelViewMatrix, 1, GL_TRUE,
-                                       numpy.dot(self.view_matrix, m))
-
-                else:
-                    if mode == COLORS:
-                        colorid = self.node2colorid[node.name]
-                        r, g, b = self.get_rgb_from_colorid(colorid)
-                        glUniform4f(shader.u_materialDiffuse, r / 255.0, g / 255.0, b / 255.0, 1.0)
-                    elif mode == SILHOUETTE:
-                        glUniform4f(shader.u_materialDiffuse, .0, .0, .0, 1.0)
-                    else:
-                        if node.selected:
-                            diffuse = (1.0, 0.0, 0.0, 1.0)  # selected nodes in red
-                        else:
-                            diffuse = mesh.material.properties["diffuse"]
-                        if len(diffuse) == 3:  # RGB instead of expected RGBA
-                            diffuse.append(1.0)
-                        glUniform4f(shader.u_materialDiffuse, *diffuse)
-                        # if ambient:
-                        #    glUniform4f( shader.Material_ambient, *mat["ambient"] )
-
-                if mode == BASE:  # not in COLORS or SILHOUETTE
-                    normal_matrix = linalg.inv(numpy.dot(self.view_matrix, m)[0:3, 0:3]).transpose()
-                    glUniformMatrix3fv(shader.u_normalMatrix, 1, GL_TRUE, normal_matrix)
-
-                glUniformMatrix4fv(shader.u_modelMatrix, 1, GL_TRUE, m)
-
-                vbo = mesh.gl["vbo"]
-                vbo.bind()
+        frame = self.frame
 
-                glEnableVertexAttribArray(shader.a_vertex)
-                if normals:
-                    glEnableVertexAttribArray(shader.a_normal)
+        # nothing to draw in the whole subtree
+        if frame.culling.states[position] == OUTSIDE:
+            return
 
-                glVertexAttribPointer(
-                    shader.a_vertex,
-                    3, GL_FLOAT, False, stride, vbo
-                )
+        if node.type == MESH and frame.culling.visible[position]:
 
-                if normals:
-                    glVertexAttribPointer(
-                        shader.a_normal,
-                        3, GL_FLOAT, False, stride, vbo + 12
-                    )
+            # the matrices of the node, computed for all the visible nodes at the start of the frame
+            glUniformMatrix4fv(shader.u_modelMatrix, 1, GL_TRUE, m)
+            if mode == BASE:  # not in COLORS or SILHOUETTE
+                glUniformMatrix3fv(shader.u_normalMatrix, 1, GL_TRUE, frame.normal_matrices[position])
+            elif mode == SILHOUETTE and node.selected:
+                glUniformMatrix4fv(shader.u_modelViewMatrix, 1, GL_TRUE, frame.model_views[position])
 
-                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, mesh.gl["faces"])
-                glDrawElements(GL_TRIANGLES, mesh.gl["nbfaces"] * 3, GL_UNSIGNED_INT, None)
+            for mesh in node.meshes:
 
-                vbo.unbind()
-                glDisableVertexAttribArray(shader.a_vertex)
+                if mode == COLORS:
+                    r, g, b = self.get_rgb_from_colorid(self.node2colorid[node.name])
+                    diffuse = (r / 255.0, g / 255.0, b / 255.0, 1.0)
+                elif mode == SILHOUETTE:
+                    diffuse = SELECTED_DIFFUSE if node.selected else (.0, .0, .0, 1.0)
+                elif node.selected:
+                    diffuse = SELECTED_DIFFUSE
+                else:
+                    diffuse = mesh.gl["diffuse"]
 
-                if normals:
-                    glDisableVertexAttribArray(shader.a_normal)
+                # only uploaded when it differs from the previous draw
+                frame.set_diffuse(shader, diffuse)
 
-                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+                glBindVertexArray(mesh.gl["vao"])
+                for primitive, count, offset in mesh.gl["draws"]:
+                    glDrawElements(primitive, count, GL_UNSIGNED_INT, offset)
 
         for child in node.children:
             self.recursive_render(child, shader, mode)
@@ -1037,6 +1142,9 @@ class PyAssimp3DViewer:
         if zooming_one_shot:
             self.is_zooming = False
 
+        if self.current_cam is not self.default_camera:
+            self.invalidate_transform(self.current_cam)
+
         self.update_view_camera()
 
     def update_view_camera(self):
@@ -1053,6 +1161,7 @@ class PyAssimp3DViewer:
     def move_selected_node(self, up, strafe):
         self.currently_selected.transformation[0][3] += strafe
         self.currently_selected.transformation[2][3] += up
+        self.invalidate_transform(self.currently_selected)
 
     @staticmethod
     def showtext(text, x=0, y=0, z=0, size=20):
@@ -1089,6 +1198,10 @@ def main(model, width, height):
         ## GUI text display
         app.switch_to_overlay()
         app.showtext("Active camera: %s" % str(app.current_cam), 10, app.h - 30)
+        culling = app.frame.culling
+        app.showtext("Culled: %d/%d nodes, %d/%d triangles" % (culling.nodes_culled, culling.nodes,
+                                                              culling.triangles_culled, culling.triangles),
+                     10, 10)
         if app.currently_selected:
             app.showtext("Selected node: %s" % app.currently_selected, 10, app.h - 50)
             pos = app.h - 70
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Checks the static batching of pyassimp.batching against the meshes of a
+scene, without opening a window.
+
+Every mesh instance of the scene (a node and one of its meshes) must be in
+the batch of its material exactly once, and the triangles drawn for it
+must be the triangles of the mesh with the world transformation of the
+node applied: same corners, same winding (reversed for mirroring
+transformations), normals transformed by the inverse transpose and the
+first set of texture coordinates. The world transformations are recomputed
+by walking the node hierarchy, independently of scene.flatten(). Batch.ranges()
+must draw exactly the indices of the instances it is given.
+
+Without a model, a scene of a few meshes (with quads, lines and points
+mixed in the triangles) instanced under random, mirrored and non-uniformly
+scaled transformations is generated:
+
+    $ python batching_check.py
+    $ python batching_check.py ../../../test/models/Collada/duck.dae
+"""
+
+import sys
+import argparse
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+import numpy
+
+import pyassimp
+from pyassimp.builder import SceneBuilder
+from pyassimp.batching import batch_scene
+
+ATTRIBUTES = ("vertices", "normals", "texturecoords")
+
+def generated_scene(meshes, nodes):
+    """ 'meshes' random meshes with 3 materials, instanced 'nodes' times
+    in a random hierarchy. """
+    rng = numpy.random.RandomState(0)
+    builder = SceneBuilder()
+    materials = [builder.add_material("material_%d" % i, diffuse = rng.rand(3)) for i in range(3)]
+    indices = []
+    for i in range(meshes):
+        vertices = rng.randn(30, 3)
+        faces = [list(rng.choice(30, 3, replace = False)) for _ in range(20)]
+        if i % 2:
+            # faces that are not batched
+            faces += [list(rng.choice(30, size, replace = False)) for size in (1, 2, 4, 2, 1)]
+            rng.shuffle(faces)
+        normals = rng.randn(30, 3)
+        normals /= numpy.linalg.norm(normals, axis = 1)[:, numpy.newaxis]
+        indices.append(builder.add_mesh(vertices, faces, normals = normals, texturecoords = rng.rand(30, 2),
+                                        material = materials[i % len(materials)], name = "mesh_%d" % i))
+
+    added = [builder.add_node("root")]
+    for i in range(nodes):
+        transformation = numpy.identity(4)
+        transformation[:3, :3] = numpy.dot(numpy.linalg.qr(rng.randn(3, 3))[0], numpy.diag(.5 + rng.rand(3)))
+        transformation[:3, 3] = 10 * rng.randn(3)
+        if i % 3 == 0:
+            transformation[:, 0] *= -1
+        chosen = rng.choice(indices, rng.randint(3), replace = False)
+        added.append(builder.add_node("node_%d" % i, parent = added[rng.randint(len(added))],
+                                      meshes = list(chosen), transformation = transformation))
+    return builder.build()
+
+def instances(scene):
+    """ The (node, mesh, world transformation) of all the mesh instances,
+    walking the hierarchy from the root. """
+    result = []
+    stack = [(scene.rootnode, numpy.identity(4))]
+    while stack:
+        node, parent = stack.pop()
+        world = numpy.dot(parent, numpy.asarray(node.transformation, dtype = numpy.float64))
+        result.extend((node, mesh, world) for mesh in node.meshes)
+        stack.extend((child, world) for child in node.children)
+    return result
+
+def expected_triangles(mesh, world):
+    """ The world-space attributes of the corners of the triangles of an
+    instance, as (T, 3, components) arrays, face by face. """
+    offsets = numpy.asarray(mesh.faceoffsets)
+    indices = numpy.asarray(mesh.indices)
+    triangles = [indices[start:end] for start, end in zip(offsets[:-1], offsets[1:]) if end - start == 3]
+    triangles = numpy.array(triangles, dtype = numpy.intp).reshape((-1, 3))
+    if numpy.linalg.det(world[:3, :3]) < 0:
+        triangles = triangles[:, ::-1]
+
+    vertices = numpy.asarray(mesh.vertices, dtype = numpy.float64)
+    expected = {"vertices": numpy.dot(vertices, world[:3, :3].T) + world[:3, 3]}
+    if mesh.normals is not None and len(mesh.normals):
+        normals = numpy.dot(mesh.normals, numpy.linalg.inv(world[:3, :3]))
+        length = numpy.linalg.norm(normals, axis = 1)[:, numpy.newaxis]
+        # degenerate normals stay zero
+        expected["normals"] = normals / numpy.where(length > 0, length, 1)
+    if mesh.texturecoords is not None and len(mesh.texturecoords):
+        expected["texturecoords"] = numpy.asarray(mesh.texturecoords[0])[:, :2]
+    return dict((name, value[triangles]) for name, value in expected.items())
+
+def check(scene, batches):
+    """ Returns the list of the errors of the batches of a scene. """
+    errors = []
+    found = {}
+    for batch in batches:
+        for (node, mesh), (first, count) in zip(batch.sources, batch.draws):
+            found.setdefault((id(node), id(mesh)), []).append((batch, first, count))
+
+    for node, mesh, world in instances(scene):
+        draws = found.pop((id(node), id(mesh)), [])
+        if len(draws) != 1:
+            errors.append("%s/%s: batched %d times" % (node, mesh, len(draws)))
+            continue
+        batch, first, count = draws[0]
+        if batch.materialindex != mesh.materialindex:
+            errors.append("%s/%s: in the batch of material %d instead of %d" % (node, mesh, batch.materialindex,
+                                                                              mesh.materialindex))
+        drawn = batch.indices[first:first + count]
+        for name, value in expected_triangles(mesh, world).items():
+            actual = batch.attribute(name)[drawn].reshape(value.shape)
+            scale = max(1., numpy.abs(value).max())
+            if actual.shape != value.shape or not numpy.allclose(actual, value, rtol = 0, atol = 1e-5 * scale):
+                errors.append("%s/%s: wrong %s" % (node, mesh, name))
+    for draws in found.values():
+        errors.append("%d instances not in the scene" % len(draws))
+
+    rng = numpy.random.RandomState(0)
+    for batch in batches:
+        mask = rng.rand(len(batch.draws)) < .5
+        drawn = [batch.indices[first:first + count] for first, count in batch.ranges(mask)]
+        expected = [batch.indices[first:first + count] for first, count in batch.draws[mask]]
+        if not numpy.array_equal(numpy.concatenate(drawn + [[]]), numpy.concatenate(expected + [[]])):
+            errors.append("%s: ranges() does not draw the selected instances" % batch)
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description = "Checks the batches of a scene against its meshes.")
+    parser.add_argument("model", nargs = "?", help = "model to load (default: a generated scene)")
+    parser.add_argument("--meshes", type = int, default = 8)
+    parser.add_argument("--nodes", type = int, default = 200)
+    args = parser.parse_args()
+
+    if args.model:
+        scene = pyassimp.load(args.model)
+    else:
+        scene = generated_scene(args.meshes, args.nodes)
+
+    try:
+        batches = batch_scene(scene, ATTRIBUTES)
+        for batch in batches:
+            print(batch)
+        errors = check(scene, batches)
+        for error in errors:
+            print("  " + error)
+        print("%d batches, %d instances, %d errors" % (len(batches), sum(len(b.draws) for b in batches), len(errors)))
+        return 1 if errors else 0
+    finally:
+        if args.model:
+            pyassimp.release(scene)
+
+if __name__ == "__main__":
+    sys.exit(main())
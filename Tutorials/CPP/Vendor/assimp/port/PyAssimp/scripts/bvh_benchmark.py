@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Benchmarks the construction of BVHs (pyassimp.bvh) and the ray queries
+against them.
+
+Without a model, a noisy terrain of the requested size is generated. Rays
+are shot from random points above the scene, towards random points of its
+bounding box:
+
+    $ python bvh_benchmark.py --triangles 1000000 --rays 100000
+    $ python bvh_benchmark.py ../../../test/models/PLY/Wuson.ply
+"""
+
+import sys
+import time
+import argparse
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+import numpy
+
+import pyassimp
+from pyassimp import bvh
+
+def terrain(triangles):
+    rows = max(2, int((triangles / 2.) ** .5) + 1)
+    x, y = numpy.meshgrid(numpy.linspace(0, 1, rows), numpy.linspace(0, 1, rows))
+    z = .1 * numpy.sin(10 * x) * numpy.cos(7 * y) + .01 * numpy.random.RandomState(0).standard_normal(x.shape)
+    vertices = numpy.stack((x, y, z), axis = -1).reshape((-1, 3)).astype(numpy.float32)
+
+    grid = numpy.arange(len(vertices)).reshape(x.shape)
+    a, b, c, d = grid[:-1, :-1].ravel(), grid[1:, :-1].ravel(), grid[:-1, 1:].ravel(), grid[1:, 1:].ravel()
+    return vertices, numpy.concatenate((numpy.stack((a, b, c), axis = 1), numpy.stack((c, b, d), axis = 1)))
+
+def rays(lower, upper, count):
+    rng = numpy.random.RandomState(1)
+    size = upper - lower
+    origins = lower + size * rng.rand(count, 3)
+    origins[:, 2] = upper[2] + size.max()
+    targets = lower + size * rng.rand(count, 3)
+    return origins, targets - origins
+
+def timed(label, function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    elapsed = time.time() - start
+    print("  %-12s %8.3fs" % (label, elapsed))
+    return result, elapsed
+
+def benchmark(build, nb_rays):
+    tree, _ = timed("build", build)
+    print("  %s" % tree)
+
+    if not len(tree.triangles):
+        return
+    lower, upper = tree.bounds[0]
+    origins, directions = rays(lower, upper, nb_rays)
+    hits, elapsed = timed("nearest hit", tree.intersect, origins, directions)
+    print("  %d/%d rays hit, %.0f rays per second" % (hits.mask.sum(), nb_rays, nb_rays / max(elapsed, 1e-9)))
+    occluded, elapsed = timed("any hit", tree.occluded, origins, directions)
+    print("  %.0f rays per second" % (nb_rays / max(elapsed, 1e-9)))
+    assert (occluded == hits.mask).all()
+
+    start = time.time()
+    for i in range(min(nb_rays, 100)):
+        tree.intersect(origins[i], directions[i])
+    print("  single ray   %8.3fms" % (1000 * (time.time() - start) / min(nb_rays, 100)))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the construction of BVHs and ray queries.")
+    parser.add_argument("model", nargs = "?", help = "model to load (default: a generated terrain)")
+    parser.add_argument("--triangles", type = int, default = 1000000, help = "size of the generated terrain")
+    parser.add_argument("--rays", type = int, default = 10000, help = "number of rays per packet")
+    parser.add_argument("--leaf-size", type = int, default = bvh.DEFAULT_LEAF_SIZE)
+    args = parser.parse_args()
+
+    if args.model is None:
+        vertices, triangles = terrain(args.triangles)
+        print("terrain: %d vertices, %d triangles" % (len(vertices), len(triangles)))
+        benchmark(lambda: bvh.build(vertices, triangles, args.leaf_size), args.rays)
+        return
+
+    with pyassimp.load(args.model) as scene:
+        print("%s: %d meshes" % (args.model, len(scene.meshes)))
+        benchmark(lambda: bvh.build_scene(scene, args.leaf_size), args.rays)
+
+if __name__ == "__main__":
+    main()
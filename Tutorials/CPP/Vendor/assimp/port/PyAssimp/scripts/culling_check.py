@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Checks the view-frustum culling of pyassimp.culling along scripted camera
+paths, without opening a window.
+
+For every camera of the path, the nodes culled by FrustumCuller must have
+all their vertices outside one of the planes of the frustum, and the
+hierarchical traversal must agree with testing the boxes of all the nodes
+one by one. The culling statistics of each camera are printed; the script
+exits with an error if a check failed. Nodes are then moved at random:
+refitting their subtrees (FrustumCuller.update(nodes)) must give the same
+boxes as recomputing all of them.
+
+Without a model, a city of instanced buildings (grouped in districts) is
+generated. The paths are an orbit around the scene, a walk through its
+streets and a turn on the spot at its center, or a JSON file holding a
+list of [eye, target] pairs:
+
+    $ python culling_check.py --path street --frames 50
+    $ python culling_check.py ../../../test/models/OBJ/spider.obj --path orbit
+    $ python culling_check.py --path my_path.json
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+import numpy
+
+import pyassimp
+from pyassimp.builder import SceneBuilder
+from pyassimp.culling import FrustumCuller, frustum_planes, classify_boxes, OUTSIDE
+
+PATHS = ("orbit", "street", "turn")
+
+CUBE_VERTICES = numpy.array([(x, y, z) for x in (-.5, .5) for y in (-.5, .5) for z in (0, 1)], dtype = numpy.float32)
+CUBE_FACES = numpy.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                          [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]], dtype = numpy.uint32)
+
+def city(districts, buildings):
+    """ A districts x districts grid of districts, each made of
+    buildings x buildings cubes of random heights. """
+    rng = numpy.random.RandomState(0)
+    builder = SceneBuilder()
+    cube = builder.add_mesh(CUBE_VERTICES, CUBE_FACES, name = "building")
+    root = builder.add_node("city")
+    size = 2. * buildings
+    for i in range(districts):
+        for j in range(districts):
+            offset = numpy.identity(4)
+            offset[:2, 3] = (i * (size + 4), j * (size + 4))
+            district = builder.add_node("district_%d_%d" % (i, j), parent = root, transformation = offset)
+            for k in range(buildings):
+                for l in range(buildings):
+                    transformation = numpy.diag([1.5, 1.5, 1 + 10 * rng.rand(), 1.])
+                    transformation[:2, 3] = (2 * k, 2 * l)
+                    builder.add_node("building_%d_%d" % (k, l), parent = district, meshes = [cube],
+                                     transformation = transformation)
+    return builder.build()
+
+def perspective(fov, aspect, znear, zfar):
+    """ The projection matrix of glFrustum, as set up by the viewers. """
+    h = znear * math.tan(fov / 2.)
+    w = h * aspect
+    return numpy.array([[znear / w, 0, 0, 0],
+                        [0, znear / h, 0, 0],
+                        [0, 0, -(zfar + znear) / (zfar - znear), -2 * zfar * znear / (zfar - znear)],
+                        [0, 0, -1, 0]])
+
+def look_at(eye, target, up = (0, 0, 1)):
+    forward = numpy.subtract(target, eye, dtype = numpy.float64)
+    forward /= numpy.linalg.norm(forward)
+    side = numpy.cross(forward, up)
+    side /= numpy.linalg.norm(side)
+    view = numpy.identity(4)
+    view[0, :3] = side
+    view[1, :3] = numpy.cross(side, forward)
+    view[2, :3] = -forward
+    view[:3, 3] = -numpy.dot(view[:3, :3], eye)
+    return view
+
+def camera_path(name, lower, upper, frames):
+    """ The (eye, target) pairs of a scripted path around a scene. """
+    center = (lower + upper) / 2
+    radius = numpy.linalg.norm(upper - lower) / 2
+    angles = numpy.linspace(0, 2 * math.pi, frames, endpoint = False)
+    if name == "orbit":
+        return [(center + radius * numpy.array([1.5 * math.cos(a), 1.5 * math.sin(a), .5]), center) for a in angles]
+    if name == "street":
+        height = lower[2] + .01 * radius
+        start = numpy.array([lower[0] - 1, center[1], height])
+        end = numpy.array([upper[0] + 1, center[1], height])
+        return [(start + t * (end - start), start + t * (end - start) + (1, 0, 0))
+                for t in numpy.linspace(0, 1, frames)]
+    if name == "turn":
+        return [(center, center + (math.cos(a), math.sin(a), 0)) for a in angles]
+    with open(name) as f:
+        return [(numpy.array(eye, dtype = numpy.float64), numpy.array(target, dtype = numpy.float64))
+                for eye, target in json.load(f)]
+
+def world_vertices(culler):
+    """ The world-space vertices of the meshes of each node. """
+    vertices = {}
+    for position, node in enumerate(culler.flat.nodes):
+        world = culler.flat.world[position]
+        points = [numpy.dot(mesh.vertices, world[:3, :3].T) + world[:3, 3] for mesh in node.meshes if len(mesh.vertices)]
+        if points:
+            vertices[position] = numpy.concatenate(points)
+    return vertices
+
+def check(culler, vertices, matrix, result):
+    """ Returns the list of the errors of a culling result. """
+    errors = []
+    planes = frustum_planes(matrix)
+
+    # the hierarchy only skips tests: same result as testing all the nodes
+    expected = classify_boxes(planes, culler.lower, culler.upper) != OUTSIDE
+    expected &= culler.triangles >= 0
+    for position in numpy.flatnonzero(expected != result.visible):
+        errors.append("node %s: visible %s, expected %s" % (culler.flat.nodes[position],
+                                                            result.visible[position], expected[position]))
+
+    # culled nodes are entirely outside one of the planes
+    for position, points in vertices.items():
+        if result.visible[position]:
+            continue
+        distances = numpy.dot(points, planes[:, :3].T) + planes[:, 3]
+        scale = 1e-6 * max(1., numpy.abs(points).max())
+        if not (distances < scale).all(axis = 0).any():
+            errors.append("node %s is culled but visible" % culler.flat.nodes[position])
+    return errors
+
+def check_moves(scene, culler, moves):
+    """ Moves random nodes; returns the number of partial updates that
+    disagree with a full one. """
+    flat = culler.flat
+    reference = FrustumCuller(scene, flat)
+    rng = numpy.random.RandomState(0)
+    size = numpy.linalg.norm(culler.subtree_upper[0] - culler.subtree_lower[0])
+    failures = 0
+    for move in range(moves):
+        node = flat.nodes[rng.randint(len(flat.nodes))]
+        transformation = numpy.array(node.transformation, dtype = numpy.float64)
+        transformation[:3, 3] += .1 * size * rng.randn(3)
+        flat.set_transformation(node, transformation)
+        culler.update([node])
+        reference.update()
+        if not all(numpy.array_equal(getattr(culler, name), getattr(reference, name))
+                   for name in ("lower", "upper", "subtree_lower", "subtree_upper")):
+            print("move %3d: the boxes of %s and its ancestors are wrong" % (move, node))
+            failures += 1
+    print("%d moves, %d failed" % (moves, failures))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description = "Checks the view-frustum culling along camera paths.")
+    parser.add_argument("model", nargs = "?", help = "model to load (default: a generated city)")
+    parser.add_argument("--path", default = "street", help = "one of %s, or a JSON file of [eye, target] pairs" % (PATHS,))
+    parser.add_argument("--frames", type = int, default = 24, help = "number of cameras of the generated paths")
+    parser.add_argument("--fov", type = float, default = 70., help = "horizontal field of view, in degrees")
+    parser.add_argument("--districts", type = int, default = 8)
+    parser.add_argument("--buildings", type = int, default = 8, help = "buildings per district side")
+    parser.add_argument("--moves", type = int, default = 50, help = "number of random node moves")
+    args = parser.parse_args()
+
+    if args.model:
+        scene = pyassimp.load(args.model)
+    else:
+        scene = city(args.districts, args.buildings)
+
+    try:
+        culler = FrustumCuller(scene)
+        vertices = world_vertices(culler)
+        lower, upper = culler.subtree_lower[0], culler.subtree_upper[0]
+        projection = perspective(math.radians(args.fov), 4 / 3., 1e-3 * numpy.linalg.norm(upper - lower),
+                                 10 * numpy.linalg.norm(upper - lower))
+
+        failures = 0
+        elapsed = 0
+        for frame, (eye, target) in enumerate(camera_path(args.path, lower, upper, args.frames)):
+            matrix = numpy.dot(projection, look_at(eye, target))
+            start = time.time()
+            result = culler.cull(matrix)
+            elapsed += time.time() - start
+            errors = check(culler, vertices, matrix, result)
+            print("camera %3d: %s%s" % (frame, result, " FAILED" if errors else ""))
+            for error in errors:
+                print("  " + error)
+            failures += bool(errors)
+
+        print("%d cameras, %d nodes, %.2fms per cull, %d failed" % (frame + 1, len(culler.flat.nodes),
+                                                                     1000 * elapsed / (frame + 1), failures))
+        failures += check_moves(scene, culler, args.moves)
+        return 1 if failures else 0
+    finally:
+        if args.model:
+            pyassimp.release(scene)
+
+if __name__ == "__main__":
+    sys.exit(main())
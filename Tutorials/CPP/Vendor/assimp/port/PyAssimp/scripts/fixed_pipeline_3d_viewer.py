@@ -8,7 +8,10 @@ render objects with OpenGL.
 'q' to quit
 
 This example mixes 'old' OpenGL fixed-function pipeline with 
-Vertex Buffer Objects.
+Vertex Buffer Objects. The meshes are merged per material
+(see pyassimp.batching), so that the whole scene is drawn with
+one draw call per material. The mesh instances outside of the
+view frustum are skipped (see pyassimp.culling).
 
 Materials are supported but textures are currently ignored.
 
@@ -33,11 +36,14 @@ import logging;logger = logging.getLogger("pyassimp_opengl")
 logging.basicConfig(level=logging.INFO)
 
 import math
+import ctypes
 import numpy
 
 import pyassimp
 from pyassimp.postprocess import *
 from pyassimp.helper import *
+from pyassimp.batching import batch_scene
+from pyassimp.culling import FrustumCuller
 
 
 name = 'pyassimp OpenGL viewer'
@@ -48,6 +54,9 @@ class GLRenderer():
     def __init__(self):
 
         self.scene = None
+        self.batches = []
+        self.culler = None
+        self.culling = None  # CullResult of the last frame
 
         self.using_fixed_cam = False
         self.current_cam_index = 0
@@ -60,34 +69,26 @@ class GLRenderer():
         self.prev_fps_time = 0
         self.frames = 0
 
-    def prepare_gl_buffers(self, mesh):
-        """ Creates 3 buffer objets for each mesh, 
-        to store the vertices, the normals, and the faces
-        indices.
+    def prepare_gl_buffers(self, batch):
+        """ Creates 2 buffer objets for each batch, 
+        to store the interleaved vertices and normals, and
+        the faces indices.
         """
 
-        mesh.gl = {}
+        batch.gl = {}
 
-        # Fill the buffer for vertex positions
-        mesh.gl["vertices"] = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, mesh.gl["vertices"])
+        # Fill the buffer for vertex positions and normals
+        batch.gl["vertices"] = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, batch.gl["vertices"])
         glBufferData(GL_ARRAY_BUFFER, 
-                    mesh.vertices,
+                    batch.vertices,
                     GL_STATIC_DRAW)
 
-        # Fill the buffer for normals
-        mesh.gl["normals"] = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, mesh.gl["normals"])
-        glBufferData(GL_ARRAY_BUFFER, 
-                    mesh.normals,
-                    GL_STATIC_DRAW)
-
-
-        # Fill the buffer for vertex positions
-        mesh.gl["triangles"] = glGenBuffers(1)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, mesh.gl["triangles"])
+        # Fill the buffer for the triangles
+        batch.gl["triangles"] = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, batch.gl["triangles"])
         glBufferData(GL_ELEMENT_ARRAY_BUFFER, 
-                    mesh.faces,
+                    batch.indices,
                     GL_STATIC_DRAW)
 
         # Unbind buffers
@@ -113,8 +114,19 @@ class GLRenderer():
 
         self.scene_center = [(a + b) / 2. for a, b in zip(self.bb_min, self.bb_max)]
 
-        for index, mesh in enumerate(scene.meshes):
-            self.prepare_gl_buffers(mesh)
+        # merge the meshes per material, with the node transformations baked in
+        self.batches = batch_scene(scene, attributes = ("vertices", "normals"))
+        logger.info("  draw calls: %d (%d mesh instances)" % (len(self.batches),
+                                                             sum(len(b.draws) for b in self.batches)))
+
+        for batch in self.batches:
+            self.prepare_gl_buffers(batch)
+
+        # the world-space boxes of the nodes, and the node of each batched instance
+        self.culler = FrustumCuller(scene)
+        for batch in self.batches:
+            batch.positions = numpy.array([self.culler.flat.position(node) for node, _ in batch.sources],
+                                          dtype=numpy.intp)
 
         # Finally release the model
         pyassimp.release(scene)
@@ -204,13 +216,13 @@ class GLRenderer():
         """
 
         if not hasattr(mat, "gl_mat"): # evaluate once the mat properties, and cache the values in a glDisplayList.
-            diffuse = numpy.array(mat.properties.get("diffuse", [0.8, 0.8, 0.8, 1.0]))
-            specular = numpy.array(mat.properties.get("specular", [0., 0., 0., 1.0]))
-            ambient = numpy.array(mat.properties.get("ambient", [0.2, 0.2, 0.2, 1.0]))
-            emissive = numpy.array(mat.properties.get("emissive", [0., 0., 0., 1.0]))
-            shininess = min(mat.properties.get("shininess", 1.0), 128)
-            wireframe = mat.properties.get("wireframe", 0)
-            twosided = mat.properties.get("twosided", 1)
+            diffuse = mat.diffuse if mat.diffuse is not None else numpy.array([0.8, 0.8, 0.8, 1.0])
+            specular = mat.specular if mat.specular is not None else numpy.array([0., 0., 0., 1.0])
+            ambient = mat.ambient if mat.ambient is not None else numpy.array([0.2, 0.2, 0.2, 1.0])
+            emissive = mat.emissive if mat.emissive is not None else numpy.array([0., 0., 0., 1.0])
+            shininess = min(mat.shininess if mat.shininess is not None else 1.0, 128)
+            wireframe = mat.properties.get(("wireframe", 0), 0)
+            twosided = mat.properties.get(("twosided", 0), 1)
 
             setattr(mat, "gl_mat", glGenLists(1))
             glNewList(mat.gl_mat, GL_COMPILE)
@@ -241,34 +253,42 @@ class GLRenderer():
         self.frames += 1
         if gl_time - self.prev_fps_time >= 1000:
             current_fps = self.frames * 1000 / (gl_time - self.prev_fps_time)
-            logger.info('%.0f fps' % current_fps)
+            logger.info('%.0f fps, %s' % (current_fps, self.culling))
             self.frames = 0
             self.prev_fps_time = gl_time
 
         glutPostRedisplay()
 
-    def recursive_render(self, node):
-        """ Main recursive rendering method.
+    def render_batches(self):
+        """ Main rendering method: one draw call per batch, or per range
+        of consecutive visible instances when some are culled.
         """
 
-        # save model matrix and apply node transformation
-        glPushMatrix()
-        m = node.transformation.transpose() # OpenGL row major
-        glMultMatrixf(m)
+        # the batches are in world space: cull against projection * modelview
+        projection = glGetFloatv(GL_PROJECTION_MATRIX).transpose()
+        modelview = glGetFloatv(GL_MODELVIEW_MATRIX).transpose()
+        self.culling = self.culler.cull(numpy.dot(projection, modelview))
+
+        for batch in self.batches:
+            visible = self.culling.visible[batch.positions]
+            if not visible.any():
+                continue
 
-        for mesh in node.meshes:
-            self.apply_material(mesh.material)
+            self.apply_material(batch.material)
 
-            glBindBuffer(GL_ARRAY_BUFFER, mesh.gl["vertices"])
+            glBindBuffer(GL_ARRAY_BUFFER, batch.gl["vertices"])
             glEnableClientState(GL_VERTEX_ARRAY)
-            glVertexPointer(3, GL_FLOAT, 0, None)
+            glVertexPointer(3, GL_FLOAT, batch.stride, None)
 
-            glBindBuffer(GL_ARRAY_BUFFER, mesh.gl["normals"])
             glEnableClientState(GL_NORMAL_ARRAY)
-            glNormalPointer(GL_FLOAT, 0, None)
+            glNormalPointer(GL_FLOAT, batch.stride, ctypes.c_void_p(3 * 4))
 
-            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, mesh.gl["triangles"])
-            glDrawElements(GL_TRIANGLES,len(mesh.faces) * 3, GL_UNSIGNED_INT, None)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, batch.gl["triangles"])
+            if visible.all():
+                glDrawElements(GL_TRIANGLES, len(batch.indices), GL_UNSIGNED_INT, None)
+            else:
+                for first, count in batch.ranges(visible):
+                    glDrawElements(GL_TRIANGLES, int(count), GL_UNSIGNED_INT, ctypes.c_void_p(4 * int(first)))
 
             glDisableClientState(GL_VERTEX_ARRAY)
             glDisableClientState(GL_NORMAL_ARRAY)
@@ -276,11 +296,6 @@ class GLRenderer():
             glBindBuffer(GL_ARRAY_BUFFER, 0)
             glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
-        for child in node.children:
-            self.recursive_render(child)
-
-        glPopMatrix()
-
 
     def display(self):
         """ GLUT callback to redraw OpenGL surface
@@ -288,7 +303,7 @@ class GLRenderer():
         glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
 
         glRotatef(self.angle,0.,1.,0.)
-        self.recursive_render(self.scene.rootnode)
+        self.render_batches()
 
         glutSwapBuffers()
         self.do_motion()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Measures the time taken by 'import pyassimp', in fresh interpreters.
+
+'import pyassimp' must stay cheap: the assimp library is only searched
+for, and numpy only imported, when they are first used. The script exits
+with an error if the import got slower than --max-ms (median of the runs),
+or if the import loaded numpy or the library:
+
+    $ python import_benchmark.py --runs 20 --max-ms 75
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, %r)
+start = time.time()
+import pyassimp
+elapsed = time.time() - start
+print(json.dumps({"ms": elapsed * 1000,
+                  "numpy": "numpy" in sys.modules,
+                  "library": "dll" in vars(pyassimp.core._assimp_lib)}))
+"""
+
+def measure(runs):
+    path = os.path.abspath(sys.path[0])
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", PROBE % path])
+        results.append(json.loads(output.decode("ascii").strip().splitlines()[-1]))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measures the time taken by 'import pyassimp'.")
+    parser.add_argument("--runs", type = int, default = 10)
+    parser.add_argument("--max-ms", type = float, default = 75., help = "maximum median import time")
+    args = parser.parse_args()
+
+    # the first run compiles the .pyc files
+    measure(1)
+    results = measure(args.runs)
+    times = sorted(r["ms"] for r in results)
+    median = times[len(times) // 2]
+    print("import pyassimp: median %.1fms, min %.1fms, max %.1fms (%d runs)" % (median, times[0], times[-1], len(times)))
+
+    errors = []
+    if median > args.max_ms:
+        errors.append("the import takes longer than %.1fms" % args.max_ms)
+    if any(r["numpy"] for r in results):
+        errors.append("numpy is imported by 'import pyassimp'")
+    if any(r["library"] for r in results):
+        errors.append("the assimp library is loaded by 'import pyassimp'")
+    for error in errors:
+        print("FAILED: " + error)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
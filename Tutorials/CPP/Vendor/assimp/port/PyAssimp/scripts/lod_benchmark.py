@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Benchmarks the generation of levels of detail (pyassimp.lod) on large
+meshes.
+
+Without a model, a UV sphere (with a texture seam and some noise) of the
+requested size is generated:
+
+    $ python lod_benchmark.py --triangles 2000000
+    $ python lod_benchmark.py ../../../test/models/PLY/Wuson.ply
+"""
+
+import sys
+import time
+import argparse
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+import numpy
+
+import pyassimp
+from pyassimp import postprocess
+from pyassimp.lod import DEFAULT_RATIOS, generate_lods
+from pyassimp.optimize import cache_statistics
+
+class Mesh(object):
+    """ The arrays of a generated mesh, as generate_lods() expects them. """
+    def __init__(self, vertices, texturecoords, indices):
+        self.name = "sphere"
+        self.vertices = vertices
+        self.texturecoords = texturecoords[numpy.newaxis]
+        self.indices = indices
+        self.faceoffsets = numpy.arange(0, len(indices) + 1, 3, dtype = numpy.uint32)
+
+    def __str__(self):
+        return self.name
+
+def sphere(triangles, noise = 0.01):
+    rows = max(2, int((triangles / 4.) ** .5))
+    theta = numpy.linspace(0, numpy.pi, rows + 1)[1:-1]
+    phi = numpy.linspace(0, 2 * numpy.pi, 2 * rows + 1)
+    t, p = numpy.meshgrid(theta, phi, indexing = 'ij')
+    radius = 1 + noise * numpy.random.RandomState(0).standard_normal(t.shape)
+    radius[:, -1] = radius[:, 0] # the seam
+    vertices = numpy.stack((radius * numpy.sin(t) * numpy.cos(p),
+                            radius * numpy.sin(t) * numpy.sin(p),
+                            radius * numpy.cos(t)), axis = -1).reshape((-1, 3))
+    uvs = numpy.stack((p / (2 * numpy.pi), t / numpy.pi, numpy.zeros_like(t)), axis = -1).reshape((-1, 3))
+
+    grid = numpy.arange(len(vertices)).reshape(t.shape)
+    a, b, c, d = grid[:-1, :-1].ravel(), grid[1:, :-1].ravel(), grid[:-1, 1:].ravel(), grid[1:, 1:].ravel()
+    tris = [numpy.stack((a, b, c), axis = 1), numpy.stack((c, b, d), axis = 1)]
+
+    # poles
+    poles = len(vertices) + numpy.arange(2 * rows)
+    vertices = numpy.concatenate((vertices, [[0, 0, 1]] * (2 * rows), [[0, 0, -1]] * (2 * rows)))
+    uvs = numpy.concatenate((uvs, [[(i + .5) / (2 * rows), 0, 0] for i in range(2 * rows)],
+                                  [[(i + .5) / (2 * rows), 1, 0] for i in range(2 * rows)]))
+    tris.append(numpy.stack((poles, grid[0, :-1], grid[0, 1:]), axis = 1))
+    tris.append(numpy.stack((poles + 2 * rows, grid[-1, 1:], grid[-1, :-1]), axis = 1))
+
+    indices = numpy.concatenate(tris).astype(numpy.uint32).ravel()
+    return Mesh(vertices.astype(numpy.float32), uvs.astype(numpy.float32), indices)
+
+def benchmark(mesh, ratios):
+    nb_triangles = len(mesh.indices) // 3
+    print("%s: %d vertices, %d triangles" % (mesh, len(mesh.vertices), nb_triangles))
+
+    start = time.time()
+    generate_lods(mesh, ratios, cache_optimize = False)
+    elapsed = time.time() - start
+
+    collapsed = nb_triangles - len(mesh.lods[-1]) // 3
+    print("  %.2fs, %d triangles removed per second" % (elapsed, collapsed / max(elapsed, 1e-9)))
+    # the levels go from the finest to the coarsest
+    for ratio, indices, error in zip(sorted(ratios, reverse = True), mesh.lods, mesh.loderrors):
+        print("  %5.1f%%: %9d triangles, error %.6f, ACMR %.3f" % (100 * ratio, len(indices) // 3, error,
+                                                                 cache_statistics(indices)[0]))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the generation of levels of detail.")
+    parser.add_argument("model", nargs = "?", help = "model to simplify (default: a generated sphere)")
+    parser.add_argument("--triangles", type = int, default = 1000000, help = "size of the generated sphere")
+    parser.add_argument("--ratios", type = float, nargs = "+", default = list(DEFAULT_RATIOS))
+    args = parser.parse_args()
+
+    if args.model is None:
+        benchmark(sphere(args.triangles), args.ratios)
+        return
+
+    scene = pyassimp.load(args.model, processing = postprocess.aiProcess_Triangulate | postprocess.aiProcess_JoinIdenticalVertices)
+    try:
+        for mesh in scene.meshes:
+            if len(mesh.indices) and (numpy.diff(mesh.faceoffsets) == 3).all():
+                benchmark(mesh, args.ratios)
+    finally:
+        pyassimp.release(scene)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+"""
+Checks the CPU picking of pyassimp.picking against brute-force ray casts,
+without opening a window.
+
+For a grid of pixels of every camera of a path, Picker.pick() must return
+the nearest triangle under the pixel: the rays are also tested against all
+the world-space triangles of the scene, one by one (plane intersection and
+edge tests, the world transformations being recomputed by walking the node
+hierarchy). Hits within a tolerance of an edge may go either way; the
+picked triangle must be hit at the returned distance, and the point must
+project back onto the pixel. Nodes are then moved at random with
+FlatScene.set_transformation(), and the picking must follow them.
+
+The cameras and the generated city come from culling_check.py:
+
+    $ python picking_check.py --frames 8 --pixels 32
+    $ python picking_check.py ../../../test/models/OBJ/spider.obj
+"""
+
+import sys
+import math
+import time
+import argparse
+
+# Make the development (ie. GIT repo) version of PyAssimp available for import.
+sys.path.insert(0, '..')
+
+import numpy
+
+import pyassimp
+from pyassimp.picking import Picker, screen_ray
+
+from culling_check import city, perspective, look_at, camera_path
+
+WIDTH, HEIGHT = 640, 480
+EPSILON = 1e-6
+
+def world_triangles(scene):
+    """ The world-space corners of all the triangles of the scene, as a
+    (T, 3, 3) array, and the position of each triangle in it by (node id,
+    mesh id, face). """
+    corners, sources = [], {}
+    stack = [(scene.rootnode, numpy.identity(4))]
+    while stack:
+        node, parent = stack.pop()
+        world = numpy.dot(parent, numpy.asarray(node.transformation, dtype = numpy.float64))
+        stack.extend((child, world) for child in node.children)
+        for mesh in node.meshes:
+            offsets = numpy.asarray(mesh.faceoffsets)
+            indices = numpy.asarray(mesh.indices)
+            vertices = numpy.dot(numpy.asarray(mesh.vertices, dtype = numpy.float64), world[:3, :3].T) + world[:3, 3]
+            for face, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                if end - start == 3:
+                    sources[(id(node), id(mesh), face)] = len(corners)
+                    corners.append(vertices[indices[start:end]])
+    return numpy.array(corners).reshape((-1, 3, 3)), sources
+
+def brute_force(corners, origin, direction):
+    """
+    The distances of the hits of a ray on all the triangles, as two
+    (T,) arrays: the hits inside the triangles by more than a tolerance
+    (certain), and the hits inside them or within the tolerance of an edge
+    (possible). The misses are at infinity.
+    """
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = numpy.einsum('ij,ij->i', normals, corners[:, 0] - origin) / numpy.dot(normals, direction)
+    point = origin + t[:, numpy.newaxis] * direction
+    length = numpy.sqrt(numpy.einsum('ij,ij->i', normals, normals))
+    tolerance = EPSILON * numpy.abs(corners).max(axis = (1, 2))
+
+    # the signed distances of the point to the edges, in the plane
+    inside = numpy.inf
+    for a, b in ((0, 1), (1, 2), (2, 0)):
+        edge = corners[:, b] - corners[:, a]
+        side = numpy.einsum('ij,ij->i', numpy.cross(edge, point - corners[:, a]), normals)
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            inside = numpy.fmin(inside, side / (length * numpy.sqrt(numpy.einsum('ij,ij->i', edge, edge))))
+
+    with numpy.errstate(invalid = 'ignore'):
+        valid = numpy.isfinite(t) & (t >= 0) & (t <= 1) & (length > tolerance ** 2)
+        certain = numpy.where(valid & (inside > 10 * tolerance), t, numpy.inf)
+        possible = numpy.where(valid & (inside > -10 * tolerance), t, numpy.inf)
+    return certain, possible
+
+def check(picker, corners, sources, projection, view, pixels):
+    """ Returns the number of pixels picked and the list of the errors of
+    the picking over a grid of pixels. """
+    hits, errors = 0, []
+    matrix = numpy.dot(projection, view)
+    for x in numpy.linspace(0, WIDTH - 1, pixels).astype(int):
+        for y in numpy.linspace(0, HEIGHT - 1, pixels).astype(int):
+            result = picker.pick(x, y, WIDTH, HEIGHT, projection, view)
+            origin, direction = screen_ray(x, y, WIDTH, HEIGHT, projection, view)
+            certain, possible = brute_force(corners, origin, direction)
+            tolerance = 1e-6 + 1e-4 * min(possible.min(), 1.)
+
+            if result is None:
+                if numpy.isfinite(certain.min()):
+                    errors.append("pixel (%d, %d): nothing picked, a triangle is hit at %g" % (x, y, certain.min()))
+                continue
+            hits += 1
+            if not possible.min() - tolerance <= result.distance <= certain.min() + tolerance:
+                errors.append("pixel (%d, %d): picked at %g, nearest hit at %g" % (
+                        x, y, result.distance, certain.min()))
+            picked = sources.get((id(result.node), id(result.mesh), result.face))
+            if picked is None or abs(possible[picked] - result.distance) > tolerance:
+                errors.append("pixel (%d, %d): %s is not hit at %g" % (x, y, result, result.distance))
+
+            # the hit point is under the pixel
+            point = numpy.dot(matrix, numpy.append(result.point, 1.))
+            window = ((point[:2] / point[3] + 1) / 2 * (WIDTH, HEIGHT)) - .5
+            if not numpy.allclose(window, (x, y), atol = 1e-3):
+                errors.append("pixel (%d, %d): the point of %s is at %s" % (x, y, result, window))
+    return hits, errors
+
+def move_nodes(picker, size, moves, rng):
+    """ Moves random nodes, as the viewers do. """
+    flat = picker.flat
+    for move in range(moves):
+        node = flat.nodes[rng.randint(len(flat.nodes))]
+        transformation = numpy.array(node.transformation, dtype = numpy.float64)
+        transformation[:3, 3] += .1 * size * rng.randn(3)
+        flat.set_transformation(node, transformation)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Checks the CPU picking against brute-force ray casts.")
+    parser.add_argument("model", nargs = "?", help = "model to load (default: a generated city)")
+    parser.add_argument("--frames", type = int, default = 8, help = "number of cameras of the orbit")
+    parser.add_argument("--pixels", type = int, default = 24, help = "pixels per side of the grid of each camera")
+    parser.add_argument("--fov", type = float, default = 70., help = "horizontal field of view, in degrees")
+    parser.add_argument("--districts", type = int, default = 4)
+    parser.add_argument("--buildings", type = int, default = 4, help = "buildings per district side")
+    parser.add_argument("--moves", type = int, default = 20, help = "number of random node moves")
+    args = parser.parse_args()
+
+    if args.model:
+        scene = pyassimp.load(args.model)
+    else:
+        scene = city(args.districts, args.buildings)
+
+    try:
+        picker = Picker(scene)
+        rng = numpy.random.RandomState(0)
+        failures = 0
+        elapsed = 0
+        for moved in (False, True):
+            if moved:
+                move_nodes(picker, numpy.linalg.norm(upper - lower), args.moves, rng)
+            corners, sources = world_triangles(scene)
+            lower, upper = corners.reshape((-1, 3)).min(axis = 0), corners.reshape((-1, 3)).max(axis = 0)
+            projection = perspective(math.radians(args.fov), WIDTH / float(HEIGHT), 1e-3 * numpy.linalg.norm(upper - lower),
+                                     10 * numpy.linalg.norm(upper - lower))
+            for frame, (eye, target) in enumerate(camera_path("orbit", lower, upper, args.frames)):
+                start = time.time()
+                hits, errors = check(picker, corners, sources, projection, look_at(eye, target), args.pixels)
+                elapsed += time.time() - start
+                print("camera %3d%s: %d pixels picked, %d errors" % (frame, " (moved nodes)" if moved else "",
+                                                                       hits, len(errors)))
+                for error in errors:
+                    print("  " + error)
+                failures += bool(errors)
+
+        print("%d cameras, %d pixels each, %d triangles, %d failed (%.1fs)" % (
+                2 * args.frames, args.pixels ** 2, len(corners), failures, elapsed))
+        return 1 if failures else 0
+    finally:
+        if args.model:
+            pyassimp.release(scene)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,7 @@ import sys
 sys.path.insert(0, '..')
 
 import sample
+import pyassimp
 from pyassimp import errors
 
 # Paths to model files.
@@ -49,5 +50,93 @@ def run_tests():
           % (ok, err))
 
 
+def check_empty_faces():
+    """ Meshes whose faces have no indices (LWO point and polyline
+    layers) must load, with empty index buffers. """
+    path = os.path.join(basepaths[0], 'LWO', 'LWO2', 'uvtest.lwo')
+    scene = pyassimp.load(path)
+    try:
+        empty = [mesh for mesh in scene.meshes if len(mesh.faces) and not len(mesh.indices)]
+        assert empty, "no mesh with empty faces in %s" % path
+        for mesh in empty:
+            assert not mesh.faceoffsets.any()
+            assert mesh.faces.shape == (len(mesh.faceoffsets) - 1, 0)
+        print('** Loaded %d meshes with empty faces from %s' % (len(empty), path))
+    finally:
+        pyassimp.release(scene)
+
+
+def check_released_arrays():
+    """ Arrays taken from a scene stay valid once the scene is released,
+    here by leaving a 'with' block. """
+    path = os.path.join(basepaths[0], 'OBJ', 'spider.obj')
+    with pyassimp.load(path) as scene:
+        vertices = scene.meshes[0].vertices
+        faces = scene.meshes[0].faces
+        expected = vertices.copy(), faces.copy()
+    # reuse the freed memory, if any
+    for _ in range(3):
+        with pyassimp.load(os.path.join(basepaths[0], 'OBJ', 'box.obj')):
+            pass
+        junk = [bytearray(b'\xff' * 4096) for _ in range(1000)]
+    assert (vertices == expected[0]).all() and (faces == expected[1]).all(), \
+        "arrays taken from %s changed after the scene was released" % path
+    print('** Arrays of %s still valid after release' % path)
+
+
+def check_optimize_released():
+    """ Optimizing the meshes of a released scene reorders their arrays,
+    not the memory of the scene (still viewed by the original arrays). """
+    from pyassimp.optimize import optimize_mesh
+    path = os.path.join(basepaths[0], 'Collada', 'duck.dae')
+    scene = pyassimp.load(path, processing = pyassimp.postprocess.aiProcess_Triangulate)
+    mesh = scene.meshes[0]
+    vertices = mesh.vertices
+    expected = vertices.copy()
+    pyassimp.release(scene, keep_arrays = False)
+    optimize_mesh(mesh)
+    assert (vertices == expected).all(), "the released memory of %s was written to" % path
+    assert sorted(map(tuple, mesh.vertices)) == sorted(map(tuple, expected))
+    print('** Optimized %s after release' % mesh)
+
+
+def check_file_objects():
+    """ File objects are left after the model once it is loaded, and the
+    import errors are not hidden by the memory-mapping of the file. """
+    path = os.path.join(basepaths[0], 'OBJ', 'spider.obj')
+    with open(path, 'rb') as f:
+        with pyassimp.load(f, file_type = 'obj') as scene:
+            assert f.tell() == os.path.getsize(path), "%s not read to the end" % path
+        try:
+            pyassimp.load(f, file_type = 'obj')
+        except errors.AssimpError:
+            pass
+        with open(path, 'rb') as model:
+            content = model.read()
+        with pyassimp.load(data = content, file_type = 'obj') as scene:
+            assert len(scene.meshes)
+    print('** Loaded %s from a file object and from its content' % path)
+
+
+def check_embedded_texture():
+    """ The data of compressed embedded textures is the original file,
+    as packed in the model. """
+    path = os.path.join(basepaths[0], 'BLEND', 'TexturedPlane_ImageUvPacked_248.blend')
+    with open(path, 'rb') as f:
+        content = f.read()
+    with pyassimp.load(path) as scene:
+        [texture] = scene.textures
+        data = bytes(bytearray(texture.data))
+        assert texture.compressed and texture.formathint == 'png', texture.formathint
+        assert data.startswith(b'\x89PNG\r\n\x1a\n') and data in content, \
+            "the embedded texture of %s does not match the packed PNG" % path
+    print('** Read the %d bytes PNG embedded in %s' % (len(data), path))
+
+
 if __name__ == '__main__':
+    check_empty_faces()
+    check_released_arrays()
+    check_optimize_released()
+    check_file_objects()
+    check_embedded_texture()
     run_tests()